@@ -0,0 +1,135 @@
+"""
+Offline benchmark of the sync engines against synthetic SQLite stand-ins.
+
+Usage:
+    python -m benchmarks.run --scales 10k,1m --engines positions,drives
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import SyntheticFleet
+from config.config import Config
+from database.probe import ENGINE_TABLES  # Source TeslaLogger table of each engine, used for rows/sec
+
+class BenchmarkConfig(Config):
+    """
+    Configuration pointing both databases at SQLite stand-in files.
+    """
+
+    def __init__(self, directory, workers=1):
+        super().__init__()
+        self.teslalogger_config = {'path': os.path.join(directory, 'teslalogger.db')}
+        self.teslamate_config = {'path': os.path.join(directory, 'teslamate.db')}
+        self.sync_config.update({
+            'dry_run': True,
+            'sync_workers': workers,
+            'checkpoint_path': os.path.join(directory, 'checkpoints.db'),
+            'full_resync': True,
+            'snapshot_dir': '',  # Always read the generated databases
+            'report_dir': '',  # Measure matching, not report compression
+        })
+
+    def get_database_connection_string(self, db_config):
+        # detect_types=1 parses TIMESTAMP columns into datetimes like the real drivers do
+        return f"sqlite:///{db_config['path']}?detect_types=1"
+
+def parse_scale(scale):
+    """
+    Turn '10k', '1m' or '10000' into a number of positions.
+    """
+    multipliers = {'k': 1000, 'm': 1000000}
+    scale = scale.strip().lower()
+    if scale[-1] in multipliers:
+        return int(float(scale[:-1]) * multipliers[scale[-1]])
+    return int(scale)
+
+def run_engine(directory, name, workers):
+    """
+    Run one engine end to end in this process and measure it.
+    """
+    # Imported here so the measured process only pays for what it uses
+    from database.checkpoints import CheckpointStore
+    from main import new_stats, run_engine as run_sync_engine
+
+    logging.basicConfig(level=logging.WARNING)
+    config = BenchmarkConfig(directory, workers)
+    checkpoints = CheckpointStore(config.sync_config['checkpoint_path'], full_resync=True)
+
+    stats = new_stats()[name]
+    started = time.monotonic()
+    duration, merges, error = run_sync_engine(name, config, stats, checkpoints)
+    elapsed = time.monotonic() - started
+    checkpoints.close()
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        'duration': duration,
+        'elapsed': elapsed,
+        'peak_rss_mb': peak_rss_mb,
+        'merges': merges,
+        'stats': stats,
+        'error': repr(error) if error else None,
+    }
+
+def benchmark(scale, engines, cars, sample_rate, clock_skew, gps_jitter, seed, workers):
+    """
+    Generate one scale of data and run every engine on it in a fresh process.
+    """
+    fleet = SyntheticFleet.for_positions(
+        scale, cars=cars, sample_rate=sample_rate, clock_skew=clock_skew,
+        gps_jitter=gps_jitter, seed=seed
+    )
+
+    with tempfile.TemporaryDirectory(prefix='tesla-sync-bench-') as directory:
+        started = time.monotonic()
+        counts = fleet.load(os.path.join(directory, 'teslalogger.db'), os.path.join(directory, 'teslamate.db'))
+        print(f"\nScale {scale:,} positions: {fleet.cars} car(s) x {fleet.days} day(s), "
+              f"generated in {time.monotonic() - started:.1f}s")
+        print(f"  Rows: {counts}")
+
+        context = multiprocessing.get_context('spawn')
+        for name in engines:
+            # A fresh process per engine keeps peak RSS attributable to that engine
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_engine, directory, name, workers).result()
+
+            rows = counts.get(ENGINE_TABLES[name], 0)
+            rate = rows / result['duration'] if result['duration'] else 0
+            print(f"  {name:<10} {result['duration']:8.2f}s  {rate:12,.0f} rows/s  "
+                  f"peak RSS {result['peak_rss_mb']:8.1f} MB  merges {result['merges']:,}  stats {result['stats']}")
+            if result['error']:
+                print(f"  {name:<10} failed: {result['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10k', help="Comma separated position counts, e.g. 10k,1m,10m")
+    parser.add_argument('--engines', default=','.join(ENGINE_TABLES), help="Comma separated engines to run")
+    parser.add_argument('--cars', type=int, default=1)
+    parser.add_argument('--sample-rate', type=int, default=1, help="Seconds between position samples")
+    parser.add_argument('--clock-skew', type=int, default=5, help="Max TeslaMate clock skew in seconds")
+    parser.add_argument('--gps-jitter', type=float, default=3, help="Max TeslaMate GPS jitter in meters")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help="SYNC_WORKERS for the position engine")
+    args = parser.parse_args()
+
+    engines = [name.strip() for name in args.engines.split(',') if name.strip()]
+    for name in engines:
+        if name not in ENGINE_TABLES:
+            parser.error(f"Unknown engine: {name}")
+
+    for scale in args.scales.split(','):
+        benchmark(parse_scale(scale), engines, args.cars, args.sample_rate,
+                  args.clock_skew, args.gps_jitter, args.seed, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import math
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111195.0
+
+# SQLite stand-ins for the TeslaLogger (MySQL) tables read by the sync engines
+TESLALOGGER_SCHEMA = [
+    """CREATE TABLE pos (
+        id INTEGER PRIMARY KEY, Datum TIMESTAMP, CarID INTEGER, lat REAL, lng REAL,
+        speed INTEGER, power INTEGER, odometer REAL, ideal_battery_range_km REAL,
+        battery_level INTEGER, outside_temp REAL, altitude REAL)""",
+    "CREATE INDEX pos_datum ON pos (Datum)",
+    """CREATE TABLE drivestate (
+        id INTEGER PRIMARY KEY, StartDate TIMESTAMP, StartPos INTEGER, EndDate TIMESTAMP,
+        EndPos INTEGER, CarID INTEGER, outside_temp_avg REAL, speed_max INTEGER,
+        power_max INTEGER, power_min INTEGER, power_avg REAL)""",
+    "CREATE INDEX drivestate_start ON drivestate (StartDate)",
+    """CREATE TABLE charging (
+        id INTEGER PRIMARY KEY, Datum TIMESTAMP, CarID INTEGER, battery_level INTEGER,
+        charge_energy_added REAL, charger_power INTEGER, ideal_battery_range_km REAL,
+        charger_voltage INTEGER, charger_phases INTEGER, charger_actual_current INTEGER)""",
+    "CREATE INDEX charging_datum ON charging (Datum)",
+    """CREATE TABLE state (
+        id INTEGER PRIMARY KEY, StartDate TIMESTAMP, EndDate TIMESTAMP, state TEXT,
+        StartPos INTEGER, EndPos INTEGER, CarID INTEGER)""",
+    "CREATE INDEX state_start ON state (StartDate)",
+]
+
+# SQLite stand-ins for the TeslaMate (PostgreSQL) tables read by the sync engines
+TESLAMATE_SCHEMA = [
+    """CREATE TABLE positions (
+        id INTEGER PRIMARY KEY, date TIMESTAMP, car_id INTEGER, latitude REAL, longitude REAL,
+        speed INTEGER, power INTEGER, odometer REAL, ideal_battery_range_km REAL,
+        battery_level INTEGER, elevation REAL, drive_id INTEGER)""",
+    "CREATE INDEX positions_date ON positions (date)",
+    """CREATE TABLE drives (
+        id INTEGER PRIMARY KEY, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER,
+        outside_temp_avg REAL, speed_max INTEGER, power_max INTEGER, power_min INTEGER,
+        start_km REAL, end_km REAL, distance REAL, duration_min INTEGER,
+        start_position_id INTEGER, end_position_id INTEGER)""",
+    "CREATE INDEX drives_start ON drives (start_date)",
+    """CREATE TABLE charging_processes (
+        id INTEGER PRIMARY KEY, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER,
+        charge_energy_added REAL, start_battery_level INTEGER, end_battery_level INTEGER,
+        duration_min INTEGER, cost REAL, position_id INTEGER)""",
+    "CREATE INDEX charging_processes_start ON charging_processes (start_date)",
+    """CREATE TABLE states (
+        id INTEGER PRIMARY KEY, state TEXT, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER)""",
+    "CREATE INDEX states_start ON states (start_date)",
+]
+
+class SyntheticFleet:
+    """
+    Seeded generator of matching TeslaLogger and TeslaMate histories.
+
+    Every car drives a few trips per day and charges overnight. TeslaMate
+    sees most TeslaLogger samples, some exactly and some with clock skew
+    and GPS jitter applied, so all match paths of the engines are exercised.
+    """
+
+    def __init__(self, cars=1, days=1, sample_rate=1, clock_skew=5, gps_jitter=3,
+                 coverage=0.95, exact_ratio=0.9, seed=42, start=datetime(2022, 1, 1)):
+        self.cars = cars
+        self.days = days
+        self.sample_rate = sample_rate  # seconds between position samples
+        self.clock_skew = clock_skew  # max seconds TeslaMate timestamps are shifted by
+        self.gps_jitter = gps_jitter  # max meters TeslaMate coordinates are shifted by
+        self.coverage = coverage  # share of TeslaLogger samples also present in TeslaMate
+        self.exact_ratio = exact_ratio  # share of covered samples that are exact duplicates
+        self.seed = seed
+        self.start = start
+
+    @classmethod
+    def for_positions(cls, positions, cars=1, sample_rate=1, **kwargs):
+        """
+        Size a fleet so that it produces roughly the given number of positions.
+        """
+        # Three trips of 30 minutes on average per car and day
+        per_day = 3 * 30 * 60 / sample_rate
+        days = max(1, math.ceil(positions / (cars * per_day)))
+        return cls(cars=cars, days=days, sample_rate=sample_rate, **kwargs)
+
+    def load(self, teslalogger_path, teslamate_path, chunk_size=50000):
+        """
+        Create both SQLite stand-ins and fill them with the generated history.
+
+        :return: Row counts per table
+        """
+        teslalogger = sqlite3.connect(teslalogger_path)
+        teslamate = sqlite3.connect(teslamate_path)
+        for statement in TESLALOGGER_SCHEMA:
+            teslalogger.execute(statement)
+        for statement in TESLAMATE_SCHEMA:
+            teslamate.execute(statement)
+
+        counts = {}
+        buffers = {}
+        for database, table, row in self._rows():
+            connection = teslalogger if database == 'teslalogger' else teslamate
+            buffer = buffers.setdefault((connection, table), [])
+            buffer.append(row)
+            counts[table] = counts.get(table, 0) + 1
+            if len(buffer) >= chunk_size:
+                self._insert(connection, table, buffer)
+
+        for (connection, table), buffer in buffers.items():
+            self._insert(connection, table, buffer)
+
+        for connection in (teslalogger, teslamate):
+            connection.commit()
+            connection.close()
+
+        return counts
+
+    def _insert(self, connection, table, rows):
+        if not rows:
+            return
+        columns = list(rows[0])
+        statement = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                     f"VALUES ({', '.join('?' for _ in columns)})")
+        connection.executemany(statement, [tuple(row[column] for column in columns) for row in rows])
+        rows.clear()
+
+    def _rows(self):
+        # Yield (database, table, row) in time order per car
+        rng = random.Random(self.seed)
+        ids = {}
+
+        def next_id(table):
+            ids[table] = ids.get(table, 0) + 1
+            return ids[table]
+
+        for car_id in range(1, self.cars + 1):
+            lat = 48.0 + rng.random() * 4
+            lng = 8.0 + rng.random() * 6
+            odometer = 10000.0 + rng.random() * 50000
+            battery = 80.0
+            state_start = self.start
+
+            for day in range(self.days):
+                midnight = self.start + timedelta(days=day)
+
+                for hour in (8, 13, 18):
+                    drive_start = midnight + timedelta(hours=hour, seconds=rng.randint(-1800, 1800))
+                    duration = rng.randint(15 * 60, 45 * 60)
+                    drive_end = drive_start + timedelta(seconds=duration)
+
+                    # Car was online or asleep until the drive started
+                    yield from self._state(next_id, car_id, state_start, drive_start, rng)
+
+                    heading = rng.random() * 2 * math.pi
+                    start_km = odometer
+                    speed_max = 0
+                    first_pos = None
+
+                    for offset in range(0, duration, self.sample_rate):
+                        timestamp = drive_start + timedelta(seconds=offset)
+                        speed = max(0, min(160, 50 + rng.gauss(0, 20)))
+                        step = speed / 3.6 * self.sample_rate
+                        heading += rng.gauss(0, 0.05)
+                        lat += step * math.cos(heading) / METERS_PER_DEGREE
+                        lng += step * math.sin(heading) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+                        odometer += step / 1000
+                        battery = max(5.0, battery - step / 1000 * 0.2)
+                        speed_max = max(speed_max, int(speed))
+                        power = int(speed * 0.4 + rng.gauss(0, 5))
+
+                        pos_id = next_id('pos')
+                        first_pos = first_pos or pos_id
+                        yield 'teslalogger', 'pos', {
+                            'id': pos_id, 'Datum': self._format(timestamp), 'CarID': car_id,
+                            'lat': round(lat, 6), 'lng': round(lng, 6), 'speed': int(speed), 'power': power,
+                            'odometer': round(odometer, 3), 'ideal_battery_range_km': round(battery * 4.5, 1),
+                            'battery_level': int(battery), 'outside_temp': 15.0, 'altitude': 250.0,
+                        }
+
+                        if rng.random() < self.coverage:
+                            tm_lat, tm_lng, tm_timestamp = round(lat, 6), round(lng, 6), timestamp
+                            if rng.random() >= self.exact_ratio:
+                                tm_timestamp += timedelta(seconds=rng.randint(-self.clock_skew, self.clock_skew))
+                                tm_lat += rng.uniform(-self.gps_jitter, self.gps_jitter) / METERS_PER_DEGREE
+                                tm_lng += rng.uniform(-self.gps_jitter, self.gps_jitter) / METERS_PER_DEGREE
+                            yield 'teslamate', 'positions', {
+                                'id': next_id('positions'), 'date': self._format(tm_timestamp), 'car_id': car_id,
+                                'latitude': tm_lat, 'longitude': tm_lng, 'speed': int(speed), 'power': power,
+                                'odometer': round(odometer, 3), 'ideal_battery_range_km': round(battery * 4.5, 1),
+                                'battery_level': int(battery), 'elevation': 250.0, 'drive_id': None,
+                            }
+
+                    distance = odometer - start_km
+                    yield 'teslalogger', 'drivestate', {
+                        'id': next_id('drivestate'), 'StartDate': self._format(drive_start), 'StartPos': first_pos,
+                        'EndDate': self._format(drive_end), 'EndPos': ids['pos'], 'CarID': car_id,
+                        'outside_temp_avg': 15.0, 'speed_max': speed_max, 'power_max': speed_max, 'power_min': -20,
+                        'power_avg': 20.0,
+                    }
+                    skew = timedelta(seconds=rng.randint(-self.clock_skew, self.clock_skew))
+                    yield 'teslamate', 'drives', {
+                        'id': next_id('drives'), 'start_date': self._format(drive_start + skew),
+                        'end_date': self._format(drive_end + skew), 'car_id': car_id, 'outside_temp_avg': 15.0,
+                        'speed_max': speed_max, 'power_max': speed_max, 'power_min': -20,
+                        'start_km': round(start_km, 3), 'end_km': round(odometer, 3), 'distance': round(distance, 3),
+                        'duration_min': duration // 60, 'start_position_id': None, 'end_position_id': None,
+                    }
+                    yield from self._state(next_id, car_id, drive_start, drive_end, rng, 'driving')
+                    state_start = drive_end
+
+                # Overnight charging session, sampled once a minute
+                charge_start = midnight + timedelta(hours=22, seconds=rng.randint(0, 1800))
+                charge_minutes = rng.randint(60, 180)
+                charge_end = charge_start + timedelta(minutes=charge_minutes)
+                yield from self._state(next_id, car_id, state_start, charge_start, rng)
+
+                start_battery = battery
+                energy = 0.0
+                for minute in range(charge_minutes):
+                    power = 11
+                    energy += power / 60
+                    battery = min(90.0, battery + power / 60 / 0.75)
+                    yield 'teslalogger', 'charging', {
+                        'id': next_id('charging'), 'Datum': self._format(charge_start + timedelta(minutes=minute)),
+                        'CarID': car_id, 'battery_level': int(battery), 'charge_energy_added': round(energy, 2),
+                        'charger_power': power, 'ideal_battery_range_km': round(battery * 4.5, 1),
+                        'charger_voltage': 230, 'charger_phases': 3, 'charger_actual_current': 16,
+                    }
+
+                skew = timedelta(seconds=rng.randint(-self.clock_skew, self.clock_skew))
+                yield 'teslamate', 'charging_processes', {
+                    'id': next_id('charging_processes'), 'start_date': self._format(charge_start + skew),
+                    'end_date': self._format(charge_end + skew), 'car_id': car_id,
+                    'charge_energy_added': round(energy, 2), 'start_battery_level': int(start_battery),
+                    'end_battery_level': int(battery), 'duration_min': charge_minutes, 'cost': None,
+                    'position_id': None,
+                }
+                yield from self._state(next_id, car_id, charge_start, charge_end, rng, 'charging')
+                state_start = charge_end
+
+    def _state(self, next_id, car_id, start, end, rng, state=None):
+        # Yield a TeslaLogger state and its TeslaMate counterpart
+        if end <= start:
+            return
+        state = state or rng.choice(['online', 'asleep'])
+        yield 'teslalogger', 'state', {
+            'id': next_id('state'), 'StartDate': self._format(start), 'EndDate': self._format(end),
+            'state': state, 'StartPos': None, 'EndPos': None, 'CarID': car_id,
+        }
+        yield 'teslamate', 'states', {
+            'id': next_id('states'), 'state': state, 'start_date': self._format(start),
+            'end_date': self._format(end), 'car_id': car_id,
+        }
+
+    def _format(self, timestamp):
+        return timestamp.isoformat(sep=' ')
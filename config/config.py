@@ -11,6 +11,9 @@ class Config:
         self.teslalogger_config = self._get_teslalogger_config()
         self.teslamate_config = self._get_teslamate_config()
 
+        # Connection pool settings shared by both databases
+        self.pool_config = self._get_pool_config()
+
         # Sync Configurations
         self.sync_config = self._get_sync_config()
 
@@ -40,6 +43,17 @@ class Config:
             'dialect': 'postgresql+psycopg2'
         }
 
+    def _get_pool_config(self):
+        """
+        Retrieve connection pool configuration
+        """
+        return {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),  # connections kept open per database
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),  # extra connections under load
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),  # seconds before a connection is replaced
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),  # seconds to wait for a free connection
+        }
+
     def _get_sync_config(self):
         """
         Retrieve sync-specific configurations
@@ -48,6 +62,7 @@ class Config:
             # Proximity settings for matching records
             'position_time_window': int(os.getenv('POSITION_TIME_WINDOW', 30)),  # seconds
             'position_distance_threshold': float(os.getenv('POSITION_DISTANCE_THRESHOLD', 10)),  # meters
+            'teslalogger_timezone': os.getenv('TESLALOGGER_TIMEZONE', ''),  # zone of TeslaLogger's local timestamps, e.g. Europe/Berlin, empty for UTC
             
             # Logging configurations
             'log_level': os.getenv('LOG_LEVEL', 'INFO'),
@@ -61,6 +76,57 @@ class Config:
             # Limits
             'position_limit': int(os.getenv('POSITION_LIMIT', 0)),
 
+            # Position range scan settings
+            'position_partition_hours': int(os.getenv('POSITION_PARTITION_HOURS', 24)),  # hours per partition
+            'position_fetch_batch_size': int(os.getenv('POSITION_FETCH_BATCH_SIZE', 10000)),  # rows per round-trip
+            'sync_workers': int(os.getenv('SYNC_WORKERS', 1)),  # processes matching position partitions
+            'position_fingerprints': os.getenv('POSITION_FINGERPRINTS', '1') == '1',  # skip days unchanged since the last run
+            'position_staging': os.getenv('POSITION_STAGING', '0') == '1',  # remove exact duplicates inside TeslaMate
+
+            # Per-car work units, each query reads a single car
+            'partition_by_car': os.getenv('PARTITION_BY_CAR', '1') == '1',
+            'car_id_map': os.getenv('CAR_ID_MAP', ''),  # TeslaLogger:TeslaMate car ids where they differ, e.g. 1:2,2:3
+
+            # Drive, charging and state keyset pagination
+            'fetch_page_size': int(os.getenv('FETCH_PAGE_SIZE', 1000)),  # rows per page
+            'drive_from_positions': os.getenv('DRIVE_FROM_POSITIONS', '0') == '1',  # rebuild drive aggregates from pos in one pass
+
+            # Skip engines with no TeslaLogger rows past their watermarks, probed before connecting
+            'fast_exit': os.getenv('FAST_EXIT', '1') == '1',
+
+            # Run the enabled engines concurrently, each with its own connections
+            'parallel_engines': os.getenv('PARALLEL_ENGINES', '0') == '1',
+
+            # Bulk write settings (DRYRUN=0)
+            'write_batch_size': int(os.getenv('WRITE_BATCH_SIZE', 5000)),  # rows per write transaction
+
+            # Incremental sync checkpoints
+            'checkpoint_path': os.getenv('CHECKPOINT_PATH', 'logs/checkpoints.db'),
+            'checkpoint_lookback_hours': int(os.getenv('CHECKPOINT_LOOKBACK_HOURS', 24)),  # hours re-read behind each watermark
+            'full_resync': os.getenv('FULL_RESYNC', '0') == '1',
+
+            # Local TeslaLogger snapshot, empty to read TeslaLogger directly
+            'snapshot_dir': os.getenv('SNAPSHOT_DIR', ''),
+            'snapshot_refresh': os.getenv('SNAPSHOT_REFRESH', '1') == '1',  # copy changed partitions before syncing
+
+            # Dry-run merge candidate reports, empty to disable
+            'report_dir': os.getenv('REPORT_DIR', 'logs/reports'),
+            'report_format': os.getenv('REPORT_FORMAT', 'jsonl').lower(),  # jsonl or csv, gzip compressed
+            'report_sample_every': int(os.getenv('REPORT_SAMPLE_EVERY', 1)),  # write every Nth candidate
+            'report_log_every': int(os.getenv('REPORT_LOG_EVERY', 0)),  # also log every Nth candidate, 0 disables
+            'report_buffer_size': int(os.getenv('REPORT_BUFFER_SIZE', 1000)),  # candidates buffered per write
+
+            # Run metrics export, empty to disable
+            'metrics_json_path': os.getenv('METRICS_JSON_PATH', ''),
+            'metrics_prometheus_path': os.getenv('METRICS_PROMETHEUS_PATH', ''),  # node_exporter textfile collector file
+
+            # Profiling
+            'profile': os.getenv('PROFILE', '0') == '1',  # cProfile each engine's sync()
+            'profile_engines': [name.strip() for name in os.getenv('PROFILE_ENGINE', '').split(',') if name.strip()],  # empty profiles all
+            'profile_memory': os.getenv('PROFILE_MEMORY', '0') == '1',  # also trace allocations with tracemalloc
+            'profile_dir': os.getenv('PROFILE_DIR', 'logs/profiles'),
+            'profile_sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', 0)),  # fraction of matcher/fetcher calls timed
+
             # Test and validation flags
             'test_position': os.getenv('TEST_POSITION', '0') == '1',
             'dry_run': os.getenv('DRYRUN', '1') == '1'
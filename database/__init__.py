@@ -1,7 +1,27 @@
-from .teslalogger_connection import establish_teslalogger_connection
-from .teslamate_connection import establish_teslamate_connection
+import importlib
 
-__all__ = [
-    'establish_teslalogger_connection',
-    'establish_teslamate_connection'
-]
+# Exported name -> submodule defining it. Submodules are imported on first
+# access, so importing one light module does not load SQLAlchemy and the database drivers.
+_EXPORTS = {
+    'establish_teslalogger_connection': 'teslalogger_connection',
+    'establish_teslamate_connection': 'teslamate_connection',
+    'CheckpointStore': 'checkpoints',
+    'TeslaMateWriter': 'teslamate_writer',
+    'keyset_pages': 'pagination',
+    'PoolManager': 'pool',
+    'get_pool_manager': 'pool',
+    'stream_options': 'pool',
+    'TeslaLoggerSnapshot': 'snapshot',
+    'refresh_snapshot': 'snapshot',
+    'ENGINE_TABLES': 'probe',
+    'teslalogger_max_ids': 'probe',
+    'resolve_car_map': 'cars',
+    'parse_car_map': 'cars',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
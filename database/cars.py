@@ -0,0 +1,89 @@
+import logging
+from sqlalchemy import text
+
+def parse_car_map(value):
+    """
+    Parse CAR_ID_MAP, e.g. '1:2,2:3', into {TeslaLogger CarID: TeslaMate car_id}.
+    """
+    mapping = {}
+    for pair in value.split(','):
+        if pair.strip():
+            teslalogger_car, teslamate_car = pair.split(':')
+            mapping[int(teslalogger_car)] = int(teslamate_car)
+    return mapping
+
+def resolve_car_map(teslalogger_conn, teslamate_conn, checkpoints=None, overrides=None):
+    """
+    Return {TeslaLogger CarID: TeslaMate car_id} for every known TeslaLogger car.
+
+    Cars are paired by VIN from the cars tables of both databases and the
+    pairs are cached in the checkpoint store, so TeslaMate is only asked
+    again once TeslaLogger reports a car with a VIN the cache does not know.
+    Cars without a VIN pairing keep their id and are not cached, and the
+    cached pairs are used when the TeslaLogger cars cannot be read.
+    Explicit overrides always win.
+    """
+    logger = logging.getLogger(__name__)
+    overrides = overrides or {}
+
+    teslalogger_vins = _vins(teslalogger_conn, "SELECT id, vin FROM cars")
+    cached = checkpoints.car_map() if checkpoints else {}
+
+    if not teslalogger_vins:
+        # TeslaLogger cars could not be read, fall back to the cached pairs
+        mapping = dict(cached)
+    elif all(car_id in cached for car_id, vin in teslalogger_vins.items() if vin):
+        mapping = {car_id: cached.get(car_id, car_id) for car_id in teslalogger_vins}
+    else:
+        teslamate_cars = {vin: car_id for car_id, vin in _vins(teslamate_conn, "SELECT id, vin FROM cars").items() if vin}
+        paired = {car_id: teslamate_cars[vin] for car_id, vin in teslalogger_vins.items() if vin in teslamate_cars}
+        # Without TeslaMate cars to pair with, the cached pairs still apply
+        known = paired if teslamate_cars else cached
+        mapping = {car_id: known.get(car_id, car_id) for car_id in teslalogger_vins}
+        if checkpoints and paired:
+            checkpoints.save_car_map(paired)
+
+    mapping.update(overrides)
+    remapped = {car_id: target for car_id, target in mapping.items() if car_id != target}
+    logger.info(f"Car mapping: {len(mapping)} TeslaLogger car(s), remapped {remapped or 'none'}")
+    return mapping
+
+def teslalogger_cars(conn, table):
+    """
+    Return the distinct CarIDs of a TeslaLogger table, in ascending order.
+
+    Rows without a CarID belong to no car and are logged as skipped.
+    """
+    cars = [row[0] for row in conn.execute(text(f"SELECT DISTINCT CarID FROM {table}"))]
+    if None in cars:
+        skipped = conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE CarID IS NULL")).scalar()
+        logging.getLogger(__name__).warning(f"Skipping {skipped} TeslaLogger {table} row(s) without a CarID")
+    return sorted(car_id for car_id in cars if car_id is not None)
+
+def car_predicate(where, params, column, car_id):
+    """
+    Narrow a SQL predicate to one car, unchanged when car_id is None.
+    """
+    if car_id is None:
+        return where, params
+    return f"{where} AND {column} = :car_id", {**params, 'car_id': car_id}
+
+def map_car_ids(pages, key, cars):
+    """
+    Rewrite the TeslaLogger car of every record in a page stream to its TeslaMate car.
+    """
+    for page in pages:
+        if cars:
+            for record in page:
+                record[key] = cars.get(record[key], record[key])
+        yield page
+
+def _vins(conn, query):
+    # {id: vin} from a cars table, {} when the database has none
+    logger = logging.getLogger(__name__)
+    try:
+        return {row.id: getattr(row, 'vin', None) for row in conn.execute(text(query))}
+    except Exception as e:
+        logger.info(f"No cars table to pair cars by VIN, keeping car ids: {e}")
+        conn.rollback()
+        return {}
@@ -0,0 +1,210 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+class CheckpointStore:
+    """
+    Persistent per-engine, per-car high-water marks stored in a local SQLite file.
+
+    Each engine records the highest TeslaLogger id and timestamp it has
+    processed for every CarID. The next run only fetches rows from that
+    timestamp minus the lookback overlap, so late-arriving rows are still seen.
+    Per-(car, day) fingerprints of reconciled days are cached alongside.
+    """
+
+    def __init__(self, path, full_resync=False, lookback_hours=24):
+        self.path = path
+        self.full_resync = full_resync  # Ignore stored marks when reading, still record new ones
+        self.lookback = timedelta(hours=lookback_hours)
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.pending = {}  # engine -> {car_id: (last_id, last_date)}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            "engine TEXT NOT NULL, "
+            "car_id INTEGER NOT NULL, "
+            "last_id INTEGER, "
+            "last_date TEXT, "
+            "updated_at TEXT, "
+            "PRIMARY KEY (engine, car_id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "engine TEXT NOT NULL, "
+            "side TEXT NOT NULL, "
+            "car_id INTEGER NOT NULL, "
+            "day TEXT NOT NULL, "
+            "fingerprint TEXT NOT NULL, "
+            "updated_at TEXT, "
+            "PRIMARY KEY (engine, side, car_id, day))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS car_map ("
+            "teslalogger_car_id INTEGER PRIMARY KEY, "
+            "teslamate_car_id INTEGER NOT NULL, "
+            "updated_at TEXT)"
+        )
+        self.conn.commit()
+
+    def get(self, engine):
+        """
+        Return the stored {car_id: (last_id, last_date)} marks for an engine.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT car_id, last_id, last_date FROM watermarks WHERE engine = ?", (engine,)
+            ).fetchall()
+
+        return {
+            car_id: (last_id, datetime.fromisoformat(last_date) if last_date else None)
+            for car_id, last_id, last_date in rows
+        }
+
+    def since(self, engine):
+        """
+        Return {car_id: timestamp} to resume reading from, or {} for a full read.
+        """
+        if self.full_resync:
+            return {}
+
+        return {
+            car_id: last_date - self.lookback
+            for car_id, (_, last_date) in self.get(engine).items()
+            if last_date is not None
+        }
+
+    def earliest(self, engine, car_id=None):
+        """
+        Return the oldest resume timestamp across all cars, or of one car, or None for a full read.
+        """
+        since = self.since(engine)
+        if car_id is not None:
+            return since.get(car_id)
+        if not since:
+            return None
+        return min(since.values())
+
+    def where_clause(self, engine, car_column, date_column):
+        """
+        Build a SQL predicate selecting only rows past each car's watermark.
+
+        Cars without a watermark, and rows without a car, are always selected in full.
+        """
+        since = self.since(engine)
+        if not since:
+            return "1 = 1", {}
+
+        params = {}
+        placeholders = []
+        clauses = []
+        for i, (car_id, timestamp) in enumerate(sorted(since.items())):
+            params[f'wm_car_{i}'] = car_id
+            params[f'wm_since_{i}'] = timestamp
+            placeholders.append(f":wm_car_{i}")
+            clauses.append(f"({car_column} = :wm_car_{i} AND {date_column} >= :wm_since_{i})")
+
+        # NOT IN is never true for a NULL car, so those rows need their own branch
+        clauses.insert(0, f"{car_column} NOT IN ({', '.join(placeholders)}) OR {car_column} IS NULL")
+        return "(" + " OR ".join(clauses) + ")", params
+
+    def track(self, engine, car_id, row_id, timestamp):
+        """
+        Remember a processed TeslaLogger row. Nothing is persisted until commit().
+        """
+        if car_id is None or timestamp is None:
+            return
+
+        with self.lock:
+            marks = self.pending.setdefault(engine, {})
+            last_id, last_date = marks.get(car_id, (None, None))
+            if row_id is not None and (last_id is None or row_id > last_id):
+                last_id = row_id
+            if last_date is None or timestamp > last_date:
+                last_date = timestamp
+            marks[car_id] = (last_id, last_date)
+
+    def commit(self, engine):
+        """
+        Persist the tracked marks of an engine, never moving a watermark backwards.
+        """
+        with self.lock:
+            marks = self.pending.pop(engine, {})
+            now = datetime.utcnow().isoformat()
+            for car_id, (last_id, last_date) in marks.items():
+                self.conn.execute(
+                    "INSERT INTO watermarks (engine, car_id, last_id, last_date, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (engine, car_id) DO UPDATE SET "
+                    "last_id = MAX(COALESCE(last_id, excluded.last_id), COALESCE(excluded.last_id, last_id)), "
+                    "last_date = MAX(COALESCE(last_date, excluded.last_date), excluded.last_date), "
+                    "updated_at = excluded.updated_at",
+                    (engine, car_id, last_id, last_date.isoformat(), now)
+                )
+            self.conn.commit()
+
+        if marks:
+            self.logger.info(f"Advanced {engine} watermarks for {len(marks)} car(s)")
+
+    def fingerprints(self, engine):
+        """
+        Return the cached {(side, car_id, day): fingerprint} of an engine, or {} for a full read.
+        """
+        if self.full_resync:
+            return {}
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT side, car_id, day, fingerprint FROM fingerprints WHERE engine = ?", (engine,)
+            ).fetchall()
+
+        return {(side, car_id, day): fingerprint for side, car_id, day, fingerprint in rows}
+
+    def save_fingerprints(self, engine, fingerprints):
+        """
+        Cache {(side, car_id, day): fingerprint} of days reconciled by a successful run.
+        """
+        with self.lock:
+            now = datetime.utcnow().isoformat()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (engine, side, car_id, day, fingerprint, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(engine, side, car_id, day, fingerprint, now)
+                 for (side, car_id, day), fingerprint in fingerprints.items()]
+            )
+            self.conn.commit()
+
+        if fingerprints:
+            self.logger.info(f"Cached {len(fingerprints)} {engine} day fingerprints")
+
+    def car_map(self):
+        """
+        Return the cached {TeslaLogger CarID: TeslaMate car_id} mapping.
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT teslalogger_car_id, teslamate_car_id FROM car_map").fetchall()
+        return dict(rows)
+
+    def save_car_map(self, mapping):
+        """
+        Replace the cached car mapping.
+        """
+        with self.lock:
+            now = datetime.utcnow().isoformat()
+            self.conn.execute("DELETE FROM car_map")
+            self.conn.executemany(
+                "INSERT INTO car_map (teslalogger_car_id, teslamate_car_id, updated_at) VALUES (?, ?, ?)",
+                [(teslalogger_car, teslamate_car, now) for teslalogger_car, teslamate_car in mapping.items()]
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
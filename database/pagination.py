@@ -0,0 +1,49 @@
+import logging
+from sqlalchemy import text
+
+def keyset_pages(conn, table, key_columns, where="1 = 1", params=None, page_size=1000):
+    """
+    Stream a table in pages ordered by (sort column, id) using keyset pagination.
+
+    Every page resumes strictly after the last key of the previous one, so
+    each query is an index range scan no matter how deep into the table it
+    is, unlike OFFSET. Rows with a NULL sort column are never returned.
+
+    :param conn: Session or connection to run the queries on
+    :param table: Table to read
+    :param key_columns: (sort column, unique tie-breaker column), e.g. ('StartDate', 'id')
+    :param where: Additional SQL predicate, combined with AND
+    :param params: Bind parameters of the predicate
+    :param page_size: Rows per page
+    :return: Generator of non-empty lists of rows
+    """
+    logger = logging.getLogger(__name__)
+    sort_column, id_column = key_columns
+    params = dict(params or {})
+    order = f"ORDER BY {sort_column}, {id_column} LIMIT :page_size"
+
+    first_page = text(f"SELECT * FROM {table} WHERE {sort_column} IS NOT NULL AND {where} {order}")
+    next_page = text(
+        f"SELECT * FROM {table} WHERE ({sort_column}, {id_column}) > (:last_sort, :last_id) "
+        f"AND {where} {order}"
+    )
+
+    query = first_page
+    pages = 0
+    while True:
+        rows = conn.execute(query, {**params, 'page_size': page_size}).fetchall()
+        if not rows:
+            break
+
+        pages += 1
+        yield rows
+
+        if len(rows) < page_size:
+            break
+
+        last = rows[-1]._mapping
+        params['last_sort'] = last[sort_column]
+        params['last_id'] = last[id_column]
+        query = next_page
+
+    logger.debug(f"Read {table} in {pages} page(s) of up to {page_size} rows")
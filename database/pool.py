@@ -0,0 +1,173 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from utils.metrics import count_round_trip
+from .probe import SNAPSHOT_FILE
+
+# Display names of the configured databases
+DATABASE_LABELS = {
+    'teslalogger': 'TeslaLogger',
+    'teslamate': 'TeslaMate',
+    'snapshot': 'TeslaLogger snapshot',
+}
+
+# Execution options for bulk reads: server-side cursors (psycopg2 named
+# cursors, PyMySQL SSCursor) fetched in chunks instead of buffering the result
+def stream_options(batch_size):
+    return {'stream_results': True, 'yield_per': batch_size}
+
+class PoolMetrics:
+    """
+    Thread-safe counters of pool checkouts and the time spent waiting for them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+                'wait_seconds_avg': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records the checkout wait time of every connection.
+    """
+
+    metrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record(time.perf_counter() - started)
+
+    def recreate(self):
+        # Keep counting across dispose() and invalidation
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class PoolManager:
+    """
+    Builds one pooled engine per database and hands out short-lived sessions.
+
+    Engines are created on first use with the configured pool_size,
+    max_overflow, pool_recycle and pool_timeout, and are shared by every
+    sync engine and thread of the process. Worker processes build their
+    own manager.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.engines = {}
+        self.sessionmakers = {}
+        self.metrics = {}
+        self.first_query_at = None  # time.monotonic() of the first statement sent by this process
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def engine(self, name):
+        """
+        Return the shared engine of a database ('teslalogger', 'teslamate' or 'snapshot').
+        """
+        with self.lock:
+            if name not in self.engines:
+                self.engines[name] = self._create_engine(name)
+                self.sessionmakers[name] = sessionmaker(bind=self.engines[name])
+            return self.engines[name]
+
+    def session(self, name):
+        """
+        Open a new session on the shared engine of a database. Close it when done.
+        """
+        self.engine(name)
+        return self.sessionmakers[name]()
+
+    def metrics_snapshot(self):
+        """
+        Return {database: checkout metrics} for every engine created so far.
+        """
+        with self.lock:
+            return {name: metrics.snapshot() for name, metrics in self.metrics.items()}
+
+    def dispose(self):
+        with self.lock:
+            for engine in self.engines.values():
+                engine.dispose()
+
+    def _create_engine(self, name):
+        pool_config = self.config.pool_config
+        connect_args = {}
+
+        if name == 'snapshot':
+            # Local TeslaLogger copy, declared column types are converted back to datetimes
+            directory = self.config.sync_config['snapshot_dir']
+            os.makedirs(directory, exist_ok=True)
+            connection_string = f"sqlite:///{os.path.join(directory, SNAPSHOT_FILE)}"
+            connect_args = {'detect_types': sqlite3.PARSE_DECLTYPES, 'check_same_thread': False}
+        else:
+            # Use the method from config to generate connection string
+            db_config = getattr(self.config, f'{name}_config')
+            connection_string = self.config.get_database_connection_string(db_config)
+
+        engine = create_engine(
+            connection_string,
+            connect_args=connect_args,
+            poolclass=TimedQueuePool,
+            pool_pre_ping=True,
+            pool_size=pool_config['pool_size'],
+            max_overflow=pool_config['max_overflow'],
+            pool_recycle=pool_config['pool_recycle'],
+            pool_timeout=pool_config['pool_timeout'],
+        )
+        metrics = PoolMetrics()
+        engine.pool.metrics = metrics
+        self.metrics[name] = metrics
+
+        # Every statement counts as a round-trip of the phase running it
+        event.listen(engine, 'before_cursor_execute', count_round_trip)
+
+        if self.first_query_at is None:
+            self.first_query_at = time.monotonic()
+
+        # Test connection
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            self.logger.info(f"{DATABASE_LABELS.get(name, name)} Database Connection Successful")
+
+        return engine
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_pool_manager(config):
+    """
+    Return the process-wide pool manager for a configuration.
+    """
+    global _manager
+
+    with _manager_lock:
+        if _manager is None or _manager.config is not config:
+            _manager = PoolManager(config)
+        return _manager
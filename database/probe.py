@@ -0,0 +1,77 @@
+import logging
+import os
+import sqlite3
+
+# SQLite file holding the TeslaLogger snapshot inside SNAPSHOT_DIR
+SNAPSHOT_FILE = 'teslalogger.sqlite'
+
+# TeslaLogger table read by each sync engine
+ENGINE_TABLES = {
+    'positions': 'pos',
+    'drives': 'drivestate',
+    'charging': 'charging',
+    'states': 'state',
+}
+
+def engine_table(name, sync_config):
+    """
+    Return the TeslaLogger table whose ids an engine's watermarks record.
+
+    Drives rebuilt from positions (DRIVE_FROM_POSITIONS=1) follow pos.
+    """
+    if name == 'drives' and sync_config.get('drive_from_positions'):
+        return 'pos'
+    return ENGINE_TABLES[name]
+
+def teslalogger_max_ids(config, tables):
+    """
+    Return {table: highest id} of TeslaLogger tables, or None when they cannot be probed.
+
+    Uses the plain DB-API driver instead of SQLAlchemy, so a run with nothing
+    to do never pays for importing it. With SNAPSHOT_REFRESH=0 the snapshot
+    is probed, as that is what the engines read.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        connection = _connect(config)
+    except Exception as e:
+        logger.warning(f"Could not probe TeslaLogger for new rows: {e}")
+        return None
+
+    if connection is None:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        max_ids = {}
+        for table in tables:
+            # MAX of the primary key is answered from the index
+            cursor.execute(f"SELECT MAX(id) FROM {table}")
+            max_ids[table] = cursor.fetchone()[0]
+        cursor.close()
+        return max_ids
+    except Exception as e:
+        logger.warning(f"Could not probe TeslaLogger for new rows: {e}")
+        return None
+    finally:
+        connection.close()
+
+def _connect(config):
+    sync_config = config.sync_config
+    if sync_config['snapshot_dir'] and not sync_config['snapshot_refresh']:
+        path = os.path.join(sync_config['snapshot_dir'], SNAPSHOT_FILE)
+        return sqlite3.connect(path) if os.path.exists(path) else None
+
+    db_config = config.teslalogger_config
+    if db_config.get('dialect') != 'mysql+pymysql':
+        return None
+
+    import pymysql
+    return pymysql.connect(
+        host=db_config['host'],
+        port=int(db_config['port']),
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['database'],
+        connect_timeout=10,
+    )
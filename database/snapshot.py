@@ -0,0 +1,317 @@
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import inspect, text
+from sqlalchemy import types as sqltypes
+from .pool import get_pool_manager, stream_options
+
+# TeslaLogger tables read by the sync engines and the timestamp column partitioning each
+SNAPSHOT_TABLES = {
+    'pos': 'Datum',
+    'drivestate': 'StartDate',
+    'charging': 'Datum',
+    'state': 'StartDate',
+}
+
+# Column TeslaLogger fills in once an interval closes, rows still open are updated in place
+OPEN_COLUMNS = {
+    'drivestate': 'EndDate',
+    'state': 'EndDate',
+}
+
+# Small TeslaLogger tables copied whole on every refresh
+WHOLE_TABLES = ['cars']
+
+# Month ('YYYY-MM') of a timestamp column per source dialect
+MONTH_EXPRESSIONS = {
+    'mysql': "DATE_FORMAT({column}, '%Y-%m')",
+    'postgresql': "to_char({column}, 'YYYY-MM')",
+    'sqlite': "strftime('%Y-%m', {column})",
+}
+
+class TeslaLoggerSnapshot:
+    """
+    Local SQLite copy of the TeslaLogger tables, refreshed per car and month.
+
+    Every (table, car, month) partition is summarised at the source by row
+    count and highest id with one grouped query. Older partitions are only
+    copied again when their summary changed. The newest month of every car,
+    which TeslaLogger still appends to, is topped up with the rows past the
+    stored highest id and the intervals that were still open, and only
+    copied in full when the counts then disagree. Small tables like cars are
+    copied whole. The snapshot keeps the source table and column names, so
+    the sync engines read it like TeslaLogger itself.
+    """
+
+    def __init__(self, snapshot_engine, batch_size=10000):
+        self.engine = snapshot_engine
+        self.batch_size = batch_size  # Rows per streamed read and insert
+        self.logger = logging.getLogger(__name__)
+
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS snapshot_partitions ("
+                "source_table TEXT NOT NULL, "
+                "car_id INTEGER NOT NULL, "
+                "month TEXT NOT NULL, "
+                "row_count INTEGER, "
+                "max_id INTEGER, "
+                "refreshed_at TEXT, "
+                "PRIMARY KEY (source_table, car_id, month))"
+            ))
+
+    def refresh(self, source_conn, tables=None):
+        """
+        Bring the snapshot up to date with the TeslaLogger database.
+
+        :param source_conn: Session on the TeslaLogger database
+        :param tables: {table: timestamp column}, defaults to SNAPSHOT_TABLES
+        :return: {table: number of partitions copied}
+        """
+        refreshed = {}
+        for table, date_column in (tables or SNAPSHOT_TABLES).items():
+            refreshed[table] = self._refresh_table(source_conn, table, date_column)
+        if tables is None:
+            for table in WHOLE_TABLES:
+                refreshed[table] = self._refresh_whole_table(source_conn, table)
+        return refreshed
+
+    def _refresh_table(self, source_conn, table, date_column):
+        columns = self._ensure_table(source_conn, table, date_column)
+
+        source = self._source_partitions(source_conn, table, date_column)
+        local = self._local_partitions(table)
+
+        newest = {}
+        for car_id, month in source:
+            newest[car_id] = max(newest.get(car_id, month), month)
+
+        removed = [key for key in local if key not in source]
+        for car_id, month in removed:
+            with self.engine.begin() as connection:
+                self._delete_partition(connection, table, date_column, car_id, month)
+
+        refreshed = 0
+        for key in sorted(source):
+            car_id, month = key
+            summary = source[key]
+            if key[1] == newest[car_id] and key in local:
+                # The newest month only grows, so copy what is new or still open
+                copied = self._top_up_partition(source_conn, table, date_column, columns, car_id, month, local[key], summary)
+                if copied is not None:
+                    refreshed += 1 if copied else 0
+                    continue
+            elif local.get(key) == summary:
+                continue
+            self._copy_partition(source_conn, table, date_column, columns, car_id, month, summary)
+            refreshed += 1
+
+        self.logger.info(
+            f"Snapshot of {table}: {refreshed} of {len(source)} partitions refreshed, {len(removed)} removed"
+        )
+        return refreshed
+
+    def _refresh_whole_table(self, source_conn, table):
+        """
+        Replace a small table with the current source rows, returning the rows copied.
+        """
+        try:
+            columns = self._ensure_table(source_conn, table)
+            result = source_conn.execute(text(f"SELECT * FROM {table}"))
+        except Exception as e:
+            self.logger.info(f"Snapshot of {table} skipped, no such TeslaLogger table: {e}")
+            source_conn.rollback()
+            return 0
+
+        rows = result.fetchall()
+        with self.engine.begin() as connection:
+            connection.execute(text(f'DELETE FROM "{table}"'))
+            self._insert_rows(connection, table, columns, list(result.keys()), [rows])
+
+        self.logger.info(f"Snapshot of {table}: {len(rows)} rows copied")
+        return len(rows)
+
+    def _ensure_table(self, source_conn, table, date_column=None):
+        """
+        Create the snapshot table from the source schema, returning its column names.
+        """
+        existing = inspect(self.engine).get_columns(table) if inspect(self.engine).has_table(table) else []
+        if existing:
+            return [column['name'] for column in existing]
+
+        source_columns = inspect(source_conn.get_bind()).get_columns(table)
+        definitions = []
+        for column in source_columns:
+            definition = f'"{column["name"]}" {_sqlite_type(column["type"])}'
+            if column['name'] == 'id':
+                definition += ' PRIMARY KEY'
+            definitions.append(definition)
+
+        with self.engine.begin() as connection:
+            connection.execute(text(f'CREATE TABLE "{table}" ({", ".join(definitions)})'))
+            if date_column:
+                connection.execute(text(f'CREATE INDEX "{table}_car_date" ON "{table}" ("CarID", "{date_column}")'))
+        return [column['name'] for column in source_columns]
+
+    def _source_partitions(self, source_conn, table, date_column):
+        """
+        Return {(car_id, month): (row_count, max_id)} of a source table.
+        """
+        month = MONTH_EXPRESSIONS[source_conn.get_bind().dialect.name].format(column=date_column)
+        query = text(
+            f"SELECT CarID AS car_id, {month} AS month, COUNT(*) AS row_count, MAX(id) AS max_id "
+            f"FROM {table} WHERE CarID IS NOT NULL AND {date_column} IS NOT NULL "
+            f"GROUP BY CarID, {month}"
+        )
+        return {(row.car_id, row.month): (row.row_count, row.max_id) for row in source_conn.execute(query)}
+
+    def _local_partitions(self, table):
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text("SELECT car_id, month, row_count, max_id FROM snapshot_partitions WHERE source_table = :table"),
+                {'table': table}
+            )
+            return {(row.car_id, row.month): (row.row_count, row.max_id) for row in rows}
+
+    def _copy_partition(self, source_conn, table, date_column, columns, car_id, month, summary):
+        """
+        Replace one (car, month) partition with the current source rows.
+        """
+        start, end = _month_bounds(month)
+        result = source_conn.execute(
+            text(f"SELECT * FROM {table} WHERE CarID = :car_id AND {date_column} >= :start AND {date_column} < :end"),
+            {'car_id': car_id, 'start': start, 'end': end},
+            execution_options=stream_options(self.batch_size)
+        )
+
+        # One transaction per partition, so an interrupted refresh never leaves half a month
+        with self.engine.begin() as connection:
+            self._delete_partition(connection, table, date_column, car_id, month)
+            self._insert_rows(connection, table, columns, list(result.keys()), result.partitions(self.batch_size))
+            self._save_summary(connection, table, car_id, month, summary)
+
+    def _top_up_partition(self, source_conn, table, date_column, columns, car_id, month, local_summary, summary):
+        """
+        Copy the rows of a partition past its stored highest id, and from its first open interval on.
+
+        :return: Number of rows copied, None when the partition no longer adds up and needs a full copy
+        """
+        start, end = _month_bounds(month)
+        bounds = {'car_id': car_id, 'start': start, 'end': end}
+        in_partition = f'"CarID" = :car_id AND "{date_column}" >= :start AND "{date_column}" < :end'
+
+        with self.engine.connect() as connection, connection.begin() as transaction:
+            after = local_summary[1] or 0
+            open_column = OPEN_COLUMNS.get(table)
+            if open_column:
+                first_open = connection.execute(
+                    text(f'SELECT MIN(id) FROM "{table}" WHERE {in_partition} AND "{open_column}" IS NULL'), bounds
+                ).scalar()
+                if first_open is not None:
+                    after = min(after, first_open - 1)
+
+            if after == local_summary[1] and summary == local_summary:
+                return 0
+
+            result = source_conn.execute(
+                text(f"SELECT * FROM {table} WHERE CarID = :car_id AND {date_column} >= :start "
+                     f"AND {date_column} < :end AND id > :after"),
+                {**bounds, 'after': after},
+                execution_options=stream_options(self.batch_size)
+            )
+            connection.execute(text(f'DELETE FROM "{table}" WHERE {in_partition} AND id > :after'), {**bounds, 'after': after})
+            copied = self._insert_rows(connection, table, columns, list(result.keys()), result.partitions(self.batch_size))
+
+            row_count = connection.execute(text(f'SELECT COUNT(*) FROM "{table}" WHERE {in_partition}'), bounds).scalar()
+            if row_count != summary[0]:
+                # Rows were deleted or back-filled below the stored id, rolled back for a full copy
+                transaction.rollback()
+                return None
+
+            connection.execute(
+                text("DELETE FROM snapshot_partitions WHERE source_table = :table AND car_id = :car_id AND month = :month"),
+                {'table': table, 'car_id': car_id, 'month': month}
+            )
+            self._save_summary(connection, table, car_id, month, summary)
+        return copied
+
+    def _insert_rows(self, connection, table, columns, keys, pages):
+        # Insert pages of source rows, keeping the columns the snapshot table has, returning the row count
+        names = [key for key in keys if key in columns]
+        positions = [keys.index(name) for name in names]
+        quoted = ', '.join(f'"{name}"' for name in names)
+        binds = ', '.join(f':c{index}' for index in range(len(names)))
+        insert = text(f'INSERT INTO "{table}" ({quoted}) VALUES ({binds})')
+        inserted = 0
+        for rows in pages:
+            if rows:
+                connection.execute(insert, [
+                    {f"c{index}": _sqlite_value(row[position]) for index, position in enumerate(positions)}
+                    for row in rows
+                ])
+                inserted += len(rows)
+        return inserted
+
+    def _save_summary(self, connection, table, car_id, month, summary):
+        connection.execute(
+            text("INSERT INTO snapshot_partitions (source_table, car_id, month, row_count, max_id, refreshed_at) "
+                 "VALUES (:table, :car_id, :month, :row_count, :max_id, :refreshed_at)"),
+            {'table': table, 'car_id': car_id, 'month': month, 'row_count': summary[0],
+             'max_id': summary[1], 'refreshed_at': datetime.now().isoformat()}
+        )
+
+    def _delete_partition(self, connection, table, date_column, car_id, month):
+        start, end = _month_bounds(month)
+        connection.execute(
+            text(f'DELETE FROM "{table}" WHERE "CarID" = :car_id AND "{date_column}" >= :start AND "{date_column}" < :end'),
+            {'car_id': car_id, 'start': start, 'end': end}
+        )
+        connection.execute(
+            text("DELETE FROM snapshot_partitions WHERE source_table = :table AND car_id = :car_id AND month = :month"),
+            {'table': table, 'car_id': car_id, 'month': month}
+        )
+
+def _month_bounds(month):
+    # [first day, first day of the next month) of a 'YYYY-MM' month
+    start = datetime.strptime(month, '%Y-%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+def _sqlite_type(column_type):
+    # Declared types drive sqlite3's PARSE_DECLTYPES converters when reading back
+    if isinstance(column_type, sqltypes.DateTime):
+        return 'TIMESTAMP'
+    if isinstance(column_type, sqltypes.Date):
+        return 'DATE'
+    if isinstance(column_type, (sqltypes.Integer, sqltypes.Boolean)):
+        return 'INTEGER'
+    if isinstance(column_type, (sqltypes.Float, sqltypes.Numeric)):
+        return 'REAL'
+    if isinstance(column_type, sqltypes.LargeBinary):
+        return 'BLOB'
+    return 'TEXT'
+
+def _sqlite_value(value):
+    # Values SQLite cannot store natively
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+def refresh_snapshot(config):
+    """
+    Refresh the TeslaLogger snapshot in SNAPSHOT_DIR from the TeslaLogger database.
+
+    :return: {table: number of partitions copied}
+    """
+    logger = logging.getLogger(__name__)
+    manager = get_pool_manager(config)
+    source_conn = manager.session('teslalogger')
+    try:
+        snapshot = TeslaLoggerSnapshot(manager.engine('snapshot'), config.sync_config['position_fetch_batch_size'])
+        refreshed = snapshot.refresh(source_conn)
+        logger.info(f"TeslaLogger snapshot refreshed: {refreshed}")
+        return refreshed
+    finally:
+        source_conn.close()
@@ -0,0 +1,104 @@
+import csv
+import io
+import logging
+from psycopg2.extras import execute_batch
+from utils.metrics import EngineMetrics
+
+# TeslaMate columns populated from TeslaLogger positions
+POSITION_COLUMNS = [
+    'date',
+    'car_id',
+    'latitude',
+    'longitude',
+    'speed',
+    'power',
+    'odometer',
+    'battery_level',
+    'ideal_battery_range_km',
+]
+
+class TeslaMateWriter:
+    """
+    High-throughput bulk writer for the TeslaMate database.
+
+    Positions are loaded with COPY FROM STDIN, merged drives, charging
+    processes and states are written with batched statements. Every batch
+    runs in its own transaction on its own pooled connection, so writes
+    never interfere with streaming reads on the sync session.
+    """
+
+    def __init__(self, teslamate_conn, batch_size=5000, metrics=None):
+        self.engine = teslamate_conn.get_bind()
+        self.batch_size = batch_size
+        self.metrics = metrics or EngineMetrics('writer')  # Write phase of the owning engine
+        self.logger = logging.getLogger(__name__)
+
+    def copy_positions(self, positions):
+        """
+        Insert TeslaLogger positions into TeslaMate with COPY FROM STDIN.
+
+        :param positions: Position records keyed by TeslaMate column
+        :return: Number of rows written
+        """
+        buffer = self.copy_payload(positions)
+        if not buffer.tell():
+            return 0
+
+        buffer.seek(0)
+        statement = f"COPY positions ({', '.join(POSITION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+        with self.metrics.phase('write'), self.engine.begin() as connection:
+            cursor = connection.connection.driver_connection.cursor()
+            try:
+                cursor.copy_expert(statement, buffer)
+                written = cursor.rowcount
+            finally:
+                cursor.close()
+        self.metrics.add('write', rows_written=written, round_trips=1)
+
+        self.logger.info(f"Copied {written} positions into TeslaMate")
+        return written
+
+    def copy_payload(self, positions):
+        """
+        Return the CSV text COPY reads, one line per position in POSITION_COLUMNS order.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for position in positions:
+            writer.writerow(self._position_row(position))
+        return buffer
+
+    def update_rows(self, table, columns, rows):
+        """
+        Update existing TeslaMate rows by id in batches of batch_size.
+
+        :param table: TeslaMate table name
+        :param columns: Columns to set, every row must also carry an 'id'
+        :param rows: Row dictionaries
+        :return: Number of rows written
+        """
+        assignments = ', '.join(f"{column} = %({column})s" for column in columns)
+        statement = f"UPDATE {table} SET {assignments} WHERE id = %(id)s"
+
+        written = 0
+        for offset in range(0, len(rows), self.batch_size):
+            batch = rows[offset:offset + self.batch_size]
+            with self.metrics.phase('write'), self.engine.begin() as connection:
+                cursor = connection.connection.driver_connection.cursor()
+                try:
+                    execute_batch(cursor, statement, batch, page_size=len(batch))
+                finally:
+                    cursor.close()
+            self.metrics.add('write', rows_written=len(batch), round_trips=1)
+            written += len(batch)
+
+        if written:
+            self.logger.info(f"Updated {written} rows in TeslaMate {table}")
+        return written
+
+    def _position_row(self, position):
+        # Naive timestamps are written as-is, None becomes an unquoted NULL
+        row = [position.get(column) for column in POSITION_COLUMNS]
+        row[0] = position['date'].isoformat(sep=' ')
+        return row
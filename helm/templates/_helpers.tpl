@@ -35,3 +35,8 @@ app.kubernetes.io/managed-by: {{ .Release.Service }}
 app.kubernetes.io/name: {{ include "tesla-sync.name" . }}
 app.kubernetes.io/instance: {{ .Release.Name }}
 {{- end }}
+
+{{/* Name of the claim holding logs and the checkpoint store */}}
+{{- define "tesla-sync.claimName" -}}
+{{- default (printf "%s-data" (include "tesla-sync.fullname" .)) .Values.persistence.existingClaim }}
+{{- end }}
@@ -1,12 +1,205 @@
+import time
+
+# Reference point of the startup timings, taken before any other import
+PROCESS_STARTED = time.monotonic()
+
+import importlib
 import logging
 from config.config import Config
-from database.teslalogger_connection import establish_teslalogger_connection
-from database.teslamate_connection import establish_teslamate_connection
-from sync.positions import PositionSync
-from sync.drives import DriveSync
-from sync.charging import ChargingSync
-from sync.states import StateSync
+from database.checkpoints import CheckpointStore
+from database.probe import ENGINE_TABLES, engine_table, teslalogger_max_ids
+from sync.sinks import BatchSink, ReportSink
+from utils.metrics import EngineMetrics, RunMetrics
+from utils.profiling import configure_sampling, function_timings, profile_run
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+# Module of each sync engine, imported only when the engine is enabled
+ENGINE_MODULES = {
+    'positions': 'sync.positions',
+    'drives': 'sync.drives',
+    'charging': 'sync.charging',
+    'states': 'sync.states',
+}
+
+def new_stats():
+    """
+    Return the initial stats hash, one subkey per sync engine.
+    """
+    return {
+        'positions': {'identical': 0, 'invalid': 0, 'added': 0},
+        'drives': {'matched': 0},
+        'charging': {'processed': 0, 'skipped': 0},
+        'states': {'matched': 0}
+    }
+
+# Label of a merge candidate in report logs, per engine
+REPORT_LABELS = {
+    'positions': 'position',
+    'drives': 'drive',
+    'charging': 'charging record',
+    'states': 'state record',
+}
+
+def build_report_sink(name, config, stats):
+    """
+    Return the dry-run report sink of an engine, or None when REPORT_DIR is empty.
+    """
+    sync_config = config.sync_config
+    if not sync_config['report_dir']:
+        return None
+
+    report_format = sync_config['report_format']
+    path = os.path.join(
+        sync_config['report_dir'],
+        f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{report_format}.gz"
+    )
+    return ReportSink(path, REPORT_LABELS.get(name, name), report_format,
+                      sync_config['report_sample_every'], sync_config['report_log_every'],
+                      sync_config['report_buffer_size'],
+                      {'engine': name, 'dry_run': sync_config['dry_run']}, stats)
+
+def build_engine(name, config, teslalogger_conn, teslamate_conn, stats, checkpoints, metrics, cars=None):
+    """
+    Create the sync engine for a stats key, wired to the given connections.
+    """
+    sync_config = config.sync_config
+    dry_run = sync_config['dry_run']
+
+    # Engines, SQLAlchemy and the database drivers are only imported for enabled engines
+
+    # Bulk writer for applying merges, dry runs stream candidates into a report instead
+    writer = None
+    sink = None
+    if not dry_run:
+        from database.teslamate_writer import TeslaMateWriter
+        writer = TeslaMateWriter(teslamate_conn, sync_config['write_batch_size'], metrics)
+    else:
+        sink = build_report_sink(name, config, stats)
+
+    if name == 'positions':
+        from sync.positions import PositionSync
+        position_sink = BatchSink(writer.copy_positions, sync_config['write_batch_size']) if writer else sink
+        return PositionSync(teslalogger_conn, teslamate_conn, dry_run, sync_config['test_position'], stats,
+                            sync_config['position_limit'], sync_config['position_partition_hours'],
+                            sync_config['position_fetch_batch_size'], checkpoints,
+                            sync_config['sync_workers'], config, position_sink, metrics,
+                            sync_config['position_fingerprints'], sync_config['position_staging'], cars,
+                            sync_config['teslalogger_timezone'])
+    if name == 'drives':
+        from sync.drives import DriveSync
+        return DriveSync(teslalogger_conn, teslamate_conn, dry_run, stats, checkpoints, writer,
+                         sync_config['fetch_page_size'], metrics, sink,
+                         sync_config['drive_from_positions'], sync_config['position_fetch_batch_size'], cars,
+                         sync_config['teslalogger_timezone'])
+    if name == 'charging':
+        from sync.charging import ChargingSync
+        return ChargingSync(teslalogger_conn, teslamate_conn, dry_run, stats, checkpoints, writer,
+                            sync_config['fetch_page_size'], metrics, sink, cars, sync_config['teslalogger_timezone'])
+    if name == 'states':
+        from sync.states import StateSync
+        return StateSync(teslalogger_conn, teslamate_conn, dry_run, stats, checkpoints, writer,
+                         sync_config['fetch_page_size'], metrics, sink, cars, sync_config['teslalogger_timezone'])
+    raise ValueError(f"Unknown sync engine: {name}")
+
+def profiler(name, config):
+    """
+    Return the profiling context for an engine, a no-op unless PROFILE=1 selects it.
+    """
+    sync_config = config.sync_config
+    if not sync_config.get('profile'):
+        return nullcontext()
+    if sync_config['profile_engines'] and name not in sync_config['profile_engines']:
+        return nullcontext()
+    return profile_run(name, sync_config['profile_dir'], sync_config['profile_memory'])
+
+def pending_engines(config, checkpoints, enabled):
+    """
+    Return the enabled engines whose TeslaLogger table has rows past their watermarks.
+
+    Compares the highest TeslaLogger id of each table with the highest id
+    recorded by the engine's last successful run. Engines without
+    watermarks, or a TeslaLogger that cannot be probed, always run.
+    """
+    logger = logging.getLogger(__name__)
+    dry_run = config.sync_config['dry_run']
+
+    tables = {name: engine_table(name, config.sync_config) for name in enabled}
+    max_ids = teslalogger_max_ids(config, sorted(set(tables.values())))
+    if max_ids is None:
+        return enabled
+
+    pending = []
+    for name in enabled:
+        table = tables[name]
+        # Watermarks of another table than the default one are kept under their own key
+        key = name if table == ENGINE_TABLES[name] else f'{name}:{table}'
+        marks = checkpoints.get(f'{key}:dryrun' if dry_run else key)
+        last_id = max((last_id for last_id, _ in marks.values() if last_id is not None), default=None)
+
+        if max_ids[table] is not None and (last_id is None or max_ids[table] > last_id):
+            pending.append(name)
+        else:
+            logger.info(f"Nothing new for {name}: TeslaLogger {table} ends at id {max_ids[table]}, watermark {last_id}")
+    return pending
+
+def run_engine(name, config, stats, checkpoints, connections=None, metrics=None, cars=None):
+    """
+    Run a single sync engine, isolating its failures from the other engines.
+
+    :param connections: Shared (teslalogger, teslamate) sessions, or None to open dedicated ones
+    :param metrics: EngineMetrics receiving per-phase timings and counters
+    :param cars: {TeslaLogger CarID: TeslaMate car_id} to sync car by car, or None
+    :return: (duration in seconds, number of potential merges, exception or None)
+    """
+    logger = logging.getLogger(__name__)
+
+    # Lazy imports happen here, so they are not charged to the engine's duration
+    importlib.import_module(ENGINE_MODULES[name])
+    from database import establish_teslalogger_connection, establish_teslamate_connection
+
+    started = time.monotonic()
+    dedicated = connections is None
+    metrics = metrics or EngineMetrics(name)
+    metrics.start()
+
+    try:
+        if dedicated:
+            # Short-lived sessions on the shared connection pools
+            connections = (
+                establish_teslalogger_connection(config),
+                establish_teslamate_connection(config)
+            )
+        teslalogger_conn, teslamate_conn = connections
+
+        engine = build_engine(name, config, teslalogger_conn, teslamate_conn, stats, checkpoints, metrics, cars)
+        logger.info(f"Running sync for {engine.__class__.__name__}")
+        with profiler(name, config):
+            potential_merges = engine.sync()
+
+        # Log merge details
+        if potential_merges:
+            logger.info(f"Potential merges for {engine.__class__.__name__}: {potential_merges}")
+            if config.sync_config['dry_run']:
+                logger.warning(f"DRY RUN MODE ACTIVE - {engine.__class__.__name__} changes not applied, set DRYRUN=0 to apply")
+        else:
+            logger.warning(f"No potential merges found for {engine.__class__.__name__}")
+
+        metrics.finish(potential_merges)
+        return time.monotonic() - started, potential_merges, None
+
+    except Exception as e:
+        logger.error(f"Sync failed for {name}: {e}", exc_info=True)
+        metrics.finish(0, e)
+        return time.monotonic() - started, 0, e
+
+    finally:
+        if dedicated and connections is not None:
+            for connection in connections:
+                connection.close()
 
 def main():
     # Configure logging
@@ -16,13 +209,13 @@ def main():
     )
     logger = logging.getLogger(__name__)
 
+    # Time spent per startup stage, from PROCESS_STARTED
+    startup = {'imports': time.monotonic() - PROCESS_STARTED}
+
     try:
         # Create configuration instance
         config = Config()
-
-        # Establish database connections
-        teslalogger_conn = establish_teslalogger_connection(config)
-        teslamate_conn = establish_teslamate_connection(config)
+        startup['config'] = time.monotonic() - PROCESS_STARTED
 
         # Sync configuration from config
         sync_positions = config.sync_config['sync_positions']
@@ -30,8 +223,11 @@ def main():
         sync_charging = config.sync_config['sync_charging']
         sync_states = config.sync_config['sync_states']
         dry_run = config.sync_config['dry_run']
-        test_position = config.sync_config['test_position']
         position_limit = config.sync_config['position_limit']
+        position_partition_hours = config.sync_config['position_partition_hours']
+        full_resync = config.sync_config['full_resync']
+        sync_workers = config.sync_config['sync_workers']
+        parallel_engines = config.sync_config['parallel_engines']
 
         # Debug logging
         logger.info(f"Sync Configuration:")
@@ -41,39 +237,131 @@ def main():
         logger.info(f"States: {sync_states}")
         logger.info(f"Dry Run: {dry_run}")
         logger.info(f"Position Limit: {position_limit}")
+        logger.info(f"Position Partition Hours: {position_partition_hours}")
+        logger.info(f"Full Resync: {full_resync}")
+        logger.info(f"Sync Workers: {sync_workers}")
+        logger.info(f"Parallel Engines: {parallel_engines}")
+        logger.info(f"Connection Pool: {config.pool_config}")
+        logger.info(f"Snapshot Directory: {config.sync_config['snapshot_dir'] or 'disabled'}")
+        logger.info(f"TeslaLogger Time Zone: {config.sync_config['teslalogger_timezone'] or 'UTC'}")
+
+        # Sampled timers around the matchers and fetchers
+        configure_sampling(config.sync_config['profile_sample_rate'])
+
+        # Watermark store for incremental runs
+        checkpoints = CheckpointStore(
+            config.sync_config['checkpoint_path'],
+            full_resync,
+            config.sync_config['checkpoint_lookback_hours']
+        )
+
+        # Initialize stats hash and per-engine metrics
+        stats = new_stats()
+        stats_lock = threading.Lock()
+        run_metrics = RunMetrics()
+        run_metrics.startup = startup
 
-        # Initialize stats hash
-        stats = {
-            'positions': {'identical': 0, 'invalid': 0, 'added': 0},
-            'drives': {},
-            'charging': {'processed': 0, 'skipped': 0},
-            'states': {}
-        }
-
-        # Sync engines
-        engines = []
-        if sync_positions:
-            engines.append(PositionSync(teslalogger_conn, teslamate_conn, dry_run, test_position, stats['positions'], position_limit))
-        if sync_drives:
-            engines.append(DriveSync(teslalogger_conn, teslamate_conn, dry_run, stats['drives']))
-        if sync_charging:
-            engines.append(ChargingSync(teslalogger_conn, teslamate_conn, dry_run, stats['charging']))
-        if sync_states:
-            engines.append(StateSync(teslalogger_conn, teslamate_conn, dry_run, stats['states']))
+        # Enabled sync engines, in the order they run sequentially
+        enabled = [name for name, enabled in [
+            ('positions', sync_positions),
+            ('drives', sync_drives),
+            ('charging', sync_charging),
+            ('states', sync_states),
+        ] if enabled]
+        if not enabled:
+            logger.info("No sync engines enabled, nothing to do")
+
+        # Cheap check for new TeslaLogger rows, before SQLAlchemy is even imported
+        if enabled and config.sync_config['fast_exit'] and not full_resync:
+            enabled = pending_engines(config, checkpoints, enabled)
+            startup['fast_path'] = time.monotonic() - PROCESS_STARTED
+            if not enabled:
+                logger.info("No new TeslaLogger rows since the last run, nothing to do")
+
+        # Bring the local TeslaLogger snapshot up to date before any engine reads it
+        if enabled and config.sync_config['snapshot_dir'] and config.sync_config['snapshot_refresh']:
+            from database.snapshot import refresh_snapshot
+            refresh_snapshot(config)
+
+        # TeslaLogger to TeslaMate car ids, resolved once and shared by every engine
+        cars = None
+        if enabled and config.sync_config['partition_by_car']:
+            from database import establish_teslalogger_connection, establish_teslamate_connection
+            from database.cars import parse_car_map, resolve_car_map
+
+            connections = (establish_teslalogger_connection(config), establish_teslamate_connection(config))
+            try:
+                cars = resolve_car_map(*connections, checkpoints, parse_car_map(config.sync_config['car_id_map']))
+            finally:
+                for connection in connections:
+                    connection.close()
+
+        def run(name, connections=None):
+            # Each engine works on a private stats dict merged under the lock afterwards
+            engine_stats = {key: 0 for key in stats[name]}
+            result = run_engine(name, config, engine_stats, checkpoints, connections, run_metrics.engine(name), cars)
+            with stats_lock:
+                for key, value in engine_stats.items():
+                    stats[name][key] = stats[name].get(key, 0) + value
+            return result
 
         # Perform syncs
-        for engine in engines:
-            logger.info(f"Running sync for {engine.__class__.__name__}")
-            potential_merges = engine.sync()
-            
-            # Log merge details
-            if potential_merges:
-                logger.info(f"Potential merges for {engine.__class__.__name__}: {len(potential_merges)}")
-            else:
-                logger.warning(f"No potential merges found for {engine.__class__.__name__}")
+        durations = {}
+        failures = []
+        if parallel_engines:
+            # Each engine opens its own connection pools
+            with ThreadPoolExecutor(max_workers=max(len(enabled), 1)) as pool:
+                futures = {name: pool.submit(run, name) for name in enabled}
+                for name, future in futures.items():
+                    duration, _, error = future.result()
+                    durations[name] = duration
+                    if error:
+                        failures.append(name)
+        elif enabled:
+            from database import establish_teslalogger_connection, establish_teslamate_connection
+
+            # Establish database connections shared by all engines
+            connections = (
+                establish_teslalogger_connection(config),
+                establish_teslamate_connection(config)
+            )
+            for name in enabled:
+                duration, _, error = run(name, connections)
+                durations[name] = duration
+                if error:
+                    failures.append(name)
+            for connection in connections:
+                connection.close()
+
+        # Log per-engine durations
+        for name, duration in durations.items():
+            logger.info(f"Sync duration for {name}: {duration:.2f}s")
 
         # Log final stats
         logger.info(f"Final Sync Stats: {stats}")
+        if enabled:
+            from database.pool import get_pool_manager
+
+            manager = get_pool_manager(config)
+            run_metrics.pools = manager.metrics_snapshot()
+            logger.info(f"Connection Pool Metrics: {run_metrics.pools}")
+            if manager.first_query_at is not None:
+                startup['first_query'] = manager.first_query_at - PROCESS_STARTED
+        logger.info("Startup Timings: " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in startup.items()))
+        run_metrics.functions = function_timings()
+        if run_metrics.functions:
+            logger.info(f"Sampled Function Timings: {run_metrics.functions}")
+
+        # Export run metrics for dashboards and alerting
+        if config.sync_config['metrics_json_path']:
+            run_metrics.write_json(config.sync_config['metrics_json_path'])
+        if config.sync_config['metrics_prometheus_path']:
+            run_metrics.write_prometheus(config.sync_config['metrics_prometheus_path'])
+
+        checkpoints.close()
+
+        if failures:
+            raise RuntimeError(f"Sync failed for engines: {', '.join(failures)}")
 
     except Exception as e:
         logger.error(f"Sync failed: {e}", exc_info=True)
@@ -1,11 +1,20 @@
-from .positions import PositionSync
-from .drives import DriveSync
-from .charging import ChargingSync
-from .states import StateSync
+import importlib
 
-__all__ = [
-    'PositionSync',
-    'DriveSync',
-    'ChargingSync',
-    'StateSync'
-]
+# Exported name -> submodule defining it. Submodules are imported on first
+# access, so importing one light module does not load every sync engine.
+_EXPORTS = {
+    'PositionSync': 'positions',
+    'DriveSync': 'drives',
+    'ChargingSync': 'charging',
+    'StateSync': 'states',
+    'CountingSink': 'sinks',
+    'BatchSink': 'sinks',
+    'ReportSink': 'sinks',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
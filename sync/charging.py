@@ -1,86 +1,119 @@
 import logging
-from utils.helpers import haversine_distance
-from sqlalchemy import text
+from utils.intervals import match_interval_pages
+from database.cars import car_predicate, map_car_ids, teslalogger_cars
+from database.pagination import keyset_pages
+from sync.charging_sessions import ChargingSessionizer
+from sync.sinks import BatchSink, CountingSink
+from utils.metrics import EngineMetrics
+from utils.profiling import sampled_timer
+from utils.timezones import records_to_utc, utc_offsets
+from datetime import timedelta
+
+# TeslaMate charging process columns updated from merged charging records
+CHARGING_WRITE_COLUMNS = ['start_date', 'end_date', 'charge_energy_added', 'cost']
+
+# Tolerance both charging intervals are widened by before comparing
+CHARGING_TIME_WINDOW = 300  # seconds
 
 class ChargingSync:
-    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, stats):
+    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, stats, checkpoints=None, writer=None, page_size=1000, metrics=None, sink=None, cars=None, timezone=None):
         self.teslalogger_conn = teslalogger_conn
         self.teslamate_conn = teslamate_conn
         self.dry_run = dry_run
         self.stats = stats  # Reference to the subkey of the stats hash 
+        self.checkpoints = checkpoints  # Optional watermark store for incremental runs
+        self.writer = writer  # TeslaMate bulk writer, only used when not in dry run
+        self.page_size = page_size  # Rows per keyset page
+        self.metrics = metrics or EngineMetrics('charging')  # Per-phase timings and counters
+        # Receives merge candidates as they are matched, by default written back in batches
+        if sink is None:
+            sink = BatchSink(self._write_merges, writer.batch_size) if writer and not dry_run else CountingSink()
+        self.sink = sink
+        self.cars = cars  # {TeslaLogger CarID: TeslaMate car_id} to sync car by car, None mixes all cars
+        self.offsets = utc_offsets(timezone)  # UTC offset transitions of TeslaLogger's local time zone, None when UTC
+        self.checkpoint_key = 'charging:dryrun' if dry_run else 'charging'
         self.logger = logging.getLogger(__name__)
 
     def sync(self):
-        # Fetch charging records from both databases
-        teslalogger_charging = self._fetch_teslalogger_charging()
-        teslamate_charging = self._fetch_teslamate_charging()
-
-        # Validate fetched charging records
-        if teslalogger_charging is None:
-            self.logger.error("Failed to fetch TeslaLogger charging records")
-            # Return empty list instead of None
-            return []
-        
-        if teslamate_charging is None:
-            self.logger.error("Failed to fetch TeslaMate charging records")
-            # Return empty list instead of None
-            return []
-
-        # Detailed logging
-        self.logger.info(f"TeslaLogger Charging Records: {len(teslalogger_charging)}")
-        self.logger.info(f"TeslaMate Charging Records: {len(teslamate_charging)}")
-
-        # Find potential matches
-        potential_merges = self._find_charging_matches(
-            teslalogger_charging, 
-            teslamate_charging
-        )
-
-        return potential_merges
-
-    def _find_charging_matches(self, teslalogger_charging, teslamate_charging):
-        matches = []
-        
-        for tl_charge in teslalogger_charging:
-            for tm_charge in teslamate_charging:
-                # Match criteria
-                if (abs((tl_charge['Datum'] - tm_charge['date']).total_seconds()) <= 300 and
-                    tl_charge['CarID'] == tm_charge['car_id']):
-                    
-                    merged_charge = self._merge_charging_record(tl_charge, tm_charge)
-                    matches.append(merged_charge)
-
-                    # Update stats
-                    self.stats['processed'] += len(teslalogger_charging)
-                else:
-                    self.stats['skipped'] += len(teslalogger_charging) - len(potential_merges)
-
-
-        return matches
+        try:
+            for car_id in self._cars():
+                # Stream charging records from both databases, page by page
+                teslalogger_charging = self.metrics.timed('fetch_teslalogger', self._fetch_teslalogger_charging(car_id), len)
+                teslamate_charging = self.metrics.timed('fetch_teslamate', self._fetch_teslamate_charging(car_id), len)
+
+                # Find potential matches and stream them to the sink
+                for merge in self._find_charging_matches(
+                    records_to_utc(map_car_ids(teslalogger_charging, 'CarID', self.cars),
+                                   ('StartDate', 'EndDate'), self.offsets),
+                    teslamate_charging
+                ):
+                    self.sink.emit(merge)
+        except Exception as e:
+            self.logger.error(f"Error syncing charging records: {e}")
+            self.sink.discard()
+            raise
+        self.sink.close()
+
+        if self.checkpoints:
+            self.checkpoints.commit(self.checkpoint_key)
+
+        return self.sink.count
+
+    def _cars(self):
+        # TeslaLogger cars synced one at a time, or None once for all cars together
+        if self.cars is None:
+            return [None]
+        return teslalogger_cars(self.teslalogger_conn, 'charging')
+
+    @sampled_timer
+    def _find_charging_matches(self, teslalogger_sessions, teslamate_charging):
+        """
+        Pair TeslaLogger sessions and TeslaMate charging processes one-to-one by overlapping time range.
+
+        Both inputs are streams of pages ordered by start date. Merges are
+        yielded as they are matched, every session read counts as skipped
+        until it is matched.
+        """
+        def counted(pages):
+            for page in pages:
+                self.stats['skipped'] += len(page)
+                yield page
+
+        # Intervals are widened by the time window before comparing
+        for tl_charge, tm_charge, _ in match_interval_pages(
+                counted(teslalogger_sessions), teslamate_charging,
+                ('CarID', 'StartDate', 'EndDate'),
+                ('car_id', 'start_date', 'end_date'),
+                timedelta(seconds=CHARGING_TIME_WINDOW)):
+            self.stats['processed'] += 1
+            self.stats['skipped'] -= 1
+            yield self._merge_charging_record(tl_charge, tm_charge)
 
     def _merge_charging_record(self, teslalogger_charge, teslamate_charge):
         # Merge logic for charging records
         merged_charge = {
+            'teslalogger_id': teslalogger_charge.get('id'),
+            'teslamate_id': teslamate_charge.get('id'),
             'start_date': min(
-                teslalogger_charge['Datum'], 
+                teslalogger_charge['StartDate'], 
                 teslamate_charge['start_date']
             ),
             'end_date': max(
-                teslalogger_charge.get('EndDate') or teslamate_charge['end_date'], 
-                teslamate_charge['end_date']
+                teslalogger_charge.get('EndDate') or teslamate_charge['end_date'] or teslalogger_charge['StartDate'], 
+                teslamate_charge['end_date'] or teslalogger_charge['StartDate']
             ),
             'car_id': teslalogger_charge['CarID'],
             'charge_energy_added': max(
-                teslalogger_charge.get('charge_energy_added', 0), 
-                teslamate_charge.get('charge_energy_added', 0)
+                teslalogger_charge.get('charge_energy_added') or 0, 
+                teslamate_charge.get('charge_energy_added') or 0
             ),
             'battery_level': {
-                'start': teslalogger_charge.get('battery_level'),
-                'end': teslamate_charge.get('end_battery_level')
+                'start': teslalogger_charge.get('start_battery_level') or teslamate_charge.get('start_battery_level'),
+                'end': teslalogger_charge.get('end_battery_level') or teslamate_charge.get('end_battery_level')
             },
             'charger_power': max(
-                teslalogger_charge.get('charger_power', 0), 
-                teslamate_charge.get('charger_power', 0)
+                teslalogger_charge.get('charger_power') or 0, 
+                teslamate_charge.get('charger_power') or 0
             ),
             'location': {
                 'latitude': teslalogger_charge.get('latitude') or teslamate_charge.get('latitude'),
@@ -95,93 +128,111 @@ class ChargingSync:
                 teslamate_charge.get('fast_charger_brand')
             ),        
         }
+        merged_charge['duration_min'] = round((merged_charge['end_date'] - merged_charge['start_date']).total_seconds() / 60)
         return merged_charge
 
-    def log_potential_merges(self, potential_merges):
-        self.logger.info(f"Dry Run - Potential Charging Merges: {len(potential_merges)}")
-        for merge in potential_merges:
-            self.logger.info(f"Would merge charging record: {merge}")
+    def _teslamate_row(self, merged_charge):
+        # Flatten a merged charging record into the TeslaMate columns that are written back
+        return {
+            'id': merged_charge['teslamate_id'],
+            'start_date': merged_charge['start_date'],
+            'end_date': merged_charge['end_date'],
+            'charge_energy_added': merged_charge['charge_energy_added'],
+            'cost': merged_charge['cost_total'] or None,
+        }
 
-        if potential_merges:
-            self.logger.warning("""
-            DRY RUN MODE ACTIVE
-            Potential charging merges detected.
-            To apply changes, set DRYRUN=0
-            """)
+    def _write_merges(self, merges):
+        # Update the matched TeslaMate rows from a batch of merges
+        self.writer.update_rows('charging_processes', CHARGING_WRITE_COLUMNS, [
+            self._teslamate_row(merge) for merge in merges if merge.get('teslamate_id') is not None
+        ])
 
-    def _fetch_teslalogger_charging(self):
+    @sampled_timer
+    def _fetch_teslalogger_charging(self, car_id=None):
         """
-        Fetch charging records from TeslaLogger database
+        Stream TeslaLogger charging sessions in pages ordered by start date
+
+        The per-sample charging table is read once in (Datum, id) order and
+        grouped into sessions on the fly.
         """
-        try:
-            # Use text() for raw SQL queries
-            query = text("SELECT * FROM charging LIMIT 1000")  # Adjust limit as needed
-            result = self.teslalogger_conn.execute(query)
-            
-            # Convert to list of dictionaries
-            charges = []
-            for row in result:
+        if self.checkpoints:
+            where, params = self.checkpoints.where_clause(self.checkpoint_key, 'CarID', 'Datum')
+        else:
+            where, params = "1 = 1", {}
+        where, params = car_predicate(where, params, 'CarID', car_id)
+
+        fetched = 0
+        sessionizer = ChargingSessionizer()
+        sessions = []
+        for session in sessionizer.sessions(self._teslalogger_samples(where, params)):
+            sessions.append(session)
+            if len(sessions) >= self.page_size:
+                fetched += len(sessions)
+                yield sessions
+                sessions = []
+        if sessions:
+            fetched += len(sessions)
+            yield sessions
+
+        self.logger.info(f"Fetched {fetched} charging sessions from TeslaLogger")
+
+    def _teslalogger_samples(self, where, params):
+        # Charging samples as dictionaries, in (Datum, id) order
+        for rows in keyset_pages(self.teslalogger_conn, 'charging', ('Datum', 'id'), where, params, self.page_size):
+            for row in rows:
+                if self.checkpoints:
+                    self.checkpoints.track(self.checkpoint_key, row.CarID, getattr(row, 'id', None), row.Datum)
+
                 try:
-                    charge = {
+                    yield {
+                        'id': getattr(row, 'id', None),
                         'Datum': row.Datum,
                         'CarID': row.CarID,
-                        'charge_energy_added': row.charge_energy_added,
-                        'battery_level_start': row.battery_level_start,
-                        'battery_level_end': row.battery_level_end,
-                        'charger_power': row.charger_power,
-                        'start_date': row.start_date,
-                        'end_date': row.end_date,
-                        'car_id': row.car_id,
                         'charge_energy_added': getattr(row, 'charge_energy_added', None),
-                        'battery_level_start': getattr(row, 'start_battery_level', None),
-                        'battery_level_end': getattr(row, 'end_battery_level', None),
-                        'charger_power': getattr(row, 'charge_power', None),
-                        'latitude': getattr(row, 'latitude', None),
-                        'longitude': getattr(row, 'longitude', None),
-                        'cost_total': getattr(row, 'cost_total', None),
-                        'fast_charger_brand': getattr(row, 'fast_charger_brand', None),
+                        'battery_level': getattr(row, 'battery_level', None),
+                        'ideal_battery_range_km': getattr(row, 'ideal_battery_range_km', None),
+                        'charger_power': getattr(row, 'charger_power', None),
                     }
-                    charges.append(charge)
                 except Exception as field_error:
                     self.logger.warning(f"Could not process charging row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(charges)} charging records from TeslaLogger")
-            return charges
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaLogger charging records: {e}")
-            return None
 
-    def _fetch_teslamate_charging(self):
+    @sampled_timer
+    def _fetch_teslamate_charging(self, car_id=None):
         """
-        Fetch charging records from TeslaMate database
+        Stream charging records from TeslaMate database in pages ordered by start date and id
         """
-        try:
-            # Use text() for raw SQL queries
-            query = text("SELECT * FROM charging_processes LIMIT 1000")  # Adjust limit as needed
-            result = self.teslamate_conn.execute(query)
-            
+        since = self.checkpoints.earliest(self.checkpoint_key, car_id) if self.checkpoints else None
+        if since is not None and self.offsets is not None:
+            # Watermarks are TeslaLogger local time, TeslaMate stores UTC
+            since = self.offsets.utc_datetime(since)
+        if since is not None:
+            where, params = "start_date >= :since", {'since': since}
+        else:
+            where, params = "1 = 1", {}
+        if car_id is not None:
+            where, params = car_predicate(where, params, 'car_id', self.cars.get(car_id, car_id))
+
+        fetched = 0
+        for rows in keyset_pages(self.teslamate_conn, 'charging_processes', ('start_date', 'id'), where, params, self.page_size):
             # Convert to list of dictionaries
             charges = []
-            for row in result:
+            for row in rows:
                 try:
                     charge = {
-                        'date': row.start_date,
+                        'id': getattr(row, 'id', None),
+                        'start_date': row.start_date,
                         'end_date': row.end_date,
                         'car_id': row.car_id,
-                        'charge_energy_added': row.charge_energy_added,
-                        'battery_level_start': row.start_battery_level,
-                        'battery_level_end': row.end_battery_level,
-                        'charger_power': row.charge_power,
-                        # Add other relevant fields
+                        'charge_energy_added': getattr(row, 'charge_energy_added', None),
+                        'start_battery_level': getattr(row, 'start_battery_level', None),
+                        'end_battery_level': getattr(row, 'end_battery_level', None),
+                        'cost_total': getattr(row, 'cost', None),
                     }
                     charges.append(charge)
                 except Exception as field_error:
                     self.logger.warning(f"Could not process TeslaMate charging row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(charges)} charging records from TeslaMate")
-            return charges
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaMate charging records: {e}")
-            return None
+
+            fetched += len(charges)
+            yield charges
+
+        self.logger.info(f"Fetched {fetched} charging records from TeslaMate")
@@ -0,0 +1,119 @@
+import heapq
+from itertools import count
+
+# No charging sample for this long ends a TeslaLogger charging session
+CHARGING_SESSION_GAP = 600  # seconds
+
+class ChargingSession:
+    """
+    Running aggregates of one charging session, updated sample by sample.
+    """
+
+    def __init__(self, car_id):
+        self.car_id = car_id
+        self.first_id = None  # id of the first sample, identifies the session
+        self.start_date = None
+        self.end_date = None
+        self.samples = 0
+        self.energy_base = 0.0  # Energy of earlier counter runs when charge_energy_added reset
+        self.last_energy = None
+        self.start_battery_level = self.end_battery_level = None
+        self.start_ideal_range_km = self.end_ideal_range_km = None
+        self.charger_power_max = None
+
+    def add(self, sample):
+        timestamp = sample['Datum']
+        if self.start_date is None:
+            self.start_date = timestamp
+            self.first_id = sample.get('id')
+        self.end_date = timestamp
+        self.samples += 1
+
+        # charge_energy_added counts up during a charge, a drop means the car restarted it
+        energy = sample.get('charge_energy_added')
+        if energy is not None:
+            if self.last_energy is not None and energy < self.last_energy:
+                self.energy_base += self.last_energy
+            self.last_energy = energy
+
+        battery_level = sample.get('battery_level')
+        if battery_level is not None:
+            if self.start_battery_level is None:
+                self.start_battery_level = battery_level
+            self.end_battery_level = battery_level
+
+        ideal_range = sample.get('ideal_battery_range_km')
+        if ideal_range is not None:
+            if self.start_ideal_range_km is None:
+                self.start_ideal_range_km = ideal_range
+            self.end_ideal_range_km = ideal_range
+
+        power = sample.get('charger_power')
+        if power is not None:
+            self.charger_power_max = power if self.charger_power_max is None else max(self.charger_power_max, power)
+
+    def record(self):
+        return {
+            'id': self.first_id,
+            'StartDate': self.start_date,
+            'EndDate': self.end_date,
+            'CarID': self.car_id,
+            'charge_energy_added': self.energy_base + (self.last_energy or 0),
+            'start_battery_level': self.start_battery_level,
+            'end_battery_level': self.end_battery_level,
+            'start_ideal_range_km': self.start_ideal_range_km,
+            'end_ideal_range_km': self.end_ideal_range_km,
+            'charger_power': self.charger_power_max,
+            'duration_min': round((self.end_date - self.start_date).total_seconds() / 60),
+            'samples': self.samples,
+        }
+
+class ChargingSessionizer:
+    """
+    Groups the time ordered TeslaLogger charging samples into sessions in a single pass.
+
+    A car's session ends once it has no sample for CHARGING_SESSION_GAP.
+    Finished sessions are released in start order, so memory holds only the
+    open session of each car.
+    """
+
+    def __init__(self):
+        self.open = {}  # car_id -> ChargingSession being built
+        self.finished = []  # Heap of (start, sequence, record)
+        self.sequence = count()
+
+    def sessions(self, samples):
+        """
+        Yield charging session records, ordered by start.
+
+        :param samples: TeslaLogger charging samples ordered by Datum
+        """
+        for sample in samples:
+            timestamp = sample['Datum']
+            car_id = sample['CarID']
+
+            # Close every session, of any car, that went quiet for longer than the gap
+            for open_car, session in list(self.open.items()):
+                if (timestamp - session.end_date).total_seconds() > CHARGING_SESSION_GAP:
+                    self._close(open_car)
+
+            session = self.open.get(car_id)
+            if session is None:
+                session = self.open[car_id] = ChargingSession(car_id)
+            session.add(sample)
+
+            yield from self._release(timestamp)
+
+        for car_id in list(self.open):
+            self._close(car_id)
+        yield from self._release(None)
+
+    def _close(self, car_id):
+        session = self.open.pop(car_id)
+        heapq.heappush(self.finished, (session.start_date, next(self.sequence), session.record()))
+
+    def _release(self, timestamp):
+        # Sessions opened later can never start before the earliest open one
+        horizon = min((session.start_date for session in self.open.values()), default=timestamp)
+        while self.finished and (horizon is None or self.finished[0][0] <= horizon):
+            yield heapq.heappop(self.finished)[2]
@@ -0,0 +1,226 @@
+import heapq
+from collections import deque
+from itertools import count
+from utils.helpers import haversine_distance
+
+# Heuristic drive detection for positions outside every drivestate interval
+DRIVE_STOP_SECONDS = 180  # standing still this long ends a drive
+DRIVE_GAP_SECONDS = 300  # no position for this long ends a drive
+
+class DriveAggregate:
+    """
+    Running aggregates of one drive, updated position by position.
+    """
+
+    def __init__(self, car_id, source, drivestate_id=None):
+        self.car_id = car_id
+        self.source = source  # 'drivestate' or 'heuristic'
+        self.drivestate_id = drivestate_id
+        self.start_date = None
+        self.end_date = None
+        self.positions = 0
+        self.start_latitude = self.start_longitude = None
+        self.end_latitude = self.end_longitude = None
+        self.path_km = 0.0  # Haversine length, used when the odometer is missing
+        self.start_km = self.end_km = None
+        self.speed_max = None
+        self.power_max = self.power_min = None
+        self.start_battery_level = self.end_battery_level = None
+        self.start_ideal_range_km = self.end_ideal_range_km = None
+
+    def add(self, position):
+        timestamp = position['Datum']
+        if self.start_date is None:
+            self.start_date = timestamp
+        self.end_date = timestamp
+        self.positions += 1
+
+        # Zero coordinates are treated as missing like in position matching
+        lat, lng = position.get('lat'), position.get('lng')
+        if lat and lng:
+            if self.start_latitude is None:
+                self.start_latitude, self.start_longitude = lat, lng
+            else:
+                self.path_km += haversine_distance(self.end_latitude, self.end_longitude, lat, lng) / 1000
+            self.end_latitude, self.end_longitude = lat, lng
+
+        odometer = position.get('odometer')
+        if odometer is not None:
+            if self.start_km is None:
+                self.start_km = odometer
+            self.end_km = odometer
+
+        speed = position.get('speed')
+        if speed is not None:
+            self.speed_max = speed if self.speed_max is None else max(self.speed_max, speed)
+
+        power = position.get('power')
+        if power is not None:
+            self.power_max = power if self.power_max is None else max(self.power_max, power)
+            self.power_min = power if self.power_min is None else min(self.power_min, power)
+
+        battery_level = position.get('battery_level')
+        if battery_level is not None:
+            if self.start_battery_level is None:
+                self.start_battery_level = battery_level
+            self.end_battery_level = battery_level
+
+        ideal_range = position.get('ideal_battery_range_km')
+        if ideal_range is not None:
+            if self.start_ideal_range_km is None:
+                self.start_ideal_range_km = ideal_range
+            self.end_ideal_range_km = ideal_range
+
+    def record(self):
+        """
+        Return the drive keyed like a TeslaLogger drivestate row, plus the position aggregates.
+        """
+        if self.start_km is not None and self.end_km is not None:
+            distance = self.end_km - self.start_km
+        else:
+            distance = self.path_km
+
+        return {
+            'id': self.drivestate_id,
+            'StartDate': self.start_date,
+            'EndDate': self.end_date,
+            'CarID': self.car_id,
+            'distance': distance,
+            'speed_max': self.speed_max,
+            'power_max': self.power_max,
+            'power_min': self.power_min,
+            'start_km': self.start_km,
+            'end_km': self.end_km,
+            'duration_min': round((self.end_date - self.start_date).total_seconds() / 60),
+            'start_latitude': self.start_latitude,
+            'start_longitude': self.start_longitude,
+            'end_latitude': self.end_latitude,
+            'end_longitude': self.end_longitude,
+            'start_battery_level': self.start_battery_level,
+            'end_battery_level': self.end_battery_level,
+            'start_ideal_range_km': self.start_ideal_range_km,
+            'end_ideal_range_km': self.end_ideal_range_km,
+            'positions': self.positions,
+            'source': self.source,
+        }
+
+class DriveReconstructor:
+    """
+    Cuts the time ordered TeslaLogger position stream into drives in a single pass.
+
+    Positions inside a drivestate interval of their car belong to that drive.
+    Moving positions outside every interval, for example where drivestate
+    rows are missing or were never closed, start a heuristic drive that ends
+    after DRIVE_STOP_SECONDS standing still or a DRIVE_GAP_SECONDS gap.
+    Aggregates are updated per position and finished drives are released
+    in start order, so memory holds only the open drive of each car.
+    """
+
+    def __init__(self, drivestates):
+        """
+        :param drivestates: TeslaLogger drive records ordered by StartDate
+        """
+        self.drivestates = iter(drivestates)
+        self.upcoming = None
+        self.intervals = {}  # car_id -> deque of (start, end, drivestate id)
+        self.open = {}  # car_id -> DriveAggregate being built
+        self.stationary = {}  # car_id -> positions standing still at the end of a heuristic drive
+        self.finished = []  # Heap of (start, sequence, record)
+        self.sequence = count()
+        self.counts = {'drivestate': 0, 'heuristic': 0}
+
+    def drives(self, positions):
+        """
+        Yield reconstructed drive records, ordered by start.
+
+        :param positions: TeslaLogger position mappings ordered by Datum
+        """
+        self.upcoming = next(self.drivestates, None)
+
+        for position in positions:
+            timestamp = position['Datum']
+            car_id = position['CarID']
+            self._read_intervals(timestamp)
+            self._add(car_id, timestamp, position)
+            yield from self._release(timestamp)
+
+        for car_id in list(self.open):
+            self._close(car_id)
+        yield from self._release(None)
+
+    def _read_intervals(self, timestamp):
+        # Queue every closed drivestate interval that has started by now
+        while self.upcoming is not None and self.upcoming['StartDate'] <= timestamp:
+            drive = self.upcoming
+            self.upcoming = next(self.drivestates, None)
+            if drive.get('EndDate') is None or drive['EndDate'] < drive['StartDate']:
+                continue
+            self.intervals.setdefault(drive['CarID'], deque()).append(
+                (drive['StartDate'], drive['EndDate'], drive.get('id')))
+
+    def _add(self, car_id, timestamp, position):
+        intervals = self.intervals.get(car_id)
+
+        # Intervals that ended before this position are complete
+        while intervals and intervals[0][1] < timestamp:
+            drive = self.open.get(car_id)
+            if drive is not None and drive.source == 'drivestate' and drive.drivestate_id == intervals[0][2]:
+                self._close(car_id)
+            intervals.popleft()
+
+        drive = self.open.get(car_id)
+        if intervals and intervals[0][0] <= timestamp:
+            drivestate_id = intervals[0][2]
+            if drive is None or drive.source != 'drivestate' or drive.drivestate_id != drivestate_id:
+                if drive is not None:
+                    self._close(car_id)
+                drive = self.open[car_id] = DriveAggregate(car_id, 'drivestate', drivestate_id)
+            drive.add(position)
+            return
+
+        if drive is not None and drive.source == 'drivestate':
+            self._close(car_id)
+            drive = None
+
+        # No drivestate row covers this position, cut by speed and gaps
+        if drive is not None and (timestamp - drive.end_date).total_seconds() > DRIVE_GAP_SECONDS:
+            self._close(car_id)
+            drive = None
+
+        speed = position.get('speed')
+        if speed is not None and speed > 0:
+            if drive is None:
+                drive = self.open[car_id] = DriveAggregate(car_id, 'heuristic')
+            for stationary in self.stationary.pop(car_id, []):
+                drive.add(stationary)
+            drive.add(position)
+        elif drive is not None:
+            stationary = self.stationary.setdefault(car_id, [])
+            stationary.append(position)
+            if (timestamp - stationary[0]['Datum']).total_seconds() >= DRIVE_STOP_SECONDS:
+                self._close(car_id)
+
+    def _close(self, car_id):
+        drive = self.open.pop(car_id, None)
+        self.stationary.pop(car_id, None)
+        if drive is None:
+            return
+        self.counts[drive.source] += 1
+        heapq.heappush(self.finished, (drive.start_date, next(self.sequence), drive.record()))
+
+    def _release(self, timestamp):
+        # Drives starting after every still open one, or after now, may start earlier than the next
+        if timestamp is not None:
+            for car_id, drive in list(self.open.items()):
+                if drive.source == 'heuristic' and (timestamp - drive.end_date).total_seconds() > DRIVE_GAP_SECONDS:
+                    self._close(car_id)
+
+        if not self.finished:
+            return
+
+        horizon = min((drive.start_date for drive in self.open.values()), default=timestamp)
+        if timestamp is not None and horizon is not None:
+            horizon = min(horizon, timestamp)
+
+        while self.finished and (horizon is None or self.finished[0][0] <= horizon):
+            yield heapq.heappop(self.finished)[2]
@@ -1,58 +1,106 @@
 import logging
 from utils.helpers import haversine_distance
-from sqlalchemy import text
+from utils.intervals import latest_end, match_interval_pages
+from database.cars import car_predicate, map_car_ids, teslalogger_cars
+from database.pagination import keyset_pages
+from database.pool import stream_options
+from sync.drive_segments import DriveReconstructor
+from sync.sinks import BatchSink, CountingSink
+from utils.metrics import EngineMetrics
+from utils.profiling import sampled_timer
+from utils.timezones import records_to_utc, utc_offsets
 from datetime import timedelta
+from sqlalchemy import text
+
+# TeslaMate drive columns updated from merged drives
+DRIVE_WRITE_COLUMNS = ['start_date', 'end_date', 'distance', 'speed_max']
+
+# Additional columns written when drives are reconstructed from positions
+DRIVE_AGGREGATE_COLUMNS = ['power_max', 'power_min', 'start_km', 'end_km', 'duration_min']
 
 class DriveSync:
-    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, stats):
+    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, stats, checkpoints=None, writer=None, page_size=1000, metrics=None, sink=None,
+                 reconstruct=False, fetch_batch_size=10000, cars=None, timezone=None):
         self.teslalogger_conn = teslalogger_conn
         self.teslamate_conn = teslamate_conn
         self.dry_run = dry_run
         self.stats = stats  # Reference to the subkey of the stats hash 
+        self.checkpoints = checkpoints  # Optional watermark store for incremental runs
+        self.writer = writer  # TeslaMate bulk writer, only used when not in dry run
+        self.page_size = page_size  # Rows per keyset page
+        self.metrics = metrics or EngineMetrics('drives')  # Per-phase timings and counters
+        # Receives merge candidates as they are matched, by default written back in batches
+        if sink is None:
+            sink = BatchSink(self._write_merges, writer.batch_size) if writer and not dry_run else CountingSink()
+        self.sink = sink
+        self.reconstruct = reconstruct  # Rebuild TeslaLogger drives from the pos stream
+        self.fetch_batch_size = fetch_batch_size  # Positions per round-trip when reconstructing
+        self.cars = cars  # {TeslaLogger CarID: TeslaMate car_id} to sync car by car, None mixes all cars
+        self.offsets = utc_offsets(timezone)  # UTC offset transitions of TeslaLogger's local time zone, None when UTC
+        self.write_columns = DRIVE_WRITE_COLUMNS + (DRIVE_AGGREGATE_COLUMNS if reconstruct else [])
+        # Rebuilt drives record pos ids, kept apart from the drivestate watermarks
+        key = 'drives:pos' if reconstruct else 'drives'
+        self.checkpoint_key = f'{key}:dryrun' if dry_run else key
         self.logger = logging.getLogger(__name__)
 
     def sync(self):
-        # Fetch drives from both databases
-        teslalogger_drives = self._fetch_teslalogger_drives()
-        teslamate_drives = self._fetch_teslamate_drives()
-
-        # Validate fetched drives
-        if teslalogger_drives is None:
-            self.logger.error("Failed to fetch TeslaLogger drives")
-            # Return empty list instead of None
-            return []
-        
-        if teslamate_drives is None:
-            self.logger.error("Failed to fetch TeslaMate drives")
-            # Return empty list instead of None
-            return []
-
-        # Detailed logging
-        self.logger.info(f"TeslaLogger Drives: {len(teslalogger_drives)}")
-        self.logger.info(f"TeslaMate Drives: {len(teslamate_drives)}")
-
-        # Find potential matches
-        potential_merges = self._find_drive_matches(
-            teslalogger_drives, 
-            teslamate_drives
-        )
+        try:
+            for car_id in self._cars():
+                # Stream drives from both databases, page by page
+                if self.reconstruct:
+                    teslalogger_drives = self.metrics.timed('fetch_teslalogger', self._reconstruct_teslalogger_drives(car_id), len)
+                else:
+                    teslalogger_drives = self.metrics.timed('fetch_teslalogger', self._fetch_teslalogger_drives(car_id), len)
+                teslamate_drives = self.metrics.timed('fetch_teslamate', self._fetch_teslamate_drives(car_id), len)
 
-        return potential_merges
+                # Find potential matches and stream them to the sink
+                for merge in self._find_drive_matches(
+                    records_to_utc(map_car_ids(teslalogger_drives, 'CarID', self.cars),
+                                   ('StartDate', 'EndDate'), self.offsets),
+                    teslamate_drives
+                ):
+                    self.sink.emit(merge)
+        except Exception as e:
+            self.logger.error(f"Error syncing drives: {e}")
+            self.sink.discard()
+            raise
+        self.sink.close()
+
+        if self.checkpoints:
+            self.checkpoints.commit(self.checkpoint_key)
+
+        return self.sink.count
 
-    def _fetch_teslalogger_drives(self):
+    def _cars(self):
+        # TeslaLogger cars synced one at a time, or None once for all cars together
+        if self.cars is None:
+            return [None]
+        return teslalogger_cars(self.teslalogger_conn, 'drivestate')
+
+    @sampled_timer
+    def _fetch_teslalogger_drives(self, car_id=None):
         """
-        Fetch drives from TeslaLogger database
+        Stream drives from TeslaLogger database in pages ordered by start date and id
         """
-        try:
-            # Use text() for raw SQL queries
-            query = text("SELECT * FROM drivestate LIMIT 1000")  # Adjust limit as needed
-            result = self.teslalogger_conn.execute(query)
-            
+        if self.checkpoints:
+            where, params = self.checkpoints.where_clause(self.checkpoint_key, 'CarID', 'StartDate')
+        else:
+            where, params = "1 = 1", {}
+        where, params = car_predicate(where, params, 'CarID', car_id)
+
+        fetched = 0
+        for rows in keyset_pages(self.teslalogger_conn, 'drivestate', ('StartDate', 'id'), where, params, self.page_size):
             # Convert to list of dictionaries
             drives = []
-            for row in result:
+            for row in rows:
+                if self.checkpoints:
+                    # Rebuilt drives record the pos ids they read instead
+                    row_id = None if self.reconstruct else getattr(row, 'id', None)
+                    self.checkpoints.track(self.checkpoint_key, row.CarID, row_id, row.StartDate)
+
                 try:
                     drive = {
+                        'id': getattr(row, 'id', None),
                         'StartDate': row.StartDate,
                         'EndDate': row.EndDate,
                         'CarID': row.CarID,
@@ -66,34 +114,102 @@ class DriveSync:
                     drives.append(drive)
                 except Exception as field_error:
                     self.logger.warning(f"Could not process drive row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(drives)} drives from TeslaLogger")
-            return drives
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaLogger drives: {e}")
-            return None
 
-    def _fetch_teslamate_drives(self):
+            fetched += len(drives)
+            yield drives
+
+        self.logger.info(f"Fetched {fetched} drives from TeslaLogger")
+
+    @sampled_timer
+    def _reconstruct_teslalogger_drives(self, car_id=None):
         """
-        Fetch drives from TeslaMate database
+        Stream TeslaLogger drives rebuilt from positions in pages ordered by start date
+
+        The pos stream is read once and cut at the drivestate boundaries, or by
+        speed and gaps where those are missing, so every aggregate is consistent
+        with the positions without querying them per drive.
         """
-        try:
-            # Use text() for raw SQL queries
-            query = text("SELECT * FROM drives LIMIT 1000")  # Adjust limit as needed
-            result = self.teslamate_conn.execute(query)
-            
+        # Boundaries are read up front, the streaming cursor below holds the connection
+        drivestates = [drive for page in self._fetch_teslalogger_drives(car_id) for drive in page]
+
+        if self.checkpoints:
+            where, params = self.checkpoints.where_clause(self.checkpoint_key, 'CarID', 'Datum')
+        else:
+            where, params = "1 = 1", {}
+        where, params = car_predicate(where, params, 'CarID', car_id)
+
+        result = self.teslalogger_conn.execute(
+            text(f"SELECT * FROM pos WHERE Datum IS NOT NULL AND {where} ORDER BY Datum, id"),
+            params,
+            execution_options=stream_options(self.fetch_batch_size)
+        )
+
+        last_ids = {}
+
+        def tracked(rows):
+            # Highest pos id read per car, recorded as the watermark id
+            for row in rows:
+                if row['id'] is not None and row['id'] > last_ids.get(row['CarID'], -1):
+                    last_ids[row['CarID']] = row['id']
+                yield row
+
+        reconstructor = DriveReconstructor(drivestates)
+        positions = (row._mapping for rows in result.partitions(self.fetch_batch_size) for row in rows)
+
+        drives = []
+        last_starts = {}
+        for drive in reconstructor.drives(tracked(positions)):
+            last_starts[drive['CarID']] = drive['StartDate']
+            drives.append(drive)
+            if len(drives) >= self.page_size:
+                yield drives
+                drives = []
+        if drives:
+            yield drives
+
+        if self.checkpoints:
+            for car, last_id in last_ids.items():
+                if car in last_starts:
+                    self.checkpoints.track(self.checkpoint_key, car, last_id, last_starts[car])
+
+        self.logger.info(
+            f"Reconstructed {reconstructor.counts['drivestate']} drives from drivestate boundaries "
+            f"and {reconstructor.counts['heuristic']} from speed and gaps"
+        )
+
+    @sampled_timer
+    def _fetch_teslamate_drives(self, car_id=None):
+        """
+        Stream drives from TeslaMate database in pages ordered by start date and id
+        """
+        since = self.checkpoints.earliest(self.checkpoint_key, car_id) if self.checkpoints else None
+        if since is not None and self.offsets is not None:
+            # Watermarks are TeslaLogger local time, TeslaMate stores UTC
+            since = self.offsets.utc_datetime(since)
+        if since is not None:
+            where, params = "start_date >= :since", {'since': since}
+        else:
+            where, params = "1 = 1", {}
+        if car_id is not None:
+            where, params = car_predicate(where, params, 'car_id', self.cars.get(car_id, car_id))
+
+        fetched = 0
+        for rows in keyset_pages(self.teslamate_conn, 'drives', ('start_date', 'id'), where, params, self.page_size):
             # Convert to list of dictionaries
             drives = []
-            for row in result:
+            for row in rows:
                 try:
                     drive = {
+                        'id': getattr(row, 'id', None),
                         'start_date': row.start_date,
                         'end_date': row.end_date,
                         'car_id': row.car_id,
-                        'distance': getattr(row, 'distance', None) or 
-                                    (getattr(row, 'end_km', 0) - getattr(row, 'start_km', 0)),
+                        'distance': getattr(row, 'distance', None) or _km_span(row),
                         'speed_max': getattr(row, 'speed_max', None),
+                        'power_max': getattr(row, 'power_max', None),
+                        'power_min': getattr(row, 'power_min', None),
+                        'start_km': getattr(row, 'start_km', None),
+                        'end_km': getattr(row, 'end_km', None),
                         'start_latitude': getattr(row, 'start_latitude', None),
                         'start_longitude': getattr(row, 'start_longitude', None),
                         'end_latitude': getattr(row, 'end_latitude', None),
@@ -102,52 +218,47 @@ class DriveSync:
                     drives.append(drive)
                 except Exception as field_error:
                     self.logger.warning(f"Could not process drive row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(drives)} drives from TeslaMate")
-            return drives
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaMate drives: {e}")
-            return None
 
+            fetched += len(drives)
+            yield drives
+
+        self.logger.info(f"Fetched {fetched} drives from TeslaMate")
+
+    @sampled_timer
     def _find_drive_matches(self, teslalogger_drives, teslamate_drives):
-        matches = []
-        
-        for tl_drive in teslalogger_drives:
-            for tm_drive in teslamate_drives:
-                # Match criteria
-                # Compare start times with a 5-minute tolerance
-                time_diff = abs(tl_drive['StartDate'] - tm_drive['start_date'])
-                
-                # Check if drives are from the same car
-                car_match = (tl_drive['CarID'] == tm_drive['car_id'])
-                
-                # Optional: Add distance proximity check
-                distance_match = True
-                if tl_drive['distance'] is not None and tm_drive['distance'] is not None:
-                    distance_match = abs(tl_drive['distance'] - tm_drive['distance']) < 1  # 1 km tolerance
-                
-                # Combine match criteria
-                if (time_diff <= timedelta(minutes=5) and 
-                    car_match and 
-                    distance_match):
-                    
-                    merged_drive = self._merge_drive_record(tl_drive, tm_drive)
-                    matches.append(merged_drive)
-
-        return matches
+        """
+        Pair TeslaLogger and TeslaMate drives one-to-one by overlapping time range.
+
+        Both inputs are streams of pages ordered by start date. Merges are
+        yielded as they are matched.
+        """
+        # Intervals are widened by a 5-minute tolerance before comparing
+        for tl_drive, tm_drive, _ in match_interval_pages(
+                teslalogger_drives, teslamate_drives,
+                ('CarID', 'StartDate', 'EndDate'),
+                ('car_id', 'start_date', 'end_date'),
+                timedelta(minutes=5),
+                self._distance_match):
+            self.stats['matched'] = self.stats.get('matched', 0) + 1
+            yield self._merge_drive_record(tl_drive, tm_drive)
+
+    def _distance_match(self, tl_drive, tm_drive):
+        # Optional: Add distance proximity check
+        if tl_drive['distance'] is not None and tm_drive['distance'] is not None:
+            return abs(tl_drive['distance'] - tm_drive['distance']) < 1  # 1 km tolerance
+        return True
 
     def _merge_drive_record(self, teslalogger_drive, teslamate_drive):
         # Merge logic for drive records
         merged_drive = {
+            'teslalogger_id': teslalogger_drive.get('id'),
+            'teslamate_id': teslamate_drive.get('id'),
             'start_date': min(
                 teslalogger_drive['StartDate'], 
                 teslamate_drive['start_date']
             ),
-            'end_date': max(
-                teslalogger_drive.get('EndDate') or teslamate_drive['end_date'], 
-                teslamate_drive['end_date']
-            ),
+            # Either side may still be open, the current drive has no end yet
+            'end_date': latest_end(teslalogger_drive.get('EndDate'), teslamate_drive['end_date']),
             'car_id': teslalogger_drive['CarID'],
             'distance': max(
                 teslalogger_drive.get('distance', 0) or 0, 
@@ -157,6 +268,10 @@ class DriveSync:
                 teslalogger_drive.get('speed_max', 0) or 0, 
                 teslamate_drive.get('speed_max', 0) or 0
             ),
+            'power_max': _bound(max, teslalogger_drive.get('power_max'), teslamate_drive.get('power_max')),
+            'power_min': _bound(min, teslalogger_drive.get('power_min'), teslamate_drive.get('power_min')),
+            'start_km': _bound(min, teslalogger_drive.get('start_km'), teslamate_drive.get('start_km')),
+            'end_km': _bound(max, teslalogger_drive.get('end_km'), teslamate_drive.get('end_km')),
             'start_location': {
                 'latitude': teslalogger_drive.get('start_latitude') or teslamate_drive.get('start_latitude'),
                 'longitude': teslalogger_drive.get('start_longitude') or teslamate_drive.get('start_longitude')
@@ -166,16 +281,30 @@ class DriveSync:
                 'longitude': teslalogger_drive.get('end_longitude') or teslamate_drive.get('end_longitude')
             }
         }
+        if merged_drive['end_date'] is not None:
+            merged_drive['duration_min'] = round((merged_drive['end_date'] - merged_drive['start_date']).total_seconds() / 60)
+        else:
+            # A drive still open on both sides has no span yet, only the rebuilt one knows its duration so far
+            merged_drive['duration_min'] = teslalogger_drive.get('duration_min')
         return merged_drive
 
-    def log_potential_merges(self, potential_merges):
-        self.logger.info(f"Dry Run - Potential Drive Merges: {len(potential_merges)}")
-        for merge in potential_merges:
-            self.logger.info(f"Would merge drive: {merge}")
-
-        if potential_merges:
-            self.logger.warning("""
-            DRY RUN MODE ACTIVE
-            Potential drive merges detected.
-            To apply changes, set DRYRUN=0
-            """)
+    def _teslamate_row(self, merged_drive):
+        # Flatten a merged drive into the TeslaMate columns that are written back
+        return {'id': merged_drive['teslamate_id'], **{column: merged_drive[column] for column in self.write_columns}}
+
+    def _write_merges(self, merges):
+        # Update the matched TeslaMate rows from a batch of merges
+        self.writer.update_rows('drives', self.write_columns, [
+            self._teslamate_row(merge) for merge in merges if merge.get('teslamate_id') is not None
+        ])
+
+def _km_span(row):
+    # Odometer distance of a TeslaMate drive, None while it is open and has no end_km
+    start_km = getattr(row, 'start_km', None)
+    end_km = getattr(row, 'end_km', None)
+    return end_km - start_km if start_km is not None and end_km is not None else None
+
+def _bound(pick, *values):
+    # min or max of the values that are present, None when none is
+    present = [value for value in values if value is not None]
+    return pick(present) if present else None
@@ -0,0 +1,148 @@
+import math
+from array import array
+from datetime import datetime, timedelta
+
+# Naive timestamps are interpreted as UTC when converted to epoch seconds
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+# Column name -> array typecode. Missing floats are stored as NaN, missing
+# small integers ('i', integer columns in TeslaMate) as MISSING_INTEGER.
+POSITION_COLUMNS = [
+    ('id', 'q'),
+    ('timestamp', 'q'),  # whole epoch seconds, both databases store no fractions
+    ('car_id', 'q'),
+    ('lat', 'd'),
+    ('lng', 'd'),
+    ('battery_level', 'i'),
+    ('ideal_battery_range_km', 'd'),
+    ('odometer', 'd'),
+    ('speed', 'i'),
+    ('power', 'i'),
+    ('heading', 'd'),
+]
+
+# Source columns of each database feeding the batch columns
+TESLALOGGER_POSITION_COLUMNS = {
+    'id': 'id', 'timestamp': 'Datum', 'car_id': 'CarID', 'lat': 'lat', 'lng': 'lng',
+    'battery_level': 'battery_level', 'ideal_battery_range_km': 'ideal_battery_range_km',
+    'odometer': 'odometer', 'speed': 'speed', 'power': 'power', 'heading': 'heading',
+}
+TESLAMATE_POSITION_COLUMNS = {
+    'id': 'id', 'timestamp': 'date', 'car_id': 'car_id', 'lat': 'latitude', 'lng': 'longitude',
+    'battery_level': 'battery_level', 'ideal_battery_range_km': 'ideal_battery_range_km',
+    'odometer': 'odometer', 'speed': 'speed', 'power': 'power', 'heading': 'heading',
+}
+
+NAN = float('nan')
+MISSING_INTEGER = -2 ** 31
+
+class PositionBatch:
+    """
+    Columnar, array-backed batch of positions.
+
+    Each attribute is an array.array column, so a sample costs a few dozen
+    bytes instead of a dictionary. Records are only materialised with
+    record() for rows that leave the matcher.
+    """
+
+    def __init__(self):
+        for name, typecode in POSITION_COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def extend(self, rows, indexes):
+        """
+        Append database rows, reading the source columns at the given positions.
+
+        :param indexes: Column name -> index into each row, or None when the source lacks it
+        """
+        integer_columns = []
+        nullable_columns = []
+        float_columns = []
+        for name, typecode in POSITION_COLUMNS:
+            if name == 'timestamp':
+                continue
+            target = {'q': integer_columns, 'i': nullable_columns}.get(typecode, float_columns)
+            target.append((getattr(self, name), indexes[name]))
+
+        timestamps = self.timestamp
+        timestamp_index = indexes['timestamp']
+
+        for row in rows:
+            timestamps.append((row[timestamp_index] - EPOCH) // ONE_SECOND)
+            for column, index in integer_columns:
+                value = row[index] if index is not None else None
+                column.append(value if value is not None else 0)
+            for column, index in nullable_columns:
+                value = row[index] if index is not None else None
+                column.append(int(round(value)) if value is not None else MISSING_INTEGER)
+            for column, index in float_columns:
+                value = row[index] if index is not None else None
+                column.append(float(value) if value is not None else NAN)
+
+    def subset(self, rows):
+        """
+        Return a new batch holding the given row numbers, in order.
+        """
+        rows = list(rows)
+        batch = PositionBatch()
+        for name, _ in POSITION_COLUMNS:
+            source = getattr(self, name)
+            getattr(batch, name).extend(source[i] for i in rows)
+        return batch
+
+    def append(self, other):
+        """
+        Append every row of another batch.
+        """
+        for name, _ in POSITION_COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def timestamps_to_utc(self, offsets):
+        """
+        Convert the local timestamps of the batch to UTC, in place, with one vectorized call.
+
+        :param offsets: UtcOffsets table of the zone the timestamps were recorded in
+        """
+        converted = array('q')
+        converted.frombytes(offsets.to_utc(self.timestamp).astype('int64').tobytes())
+        self.timestamp = converted
+
+    def map_car_ids(self, mapping):
+        """
+        Replace every car id with its entry in mapping, in place.
+        """
+        self.car_id = array('q', (mapping.get(car_id, car_id) for car_id in self.car_id))
+
+    def has_coordinates(self, i):
+        lat = self.lat[i]
+        lng = self.lng[i]
+        # NaN marks a missing value, zero is treated as missing like before
+        return bool(lat and lng) and not (math.isnan(lat) or math.isnan(lng))
+
+    def record(self, i):
+        """
+        Materialise row i as a dictionary keyed by TeslaMate position columns.
+        """
+        record = {'date': EPOCH + timedelta(seconds=self.timestamp[i])}
+        for name, typecode in POSITION_COLUMNS:
+            if name == 'timestamp':
+                continue
+            value = getattr(self, name)[i]
+            if (typecode == 'd' and math.isnan(value)) or (typecode == 'i' and value == MISSING_INTEGER):
+                value = None
+            record[name] = value
+
+        record['latitude'] = record.pop('lat')
+        record['longitude'] = record.pop('lng')
+        return record
+
+def column_indexes(keys, source_columns):
+    """
+    Resolve batch columns to row positions for a result with the given keys.
+    """
+    positions = {key: index for index, key in enumerate(keys)}
+    return {name: positions.get(source) for name, source in source_columns.items()}
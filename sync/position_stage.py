@@ -0,0 +1,121 @@
+import csv
+import io
+import logging
+from datetime import timedelta
+from sqlalchemy import text
+from database.cars import car_predicate
+from sync.position_batch import EPOCH, PositionBatch, TESLAMATE_POSITION_COLUMNS, column_indexes
+
+# Session-local TeslaMate table holding the TeslaLogger positions of one partition
+STAGE_TABLE = 'tesla_sync_position_stage'
+
+# Same car and second with the same coordinates, missing coordinates compare equal
+EXACT_DUPLICATE = (
+    "s.car_id = p.car_id AND s.date = date_trunc('second', p.date) "
+    "AND s.lat IS NOT DISTINCT FROM p.latitude::double precision "
+    "AND s.lng IS NOT DISTINCT FROM p.longitude::double precision"
+)
+
+class PositionStage:
+    """
+    Removes exact duplicate positions inside the TeslaMate database.
+
+    Each TeslaLogger partition is copied into a temporary table with COPY
+    FROM STDIN. Indexed anti-joins against positions then return only the
+    TeslaLogger positions without an exact TeslaMate duplicate and the
+    TeslaMate positions that none of them duplicates, so only those reach
+    the fuzzy matcher. Requires a PostgreSQL TeslaMate database.
+    """
+
+    def __init__(self, teslamate_conn):
+        self.engine = teslamate_conn.get_bind()
+        self.connection = None  # Temporary tables only exist on the connection that created them
+        self.logger = logging.getLogger(__name__)
+
+    def supported(self):
+        return self.engine.dialect.name == 'postgresql'
+
+    def open(self):
+        """
+        Check out a dedicated connection and create the staging table on it.
+        """
+        self.connection = self.engine.connect()
+        self.connection.execute(text(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGE_TABLE} "
+            f"(id bigint PRIMARY KEY, car_id bigint, date timestamp, lat double precision, lng double precision)"
+        ))
+        self.connection.execute(text(f"CREATE INDEX IF NOT EXISTS {STAGE_TABLE}_car_date ON {STAGE_TABLE} (car_id, date)"))
+        self.connection.commit()
+
+    def close(self):
+        # Returning the connection to the pool keeps the table, so drop it first
+        if self.connection is not None:
+            try:
+                self.connection.rollback()
+                self.connection.execute(text(f"DROP TABLE IF EXISTS {STAGE_TABLE}"))
+                self.connection.commit()
+            finally:
+                self.connection.close()
+                self.connection = None
+
+    def load(self, batch):
+        """
+        Replace the staged positions with a TeslaLogger batch.
+
+        :param batch: PositionBatch of TeslaLogger positions
+        :return: Ids of the staged positions without an exact TeslaMate duplicate
+        """
+        if self.connection is None:
+            self.open()
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row_id, timestamp, car_id, lat, lng in zip(batch.id, batch.timestamp, batch.car_id, batch.lat, batch.lng):
+            # NaN marks a missing coordinate and becomes an unquoted NULL
+            writer.writerow([
+                row_id, car_id, (EPOCH + timedelta(seconds=timestamp)).isoformat(sep=' '),
+                repr(lat) if lat == lat else None, repr(lng) if lng == lng else None,
+            ])
+        buffer.seek(0)
+
+        self.connection.execute(text(f"TRUNCATE {STAGE_TABLE}"))
+        cursor = self.connection.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {STAGE_TABLE} (id, car_id, date, lat, lng) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+        self.connection.execute(text(f"ANALYZE {STAGE_TABLE}"))
+
+        result = self.connection.execute(text(
+            f"SELECT s.id FROM {STAGE_TABLE} s WHERE NOT EXISTS "
+            f"(SELECT 1 FROM positions p WHERE p.car_id = s.car_id "
+            f"AND p.date >= s.date AND p.date < s.date + interval '1 second' AND {EXACT_DUPLICATE})"
+        ))
+        leftover = {row.id for row in result}
+        self.connection.commit()
+
+        self.logger.info(f"Staged {len(batch)} TeslaLogger positions, {len(batch) - len(leftover)} exact duplicates")
+        return leftover
+
+    def teslamate_leftovers(self, start, end, fetch_batch_size=10000, car_id=None):
+        """
+        Return the TeslaMate positions in [start, end), of one car or all, that no staged position duplicates.
+        """
+        where, params = car_predicate("p.date >= :start AND p.date < :end", {'start': start, 'end': end}, 'p.car_id', car_id)
+        result = self.connection.execute(
+            text(
+                f"SELECT * FROM positions p WHERE {where} "
+                f"AND NOT EXISTS (SELECT 1 FROM {STAGE_TABLE} s WHERE {EXACT_DUPLICATE}) ORDER BY p.date"
+            ),
+            params,
+        )
+
+        batch = PositionBatch()
+        indexes = column_indexes(result.keys(), TESLAMATE_POSITION_COLUMNS)
+        while True:
+            rows = result.fetchmany(fetch_batch_size)
+            if not rows:
+                break
+            batch.extend(rows, indexes)
+        self.connection.commit()
+        return batch
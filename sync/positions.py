@@ -1,10 +1,37 @@
 import logging
-from utils.helpers import haversine_distance
-from sqlalchemy import text
-from datetime import timedelta
+from database.teslalogger_connection import establish_teslalogger_connection
+from database.teslamate_connection import establish_teslamate_connection
+from database.cars import car_predicate
+from database.pool import stream_options
+from sync.position_stage import PositionStage
+from sync.position_batch import (EPOCH, ONE_SECOND, PositionBatch, TESLALOGGER_POSITION_COLUMNS,
+                                 TESLAMATE_POSITION_COLUMNS, column_indexes)
+from sync.sinks import CountingSink
+from utils.metrics import EngineMetrics
+from utils.profiling import sampled_timer
+from utils.spatial_index import SpatioTemporalIndex
+from utils.timezones import utc_offsets
+from sqlalchemy import DateTime, text
+from datetime import date, datetime, time, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import multiprocessing
+import numpy as np
+from bisect import bisect_left
+from itertools import groupby, repeat
+
+# Matching tolerances for positions
+POSITION_TIME_WINDOW = 30  # seconds
+POSITION_DISTANCE_THRESHOLD = 10  # meters
+
+# TeslaLogger positions measured per vectorized distance call
+PROXIMITY_BATCH_SIZE = 10000
 
 class PositionSync:
-    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, test_position, stats, position_limit):
+    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, test_position, stats, position_limit,
+                 partition_hours=24, fetch_batch_size=10000, checkpoints=None, workers=1, config=None,
+                 sink=None, metrics=None, skip_unchanged=False, staging=False, cars=None, timezone=None):
         self.debug_print = 1
         self.teslalogger_conn = teslalogger_conn
         self.teslamate_conn = teslamate_conn
@@ -12,219 +39,717 @@ class PositionSync:
         self.test_position = test_position
         self.stats = stats  # Reference to the subkey of the stats hash
         self.position_limit = position_limit  # Limit for the number of positions to fetch
+        self.partition_size = timedelta(hours=partition_hours)  # Width of each client-side partition
+        self.fetch_batch_size = fetch_batch_size  # Rows buffered per round-trip by streaming cursors
+        self.checkpoints = checkpoints  # Optional watermark store for incremental runs
+        self.checkpoint_key = 'positions:dryrun' if dry_run else 'positions'
+        self.workers = workers  # Number of processes partitions are spread across
+        self.config = config  # Needed by worker processes to open their own connections
+        self.sink = sink or CountingSink()  # Receives merge candidates as they are produced
+        self.metrics = metrics or EngineMetrics('positions')  # Per-phase timings and counters
+        self.skip_unchanged = skip_unchanged  # Skip days whose (car, day) fingerprints are cached
+        self.fingerprints = {}  # Current {(side, car_id, day): fingerprint} of the synced range
+        self.not_written = 0  # Candidates held back from the writer
+        self.staging = staging  # Remove exact duplicates inside TeslaMate before matching
+        self.stage = None
+        self.cars = cars  # {TeslaLogger CarID: TeslaMate car_id} to sync car by car, None mixes all cars
+        self.timezone = timezone  # Zone of TeslaLogger's local timestamps, None when they are UTC
+        self.offsets = utc_offsets(timezone)  # Cached UTC offset transitions of that zone
+        self.car_ranges = {}  # TeslaLogger CarID -> [start, end) of its positions past the watermark
+        self.watermark_filter = ("1 = 1", {})
+        self.high_water = {}
         self.logger = logging.getLogger(__name__)
 
     def sync(self):
         """
         Sync positions between TeslaLogger and TeslaMate databases.
+
+        Merge candidates are streamed to the sink as they are found.
+
+        :return: Number of merge candidates emitted
         """
-        # Get the list of distinct dates
-        distinct_dates = self._get_distinct_dates()
-        potential_merges = []
+        self.watermark_filter = self._watermark_clause()
+        self.high_water = {}
+        self.fingerprints = {}
+        self.not_written = 0
+
+        # Get the overall date range covered by TeslaLogger
+        date_range = self._get_date_range()
+
+        if date_range is None:
+            self.sink.close()
+            return 0
+
+        start, end = date_range
+
+        try:
+            # Only partitions holding a (car, day) that changed since the last successful run
+            changed = self._changed_days(start, end) if self.skip_unchanged and self.checkpoints else None
+            partitions = [partition for partition in self._partition_bounds(start, end)
+                          if changed is None or self._partition_changed(partition, changed)]
 
-        # Iterate through each date and process positions
-        for date in distinct_dates:
-            self.logger.info(f"Processing positions for date: {date}")
-            
-            # Fetch positions for the specific date
-            teslalogger_positions = self._fetch_teslalogger_positions(date)
-            teslamate_positions = self._fetch_teslamate_positions(date)
+            if self.workers > 1:
+                self._sync_parallel(partitions)
+            else:
+                for car_id, range_start, range_end in self._contiguous_ranges(partitions):
+                    for match in self._sync_range(range_start, range_end, car_id):
+                        self._emit(match)
 
-            # Validate fetched positions
-            if teslalogger_positions is None:
-                self.logger.error(f"Failed to fetch TeslaLogger positions for date: {date}")
-                return []
-            
-            if teslamate_positions is None:
-                self.logger.error(f"Failed to fetch TeslaMate positions for date: {date}")
-                return []
+        except Exception as e:
+            self.logger.error(f"Error streaming positions between {start} and {end}: {e}")
+            self.sink.discard()
+            raise
+        finally:
+            if self.stage is not None:
+                self.stage.close()
+                self.stage = None
+        self.sink.close()
+
+        if self.not_written:
+            self.logger.info(f"Held back {self.not_written} positions that TeslaMate has within range or that lack coordinates")
+
+        # Only advance the watermarks once every partition was processed
+        if self.checkpoints:
+            for car_id, (last_id, last_date) in self.high_water.items():
+                self.checkpoints.track(self.checkpoint_key, car_id, last_id, last_date)
+            self.checkpoints.commit(self.checkpoint_key)
 
-            # Find potential matches
-            potential_merges.append(self._find_position_matches(
-                teslalogger_positions, 
-                teslamate_positions
-            ))
+            # Every candidate of the synced days has been emitted, so they are reconciled.
+            # Days that got positions written have a new TeslaMate fingerprint and are checked once more.
+            self.checkpoints.save_fingerprints(self.checkpoint_key, self.fingerprints)
 
-        return potential_merges
+        return self.sink.count
 
-    def _get_distinct_dates(self):
+    def _sync_range(self, start, end, car_id=None):
         """
-        Retrieve a list of distinct dates from both databases.
+        Match all partitions of [start, end) from one ordered range scan per database.
+
+        With a car_id only that car is read from both databases. Yields merge
+        candidates, holding at most one partition in memory.
         """
-        try:
-            query = text("SELECT DISTINCT DATE(Datum) as date FROM pos ORDER BY date")
-            result = self.teslalogger_conn.execute(query)
-            dates = [row.date for row in result]
-            self.logger.info(f"Found {len(dates)} distinct dates in TeslaLogger database")
-            return dates
-        except Exception as e:
-            self.logger.error(f"Error fetching distinct dates: {e}")
-            return []
+        # One ordered range scan per database, cut into columnar partitions client side
+        teslalogger_partitions = self.metrics.timed(
+            'fetch_teslalogger', self._stream_teslalogger_positions(start, end, car_id), self._partition_rows)
+        stage = self._position_stage()
+        if stage is not None:
+            partitions = self._staged_partitions(stage, teslalogger_partitions, self._teslamate_car(car_id))
+        else:
+            teslamate_partitions = self.metrics.timed(
+                'fetch_teslamate', self._stream_teslamate_positions(start, end, self._teslamate_car(car_id)),
+                self._partition_rows)
+            partitions = self._partition_positions(teslalogger_partitions, teslamate_partitions)
+
+        for partition_start, teslalogger_positions, teslamate_positions in partitions:
+            self.logger.info(f"Processing positions for partition: {partition_start}")
+            self.logger.info(f"Fetched {len(teslalogger_positions)} positions from TeslaLogger for partition: {partition_start}")
+            self.logger.info(f"Fetched {len(teslamate_positions)} positions from TeslaMate for partition: {partition_start}")
 
-    def _fetch_teslalogger_positions(self, date):
+            # Find potential matches, only materialising the rows to add
+            for row, teslamate_row in self._find_position_matches(teslalogger_positions, teslamate_positions):
+                record = teslalogger_positions.record(row)
+                record['teslalogger_id'] = record.pop('id')
+                record['teslamate_id'] = teslamate_positions.id[teslamate_row] if teslamate_row is not None else None
+                yield record
+
+    def _sync_parallel(self, partitions):
         """
-        Fetch positions from TeslaLogger database for a specific date.
+        Spread partitions across a process pool, each worker with its own connections.
+
+        Results are emitted in partition order and the per-worker stats are
+        merged into this engine's stats. Only a bounded number of partitions
+        is in flight at any time.
         """
-        try:
-            query = text(f"SELECT * FROM pos WHERE DATE(Datum) = :date")
-            result = self.teslalogger_conn.execute(query, {'date': date})
-            
-            # Convert to list of dictionaries
-            positions = []
-            for row in result:
-                try:
-                    position = {
-                        'Datum': row.Datum,
-                        'CarID': row.CarID,
-                        'lat': float(getattr(row, 'lat', None)) if getattr(row, 'lat', None) is not None else None,
-                        'lng': float(getattr(row, 'lng', None)) if getattr(row, 'lng', None) is not None else None,
-                        'battery_level': getattr(row, 'battery_level', None),
-                        'ideal_battery_range_km': getattr(row, 'ideal_battery_range_km', None),
-                        'odometer': getattr(row, 'odometer', None),
-                        'speed': getattr(row, 'speed', None),
-                        'power': getattr(row, 'power', None),
-                        'heading': getattr(row, 'heading', None),
-                    }
-                    positions.append(position)
-                except Exception as field_error:
-                    self.logger.warning(f"Could not process row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(positions)} positions from TeslaLogger for date: {date}")
-            return positions
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaLogger positions for date {date}: {e}")
-            return None
+        self.logger.info(f"Processing position partitions with {self.workers} workers")
+
+        options = {
+            'dry_run': self.dry_run,
+            'test_position': self.test_position,
+            'position_limit': self.position_limit,
+            'partition_hours': self.partition_size / timedelta(hours=1),
+            'fetch_batch_size': self.fetch_batch_size,
+            'staging': self.staging,
+            'cars': self.cars,
+            'timezone': self.timezone,
+        }
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(self.config, options)) as pool:
+            in_flight = deque()
+            for partition in partitions:
+                in_flight.append(pool.submit(_sync_partition, partition))
+                if len(in_flight) >= self.workers * 2:
+                    self._collect_partition(in_flight.popleft().result())
+
+            while in_flight:
+                self._collect_partition(in_flight.popleft().result())
+
+    def _partition_bounds(self, start, end):
+        """
+        Yield (car_id, partition_start, partition_end, watermark_filter) work units.
+
+        Without a car mapping a single unit sequence covers [start, end) for
+        all cars, car_id being None. Otherwise every car gets its own units
+        over the range of its own positions.
+        """
+        ranges = [(None, start, end)] if self.cars is None else [
+            (car_id, car_start, car_end) for car_id, (car_start, car_end) in sorted(self.car_ranges.items())
+        ]
+        for car_id, range_start, range_end in ranges:
+            partition_start = range_start
+            while partition_start < range_end:
+                partition_end = min(partition_start + self.partition_size, range_end)
+                yield car_id, partition_start, partition_end, self.watermark_filter
+                partition_start = partition_end
+
+    def _partition_changed(self, partition, changed):
+        # Whether a work unit covers a changed (car, day), of any car for an all-car unit
+        car_id, partition_start, partition_end, _ = partition
+        days = self._partition_days(partition_start, partition_end)
+        if car_id is None:
+            return any(day in days for _, day in changed)
+        return any((car_id, day) in changed for day in days)
+
+    def _teslamate_car(self, car_id):
+        # TeslaMate car_id of a TeslaLogger CarID
+        if car_id is None or not self.cars:
+            return car_id
+        return self.cars.get(car_id, car_id)
+
+    def _collect_partition(self, result):
+        """
+        Merge a worker's partition result into this engine and emit its matches.
+        """
+        matches, stats, high_water, phases = result
+        self.metrics.merge(phases)
+        for key, value in stats.items():
+            self.stats[key] = self.stats.get(key, 0) + value
+        for car_id, (last_id, last_date) in high_water.items():
+            self._track(car_id, last_id, last_date)
+        for match in matches:
+            self._emit(match)
+
+    def _emit(self, match):
+        # Only new positions are written, a position within range is already in TeslaMate
+        # and TeslaMate requires coordinates
+        if not self.dry_run and (match['teslamate_id'] is not None or
+                                 match['latitude'] is None or match['longitude'] is None):
+            self.not_written += 1
+            return
+        self.sink.emit(match)
+
+    def _contiguous_ranges(self, partitions):
+        """
+        Merge adjacent partitions of a car into (car_id, start, end) ranges scanned in one pass.
+        """
+        ranges = []
+        for car_id, partition_start, partition_end, _ in partitions:
+            if ranges and ranges[-1][0] == car_id and ranges[-1][2] == partition_start:
+                ranges[-1][2] = partition_end
+            else:
+                ranges.append([car_id, partition_start, partition_end])
+        return [tuple(bounds) for bounds in ranges]
+
+    def _partition_days(self, start, end):
+        # ISO dates of the days overlapping [start, end)
+        days = set()
+        day = start.date()
+        while day <= (end - timedelta(microseconds=1)).date():
+            days.add(day.isoformat())
+            day += timedelta(days=1)
+        return days
+
+    def _changed_days(self, start, end):
+        """
+        Return the (TeslaLogger CarID, day) pairs in [start, end) whose fingerprints,
+        on either side, differ from the ones cached by the last successful run.
+
+        A fingerprint is the row count, first and last timestamp and the sums
+        of the coordinates rounded to about a meter, per (car, day) and side.
+        """
+        with self.metrics.phase('fetch_teslalogger'):
+            self.fingerprints = self._fetch_fingerprints(
+                'teslalogger', self.teslalogger_conn, 'pos', 'CarID', 'Datum', 'lat', 'lng', start, end)
+        with self.metrics.phase('fetch_teslamate'):
+            self.fingerprints.update(self._fetch_fingerprints(
+                'teslamate', self.teslamate_conn, 'positions', 'car_id', 'date', 'latitude', 'longitude', start, end))
+
+        cached = self.checkpoints.fingerprints(self.checkpoint_key)
+
+        # Days without TeslaLogger positions have nothing to add
+        teslalogger_days = [(car_id, day) for side, car_id, day in self.fingerprints if side == 'teslalogger']
+        changed = set()
+        for car_id, day in teslalogger_days:
+            keys = (('teslalogger', car_id, day), ('teslamate', self._teslamate_car(car_id), day))
+            if any(self.fingerprints.get(key) != cached.get(key) for key in keys):
+                changed.add((car_id, day))
+
+        self.logger.info(f"Position car days changed since the last run: {len(changed)} of {len(teslalogger_days)}")
 
-    def _fetch_teslamate_positions(self, date):
+        # TeslaLogger days are local, partitions UTC, so a changed day can reach into its neighbours
+        if self.offsets is not None:
+            changed |= {(car_id, (date.fromisoformat(day) + timedelta(days=shift)).isoformat())
+                        for car_id, day in changed for shift in (-1, 1)}
+        return changed
+
+    def _fetch_fingerprints(self, side, conn, table, car_column, date_column, lat_column, lng_column, start, end):
+        """
+        Run one grouped aggregate query returning {(side, car_id, day): fingerprint}.
         """
-        Fetch positions from TeslaMate database for a specific date.
+        query = text(
+            f"SELECT {car_column} AS car_id, DATE({date_column}) AS day, COUNT(*) AS row_count, "
+            f"MIN({date_column}) AS first_date, MAX({date_column}) AS last_date, "
+            f"SUM(ROUND({lat_column} * 100000)) AS lat_sum, SUM(ROUND({lng_column} * 100000)) AS lng_sum "
+            f"FROM {table} WHERE {date_column} >= :start AND {date_column} < :end "
+            f"GROUP BY {car_column}, DATE({date_column})"
+        ).columns(first_date=DateTime, last_date=DateTime)
+
+        fingerprints = {}
+        for row in conn.execute(query, {'start': start, 'end': end}):
+            fingerprints[(side, row.car_id, str(row.day)[:10])] = (
+                f"{row.row_count}|{row.first_date.isoformat()}|{row.last_date.isoformat()}|"
+                f"{int(row.lat_sum or 0)}|{int(row.lng_sum or 0)}"
+            )
+        return fingerprints
+
+    def _partition_rows(self, partition):
+        # Rows in a (partition_start, PositionBatch) item
+        return len(partition[1])
+
+    def _get_date_range(self):
+        """
+        Retrieve the half-open [start, end) range of whole days covered by TeslaLogger
+        positions that are past the watermarks.
+
+        Each car is bounded by its own query on the (CarID, Datum) index, so
+        MIN and MAX are read from the two ends of one index range instead of
+        grouping the whole table.
         """
         try:
-            query = text(f"SELECT * FROM positions WHERE DATE(date) = :date")
-            result = self.teslamate_conn.execute(query, {'date': date})
-            
-            # Convert to list of dictionaries
-            positions = []
-            for row in result:
-                try:
-                    position = {
-                        'date': row.date,
-                        'car_id': row.car_id,
-                        'latitude': float(getattr(row, 'latitude', None)) if getattr(row, 'latitude', None) is not None else None,
-                        'longitude': float(getattr(row, 'longitude', None)) if getattr(row, 'longitude', None) is not None else None,
-                        'battery_level': getattr(row, 'battery_level', None),
-                        'odometer': getattr(row, 'odometer', None),
-                        'speed': getattr(row, 'speed', None),
-                        'power': getattr(row, 'power', None),
-                        'heading': getattr(row, 'heading', None),
-                    }
-                    positions.append(position)
-                except Exception as field_error:
-                    self.logger.warning(f"Could not process row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(positions)} positions from TeslaMate for date: {date}")
-            return positions
-        
+            since = self.checkpoints.since(self.checkpoint_key) if self.checkpoints else {}
+            rows = []
+            with self.metrics.phase('fetch_teslalogger'):
+                car_ids = self._teslalogger_car_ids()
+                for car_id in car_ids:
+                    first_date, last_date = self._car_date_range(car_id, since.get(car_id))
+                    if first_date is not None:
+                        rows.append((car_id, first_date, last_date))
+            # Cars without a CarID are only synced together with the others
+            if self.cars is not None and None in car_ids:
+                skipped = self.teslalogger_conn.execute(text("SELECT COUNT(*) FROM pos WHERE CarID IS NULL")).scalar()
+                self.logger.warning(f"Skipping {skipped} TeslaLogger positions without a CarID, synced car by car")
+                rows = [row for row in rows if row[0] is not None]
+            if not rows:
+                self.logger.info("No positions found in TeslaLogger database")
+                return None
+
+            # Whole UTC days per car
+            self.car_ranges = {
+                car_id: (datetime.combine(self._utc(first_date).date(), time.min),
+                         datetime.combine(self._utc(last_date).date(), time.min) + timedelta(days=1))
+                for car_id, first_date, last_date in rows if car_id is not None
+            }
+            start = datetime.combine(self._utc(min(first_date for _, first_date, _ in rows)).date(), time.min)
+            end = datetime.combine(self._utc(max(last_date for _, _, last_date in rows)).date(), time.min) + timedelta(days=1)
+            self.logger.info(f"TeslaLogger positions range from {start} to {end} over {len(self.car_ranges)} car(s)")
+            return start, end
         except Exception as e:
-            self.logger.error(f"Error fetching TeslaMate positions for date {date}: {e}")
-            return None
+            self.logger.error(f"Error fetching position date range: {e}")
+            raise
+
+    def _utc(self, timestamp):
+        # UTC datetime of a TeslaLogger timestamp
+        return self.offsets.utc_datetime(timestamp) if self.offsets is not None else timestamp
+
+    def _teslalogger_car_ids(self):
+        """
+        Return the CarIDs of the TeslaLogger positions, None included when some have no car.
+
+        Every car is found with one seek on the CarID index, as the next id
+        above the previous one, so the table is never scanned.
+        """
+        car_ids = []
+        previous = self.teslalogger_conn.execute(text("SELECT MIN(CarID) FROM pos")).scalar()
+        while previous is not None:
+            car_ids.append(previous)
+            previous = self.teslalogger_conn.execute(
+                text("SELECT MIN(CarID) FROM pos WHERE CarID > :previous"), {'previous': previous}
+            ).scalar()
+        if self.teslalogger_conn.execute(text("SELECT 1 FROM pos WHERE CarID IS NULL LIMIT 1")).first():
+            car_ids.append(None)
+        return car_ids
+
+    def _car_date_range(self, car_id, since=None):
+        """
+        Return the (first, last) Datum of one car's positions from since on, (None, None) when it has none.
+        """
+        where, params = ("CarID IS NULL", {}) if car_id is None else ("CarID = :car_id", {'car_id': car_id})
+        if since is not None:
+            where, params = f"{where} AND Datum >= :since", {**params, 'since': since}
+
+        query = text(
+            f"SELECT MIN(Datum) AS first_date, MAX(Datum) AS last_date FROM pos WHERE {where}"
+        ).columns(first_date=DateTime, last_date=DateTime)
+        row = self.teslalogger_conn.execute(query, params).one()
+        return row.first_date, row.last_date
+
+    def _watermark_clause(self):
+        """
+        Predicate limiting TeslaLogger positions to those past each car's watermark.
+        """
+        if self.checkpoints:
+            return self.checkpoints.where_clause(self.checkpoint_key, 'CarID', 'Datum')
+        return "1 = 1", {}
+
+    def _track(self, car_id, row_id, timestamp):
+        """
+        Record the highest TeslaLogger id and timestamp seen per car.
+        """
+        last_id, last_date = self.high_water.get(car_id, (None, None))
+        if row_id is not None and (last_id is None or row_id > last_id):
+            last_id = row_id
+        if last_date is None or timestamp > last_date:
+            last_date = timestamp
+        self.high_water[car_id] = (last_id, last_date)
+
+    def _track_batch(self, batch):
+        """
+        Record the high-water marks of a TeslaLogger batch.
+        """
+        marks = {}
+        for car_id, row_id, timestamp in zip(batch.car_id, batch.id, batch.timestamp):
+            mark = marks.get(car_id)
+            if mark is None:
+                marks[car_id] = [row_id, timestamp]
+            else:
+                mark[0] = max(mark[0], row_id)
+                mark[1] = max(mark[1], timestamp)
 
+        for car_id, (row_id, timestamp) in marks.items():
+            # Watermarks are compared with Datum, so they stay in TeslaLogger's local time
+            if self.offsets is not None:
+                timestamp = int(self.offsets.to_local(timestamp))
+            self._track(car_id, row_id, EPOCH + timedelta(seconds=timestamp))
+
+    @sampled_timer
+    def _stream_teslalogger_positions(self, start, end, car_id=None):
+        """
+        Stream positions from TeslaLogger database ordered by timestamp.
+
+        Yields (partition_start, PositionBatch) per partition, keyed by TeslaMate car ids.
+        """
+        where, params = car_predicate(*self.watermark_filter, 'CarID', car_id)
+        bounds = {'start': start, 'end': end}
+        if self.offsets is not None:
+            # [start, end) is UTC, Datum is local time
+            bounds = {'start': self.offsets.local_datetime(start), 'end': self.offsets.local_datetime(end)}
+        query = text(f"SELECT * FROM pos WHERE Datum >= :start AND Datum < :end AND {where} ORDER BY Datum")
+        result = self.teslalogger_conn.execute(
+            query, {**bounds, **params},
+            execution_options=stream_options(self.fetch_batch_size)
+        )
+
+        indexes = column_indexes(result.keys(), TESLALOGGER_POSITION_COLUMNS)
+        if self.offsets is not None:
+            partitions = self._stream_utc_partitions(result, indexes, start)
+        else:
+            partitions = self._stream_partitions(result, indexes, start)
+        for partition_start, batch in partitions:
+            self._track_batch(batch)
+            if self.cars:
+                batch.map_car_ids(self.cars)
+            yield partition_start, batch
+
+    @sampled_timer
+    def _stream_teslamate_positions(self, start, end, car_id=None):
+        """
+        Stream positions from TeslaMate database ordered by timestamp.
+
+        Yields (partition_start, PositionBatch) per partition.
+        """
+        where, params = car_predicate("date >= :start AND date < :end", {'start': start, 'end': end}, 'car_id', car_id)
+        query = text(f"SELECT * FROM positions WHERE {where} ORDER BY date")
+        result = self.teslamate_conn.execute(
+            query, params,
+            execution_options=stream_options(self.fetch_batch_size)
+        )
+
+        indexes = column_indexes(result.keys(), TESLAMATE_POSITION_COLUMNS)
+        yield from self._stream_partitions(result, indexes, start)
+
+    def _stream_partitions(self, rows, indexes, start):
+        """
+        Cut a timestamp ordered row stream into columnar partitions.
+        """
+        timestamp_index = indexes['timestamp']
+        for partition, partition_rows in groupby(rows, key=lambda row: (row[timestamp_index] - start) // self.partition_size):
+            batch = PositionBatch()
+            batch.extend(partition_rows, indexes)
+            yield start + partition * self.partition_size, batch
+
+    def _stream_utc_partitions(self, result, indexes, start):
+        """
+        Cut a local time ordered TeslaLogger stream into partitions of UTC time.
+
+        Rows are read fetch_batch_size at a time. Each chunk is converted to
+        UTC epoch seconds in one vectorized step and split where it crosses a
+        partition boundary.
+        """
+        size = self.partition_size // ONE_SECOND
+        origin = (start - EPOCH) // ONE_SECOND
+        current_key, current = None, None
+
+        for rows in result.partitions(self.fetch_batch_size):
+            chunk = PositionBatch()
+            chunk.extend(rows, indexes)
+            chunk.timestamps_to_utc(self.offsets)
+            keys = ((np.asarray(chunk.timestamp, dtype=np.int64) - origin) // size).tolist()
+
+            for key, chunk_rows in groupby(range(len(chunk)), key=keys.__getitem__):
+                part = chunk if keys[0] == keys[-1] else chunk.subset(chunk_rows)
+                if key == current_key:
+                    current.append(part)
+                    continue
+                if current is not None:
+                    yield start + current_key * self.partition_size, current
+                current_key, current = key, part
+
+        if current is not None:
+            yield start + current_key * self.partition_size, current
+
+    def _partition_positions(self, teslalogger_partitions, teslamate_partitions):
+        """
+        Align the partitions of both streams.
+
+        Yields (partition_start, teslalogger_positions, teslamate_positions) for
+        every partition that holds at least one TeslaLogger position.
+        """
+        teslamate_partition = next(teslamate_partitions, None)
+
+        for partition_start, teslalogger_positions in teslalogger_partitions:
+            # Skip TeslaMate partitions with no TeslaLogger counterpart
+            while teslamate_partition is not None and teslamate_partition[0] < partition_start:
+                teslamate_partition = next(teslamate_partitions, None)
+
+            if teslamate_partition is not None and teslamate_partition[0] == partition_start:
+                teslamate_positions = teslamate_partition[1]
+            else:
+                teslamate_positions = PositionBatch()
+
+            yield partition_start, teslalogger_positions, teslamate_positions
+
+    def _position_stage(self):
+        """
+        Return the staging table of this engine when staging is enabled and supported.
+        """
+        if self.staging and self.stage is None:
+            stage = PositionStage(self.teslamate_conn)
+            if stage.supported():
+                self.stage = stage
+            else:
+                self.logger.warning("Position staging requires a PostgreSQL TeslaMate database, matching in Python")
+                self.staging = False
+        return self.stage
+
+    def _staged_partitions(self, stage, teslalogger_partitions, car_id=None):
+        """
+        Remove exact duplicates of every TeslaLogger partition inside TeslaMate.
+
+        Yields (partition_start, teslalogger_positions, teslamate_positions)
+        holding only the leftovers of both sides, which still need fuzzy matching.
+        """
+        for partition_start, batch in teslalogger_partitions:
+            with self.metrics.phase('fetch_teslamate'):
+                leftover = stage.load(batch)
+                teslamate_positions = stage.teslamate_leftovers(
+                    partition_start, partition_start + self.partition_size, self.fetch_batch_size, car_id)
+            self.metrics.add('fetch_teslamate', rows_read=len(teslamate_positions))
+
+            # Exact duplicates are identical positions, as the Python matcher would count them
+            self.stats['identical'] += len(batch) - len(leftover)
+            teslalogger_positions = batch.subset(row for row, row_id in enumerate(batch.id) if row_id in leftover)
+
+            yield partition_start, teslalogger_positions, teslamate_positions
+
+    @sampled_timer
     def _find_position_matches(self, teslalogger_pos, teslamate_pos):
         """
         Find matches between TeslaLogger and TeslaMate positions.
+
+        Both batches are ordered by (car, timestamp) and walked with two
+        pointers per car that bound the time window of each TeslaLogger
+        position. Candidates inside the window are looked up in a
+        spatio-temporal grid index, so only TeslaMate positions in the
+        neighbouring cells are measured. Works directly on the batch columns.
+
+        TeslaLogger positions of all cars are visited in time order, and the
+        TeslaMate positions of other cars in the window are counted as invalid
+        like the nested loop did, so the stats are the same as before.
+
+        Yields (TeslaLogger row, TeslaMate row) for every TeslaLogger position
+        that is not identical to a TeslaMate one. The TeslaMate row is the
+        position within range it was matched with, or None when there is none.
         """
-        matches = []
-
-        for tl_pos in teslalogger_pos:
-            match_found = False
-
-            for tm_pos in teslamate_pos:
-
-                # When debug is enabled, show what the comparative position values are
-                if self.debug_print:
-                    print(tm_pos)
-                    print(tl_pos)
-                    self.debug_print = 0
-
-                # Check if positions are identical
-                if (tl_pos['Datum'] == tm_pos['date'] and
-                    tl_pos['CarID'] == tm_pos['car_id'] and
-                    tl_pos['lat'] == tm_pos['latitude'] and
-                    tl_pos['lng'] == tm_pos['longitude']):
-                    self.stats['identical'] += 1
-                    teslalogger_pos.remove(tl_pos)  # Remove from TeslaLogger list
-                    teslamate_pos.remove(tm_pos)   # Remove from TeslaMate list
-                    match_found = True
-                    break
-
-                # Compare timestamps with a 30-second tolerance
-                time_diff = abs(tl_pos['Datum'] - tm_pos['date'])
-                if time_diff <= timedelta(seconds=30):
-                    car_match = (tl_pos.get('CarID') == tm_pos.get('car_id'))
-
-                    # Calculate distance between positions
-                    if (tl_pos['lat'] and tl_pos['lng'] and 
-                        tm_pos['latitude'] and tm_pos['longitude']):
-                        distance = haversine_distance(
-                            tl_pos['lat'], tl_pos['lng'],
-                            tm_pos['latitude'], tm_pos['longitude']
-                        )
-                    else:
-                        distance = float('inf')
-
-                    # Validate based on distance threshold
-                    if car_match and distance <= 10:  # 10 meters proximity
-                        #merged_pos = self._merge_position_record(tl_pos, tm_pos)
-                        matches.append(tl_pos)
-                        self.stats['added'] += 1
-                        match_found = True
-                        break
-                    else:
-                        self.stats['invalid'] += 1
-
-            # If no match was found within 30 seconds, add the position
-            if not match_found:
-                self.stats['added'] += 1
-                matches.append(tl_pos)
-
-        return matches
-
-    def _merge_position_record(self, teslalogger_pos, teslamate_pos):
-        # Merge logic for position records
-        merged_pos = {
-            'timestamp': min(teslalogger_pos['Datum'], teslamate_pos['date']),
-            'car_id': teslalogger_pos.get('CarID') or teslamate_pos.get('car_id'),
-            'latitude': teslalogger_pos.get('lat') or teslamate_pos.get('latitude'),
-            'longitude': teslalogger_pos.get('lng') or teslamate_pos.get('longitude'),
-            'battery_level': max(
-                teslalogger_pos.get('battery_level', 0) or 0,
-                teslamate_pos.get('battery_level', 0) or 0
-            ),
-            'odometer': max(
-                teslalogger_pos.get('odometer', 0) or 0,
-                teslamate_pos.get('odometer', 0) or 0
-            ),
-            'speed': max(
-                teslalogger_pos.get('speed', 0) or 0,
-                teslamate_pos.get('speed', 0) or 0
-            ),
-            'power': max(
-                teslalogger_pos.get('power', 0) or 0,
-                teslamate_pos.get('power', 0) or 0
-            ),
-            'heading': teslalogger_pos.get('heading') or teslamate_pos.get('heading'),
-        }
-        return merged_pos
-
-    def log_potential_merges(self, potential_merges):
-        self.logger.info(f"Dry Run - Potential Position Merges: {len(potential_merges)}")
-        for merge in potential_merges:
-            self.logger.info(f"Would merge position: {merge}")
-
-        if potential_merges:
-            self.logger.warning("""
-            DRY RUN MODE ACTIVE
-            Potential position merges detected.
-            To apply changes, set DRYRUN=0
-            """)
+        window = POSITION_TIME_WINDOW
+        teslamate_by_car = self._group_by_car(teslamate_pos)
+
+        index = SpatioTemporalIndex(POSITION_TIME_WINDOW, POSITION_DISTANCE_THRESHOLD)
+        for car_id, tm_rows in teslamate_by_car.items():
+            for position, row in enumerate(tm_rows):
+                if teslamate_pos.has_coordinates(row):
+                    index.insert(car_id, teslamate_pos.timestamp[row], teslamate_pos.lat[row], teslamate_pos.lng[row], position)
+
+        teslalogger_by_car = self._group_by_car(teslalogger_pos)
+        for car_id in teslalogger_by_car:
+            teslamate_by_car.setdefault(car_id, [])
+
+        # Per car: (timestamp, row) of its TeslaMate positions, consumed flags and [lower, upper) pointers
+        keys = {car_id: [(teslamate_pos.timestamp[row], row) for row in tm_rows]
+                for car_id, tm_rows in teslamate_by_car.items()}
+        consumed = {car_id: bytearray(len(tm_rows)) for car_id, tm_rows in teslamate_by_car.items()}
+        pointers = {car_id: [0, 0] for car_id in teslamate_by_car}
+
+        # All cars in time order, so TeslaMate positions are consumed in the order the nested loop did
+        rows = heapq.merge(*(
+            zip(repeat(car_id), tl_rows, self._proximity_hits(index, car_id, teslalogger_pos, tl_rows))
+            for car_id, tl_rows in teslalogger_by_car.items()
+        ), key=lambda item: (teslalogger_pos.timestamp[item[1]], item[1]))
+
+        for car_id, row, nearby in rows:
+            timestamp = teslalogger_pos.timestamp[row]
+            tm_rows = teslamate_by_car[car_id]
+            tm_keys = keys[car_id]
+            car_consumed = consumed[car_id]
+            lower, upper = pointers[car_id]
+
+            # Move both pointers so that [lower, upper) is the time window
+            while lower < len(tm_keys) and tm_keys[lower][0] < timestamp - window:
+                lower += 1
+            upper = max(upper, lower)
+            while upper < len(tm_keys) and tm_keys[upper][0] <= timestamp + window:
+                upper += 1
+            pointers[car_id] = [lower, upper]
+
+            # With debug logging, show the first pair of position values compared
+            if self.debug_print and lower < upper and self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"Comparing TeslaMate position {teslamate_pos.record(tm_rows[lower])} "
+                                  f"with TeslaLogger position {teslalogger_pos.record(row)}")
+                self.debug_print = 0
+
+            # The first unconsumed TeslaMate position in the window that is within range
+            if nearby is not None:
+                hits = [position for position in nearby if not car_consumed[position]]
+                hit = min(hits) if hits else None
+            else:
+                # Without coordinates only an identical position can match
+                hit = next((position for position in range(lower, upper)
+                            if not car_consumed[position] and
+                            self._is_identical(teslalogger_pos, row, teslamate_pos, tm_rows[position])), None)
+
+            # Every unconsumed position scanned before the hit was rejected
+            stop = upper if hit is None else hit
+            self.stats['invalid'] += (stop - lower) - car_consumed[lower:stop].count(1)
+
+            # So was every unconsumed position of another car in the window ahead of the hit
+            if len(keys) > 1:
+                limit = (timestamp + window + 1,) if hit is None else tm_keys[hit]
+                for other_id, other_keys in keys.items():
+                    if other_id == car_id or not other_keys:
+                        continue
+                    first = bisect_left(other_keys, (timestamp - window,))
+                    last = bisect_left(other_keys, limit)
+                    if first < last:
+                        self.stats['invalid'] += (last - first) - consumed[other_id][first:last].count(1)
+
+            # Check if positions are identical
+            if hit is not None and self._is_identical(teslalogger_pos, row, teslamate_pos, tm_rows[hit]):
+                self.stats['identical'] += 1
+                car_consumed[hit] = 1  # TeslaMate position cannot be matched again
+                continue
+
+            # Either within 10 meters of a TeslaMate position or no match at all
+            self.stats['added'] += 1
+            yield row, tm_rows[hit] if hit is not None else None
+
+    def _proximity_hits(self, index, car_id, teslalogger_pos, tl_rows):
+        """
+        Yield the TeslaMate positions within range of every TeslaLogger row, or
+        None for rows without coordinates.
+
+        Rows are measured PROXIMITY_BATCH_SIZE at a time with one vectorized
+        distance call per batch.
+        """
+        for offset in range(0, len(tl_rows), PROXIMITY_BATCH_SIZE):
+            rows = tl_rows[offset:offset + PROXIMITY_BATCH_SIZE]
+            located = [row for row in rows if teslalogger_pos.has_coordinates(row)]
+            found = dict(zip(located, index.query_many(
+                car_id,
+                [teslalogger_pos.timestamp[row] for row in located],
+                [teslalogger_pos.lat[row] for row in located],
+                [teslalogger_pos.lng[row] for row in located]
+            )))
+            for row in rows:
+                yield found.get(row)
+
+    def _is_identical(self, teslalogger_pos, tl_row, teslamate_pos, tm_row):
+        # NaN marks a missing coordinate, two missing coordinates are equal
+        tl_lat, tm_lat = teslalogger_pos.lat[tl_row], teslamate_pos.lat[tm_row]
+        tl_lng, tm_lng = teslalogger_pos.lng[tl_row], teslamate_pos.lng[tm_row]
+        return (teslalogger_pos.timestamp[tl_row] == teslamate_pos.timestamp[tm_row] and
+                (tl_lat == tm_lat or (tl_lat != tl_lat and tm_lat != tm_lat)) and
+                (tl_lng == tm_lng or (tl_lng != tl_lng and tm_lng != tm_lng)))
+
+    def _group_by_car(self, batch):
+        """
+        Order a batch by (car, timestamp) and group its row numbers per car.
+        """
+        car_ids = batch.car_id
+        timestamps = batch.timestamp
+        ordered = sorted(range(len(batch)), key=lambda row: (car_ids[row], timestamps[row]))
+        return {car_id: list(rows) for car_id, rows in groupby(ordered, key=car_ids.__getitem__)}
+
+
+# Per-process PositionSync used by the worker pool
+_worker_sync = None
+
+def _init_worker(config, options):
+    """
+    Open dedicated database connections for a worker process.
+    """
+    global _worker_sync
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    _worker_sync = PositionSync(
+        establish_teslalogger_connection(config),
+        establish_teslamate_connection(config),
+        options['dry_run'],
+        options['test_position'],
+        {},
+        options['position_limit'],
+        options['partition_hours'],
+        options['fetch_batch_size'],
+        staging=options['staging'],
+        cars=options['cars'],
+        timezone=options['timezone'],
+    )
+
+def _sync_partition(partition):
+    """
+    Match a single partition in a worker process.
+
+    :return: (matches, stats, high_water, phase metrics) for the partition
+    """
+    car_id, start, end, watermark_filter = partition
+    _worker_sync.stats = {'identical': 0, 'invalid': 0, 'added': 0}
+    _worker_sync.watermark_filter = watermark_filter
+    _worker_sync.high_water = {}
+    _worker_sync.metrics = EngineMetrics('positions')
+    _worker_sync.metrics.start()
+
+    matches = list(_worker_sync._sync_range(start, end, car_id))
+    _worker_sync.metrics.finish(len(matches))
+
+    return matches, _worker_sync.stats, _worker_sync.high_water, _worker_sync.metrics.snapshot()
@@ -0,0 +1,178 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+class CountingSink:
+    """
+    Sink that only counts merge candidates, keeping none of them in memory.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+    def close(self):
+        pass
+
+    def discard(self):
+        pass
+
+class BatchSink(CountingSink):
+    """
+    Sink that buffers merge candidates and hands them to a writer in batches.
+    """
+
+    def __init__(self, flush, batch_size):
+        super().__init__()
+        self.flush = flush  # Callable receiving a list of records
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def emit(self, record):
+        super().emit(record)
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+
+    def discard(self):
+        # Records buffered by a failed run are dropped, not written
+        self.buffer = []
+
+    def _flush(self):
+        if self.buffer:
+            self.flush(self.buffer)
+            self.buffer = []
+
+class ReportSink(CountingSink):
+    """
+    Sink that streams merge candidates into a gzip compressed JSONL or CSV report.
+
+    Records go through a bounded buffer into a temporary body file. On close
+    a summary header with the final counts and stats is written, followed by
+    the body, as consecutive gzip members of a single file. With
+    sample_every N only every Nth candidate is written, with log_every N
+    every Nth is also logged. All candidates are counted.
+    """
+
+    def __init__(self, path, label, report_format='jsonl', sample_every=1, log_every=0,
+                 buffer_size=1000, header=None, stats=None):
+        super().__init__()
+        self.path = path
+        self.label = label
+        self.report_format = report_format  # 'jsonl' or 'csv'
+        self.sample_every = max(sample_every, 1)
+        self.log_every = log_every  # 0 logs no individual candidates
+        self.buffer_size = buffer_size  # Records held before they are compressed
+        self.header = dict(header or {})  # Static summary fields, e.g. engine and dry run
+        self.stats = stats  # Engine stats, read when the report is closed
+        self.written = 0
+        self.buffer = []
+        self.fieldnames = None  # CSV columns, taken from the first record
+        self.body = None
+        self.logger = logging.getLogger(__name__)
+
+    def emit(self, record):
+        super().emit(record)
+        if self.log_every and self.count % self.log_every == 0:
+            self.logger.info(f"Would merge {self.label}: {record}")
+        if (self.count - 1) % self.sample_every:
+            return
+
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self._flush()
+
+    def close(self):
+        if self.path is None:
+            return
+        self._flush()
+        if self.body is not None:
+            self.body.close()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        body_path = f"{self.path}.body"
+        with open(self.path, 'wb') as report:
+            with gzip.GzipFile(fileobj=report, mode='wb') as header:
+                header.write(self._summary().encode('utf-8'))
+            if os.path.exists(body_path):
+                with open(body_path, 'rb') as body:
+                    shutil.copyfileobj(body, report)
+                os.remove(body_path)
+
+        self.logger.info(f"Wrote {self.written} of {self.count} {self.label} candidates to {self.path}")
+        self.path = None
+
+    def discard(self):
+        # A failed run leaves no report behind
+        self.buffer = []
+        if self.body is not None:
+            self.body.close()
+            os.remove(f"{self.path}.body")
+            self.body = None
+        self.path = None
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        if self.body is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.body = gzip.open(f"{self.path}.body", 'wt', encoding='utf-8', newline='')
+
+        if self.report_format == 'csv':
+            rows = [_flatten(record) for record in self.buffer]
+            if self.fieldnames is None:
+                self.fieldnames = list(rows[0])
+            writer = csv.DictWriter(self.body, self.fieldnames, extrasaction='ignore')
+            writer.writerows(rows)
+        else:
+            for record in self.buffer:
+                self.body.write(json.dumps(record, default=str) + "\n")
+
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    def _summary(self):
+        summary = {
+            **self.header,
+            'format': self.report_format,
+            'finished': datetime.now().isoformat(),
+            'candidates': self.count,
+            'written': self.written,
+            'sample_every': self.sample_every,
+            'stats': dict(self.stats or {}),
+        }
+        if self.report_format != 'csv':
+            return json.dumps({'summary': summary}, default=str) + "\n"
+
+        # Summary as comment lines above the column header
+        lines = io.StringIO()
+        for key, value in summary.items():
+            lines.write(f"# {key}: {value}\n")
+        if self.fieldnames:
+            csv.writer(lines).writerow(self.fieldnames)
+        return lines.getvalue()
+
+def _flatten(record, prefix=''):
+    # Nested dictionaries become dotted CSV columns
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
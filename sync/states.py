@@ -1,82 +1,104 @@
 import logging
 from utils.helpers import haversine_distance
-from sqlalchemy import text
+from utils.intervals import latest_end, match_interval_pages
+from database.cars import car_predicate, map_car_ids, teslalogger_cars
+from database.pagination import keyset_pages
+from sync.sinks import BatchSink, CountingSink
+from utils.metrics import EngineMetrics
+from utils.profiling import sampled_timer
+from utils.timezones import records_to_utc, utc_offsets
 from datetime import timedelta
 
+# TeslaMate state columns updated from merged states
+STATE_WRITE_COLUMNS = ['start_date', 'end_date', 'state']
+
 class StateSync:
-    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, stats):
+    def __init__(self, teslalogger_conn, teslamate_conn, dry_run, stats, checkpoints=None, writer=None, page_size=1000, metrics=None, sink=None, cars=None, timezone=None):
         self.teslalogger_conn = teslalogger_conn
         self.teslamate_conn = teslamate_conn
         self.dry_run = dry_run
         self.stats = stats  # Reference to the subkey of the stats hash 
+        self.checkpoints = checkpoints  # Optional watermark store for incremental runs
+        self.writer = writer  # TeslaMate bulk writer, only used when not in dry run
+        self.page_size = page_size  # Rows per keyset page
+        self.metrics = metrics or EngineMetrics('states')  # Per-phase timings and counters
+        # Receives merge candidates as they are matched, by default written back in batches
+        if sink is None:
+            sink = BatchSink(self._write_merges, writer.batch_size) if writer and not dry_run else CountingSink()
+        self.sink = sink
+        self.cars = cars  # {TeslaLogger CarID: TeslaMate car_id} to sync car by car, None mixes all cars
+        self.offsets = utc_offsets(timezone)  # UTC offset transitions of TeslaLogger's local time zone, None when UTC
+        self.checkpoint_key = 'states:dryrun' if dry_run else 'states'
         self.logger = logging.getLogger(__name__)
 
     def sync(self):
-        # Fetch states from both databases
-        teslalogger_states = self._fetch_teslalogger_states()
-        teslamate_states = self._fetch_teslamate_states()
-
-        # Validate fetched states
-        if teslalogger_states is None:
-            self.logger.error("Failed to fetch TeslaLogger states")
-            return []
-        
-        if teslamate_states is None:
-            self.logger.error("Failed to fetch TeslaMate states")
-            return []
-
-        # Detailed logging
-        self.logger.info(f"TeslaLogger States: {len(teslalogger_states)}")
-        self.logger.info(f"TeslaMate States: {len(teslamate_states)}")
-
-        # Find potential matches
-        potential_merges = self._find_state_matches(
-            teslalogger_states, 
-            teslamate_states
-        )
+        try:
+            for car_id in self._cars():
+                # Stream states from both databases, page by page
+                teslalogger_states = self.metrics.timed('fetch_teslalogger', self._fetch_teslalogger_states(car_id), len)
+                teslamate_states = self.metrics.timed('fetch_teslamate', self._fetch_teslamate_states(car_id), len)
+
+                # Find potential matches and stream them to the sink
+                for merge in self._find_state_matches(
+                    records_to_utc(map_car_ids(teslalogger_states, 'CarID', self.cars),
+                                   ('StartDate', 'EndDate'), self.offsets),
+                    teslamate_states
+                ):
+                    self.sink.emit(merge)
+        except Exception as e:
+            self.logger.error(f"Error syncing states: {e}")
+            self.sink.discard()
+            raise
+        self.sink.close()
+
+        if self.checkpoints:
+            self.checkpoints.commit(self.checkpoint_key)
 
-        return potential_merges
+        return self.sink.count
 
+    def _cars(self):
+        # TeslaLogger cars synced one at a time, or None once for all cars together
+        if self.cars is None:
+            return [None]
+        return teslalogger_cars(self.teslalogger_conn, 'state')
+
+    @sampled_timer
     def _find_state_matches(self, teslalogger_states, teslamate_states):
-        matches = []
-        
-        for tl_state in teslalogger_states:
-            for tm_state in teslamate_states:
-                # Match criteria
-                # Compare start times with a 5-minute tolerance
-                time_diff = abs(tl_state['StartDate'] - tm_state['start_date'])
-                
-                # Check if states are from the same car
-                car_match = (tl_state['CarID'] == tm_state['car_id'])
-                
-                # Compare state attributes
-                state_match = (
-                    tl_state.get('state') == tm_state.get('state') or
-                    tl_state.get('state') is None or
-                    tm_state.get('state') is None
-                )
-                
-                # Combine match criteria
-                if (time_diff <= timedelta(minutes=5) and 
-                    car_match and 
-                    state_match):
-                    
-                    merged_state = self._merge_state_record(tl_state, tm_state)
-                    matches.append(merged_state)
-
-        return matches
+        """
+        Pair TeslaLogger and TeslaMate states one-to-one by overlapping time range.
+
+        Both inputs are streams of pages ordered by start date. Merges are
+        yielded as they are matched.
+        """
+        # Intervals are widened by a 5-minute tolerance before comparing
+        for tl_state, tm_state, _ in match_interval_pages(
+                teslalogger_states, teslamate_states,
+                ('CarID', 'StartDate', 'EndDate'),
+                ('car_id', 'start_date', 'end_date'),
+                timedelta(minutes=5),
+                self._state_match):
+            self.stats['matched'] = self.stats.get('matched', 0) + 1
+            yield self._merge_state_record(tl_state, tm_state)
+
+    def _state_match(self, tl_state, tm_state):
+        # Compare state attributes
+        return (
+            tl_state.get('state') == tm_state.get('state') or
+            tl_state.get('state') is None or
+            tm_state.get('state') is None
+        )
 
     def _merge_state_record(self, teslalogger_state, teslamate_state):
         # Merge logic for state records
         merged_state = {
+            'teslalogger_id': teslalogger_state.get('id'),
+            'teslamate_id': teslamate_state.get('id'),
             'start_date': min(
                 teslalogger_state['StartDate'], 
                 teslamate_state['start_date']
             ),
-            'end_date': max(
-                teslalogger_state.get('EndDate') or teslamate_state['end_date'], 
-                teslamate_state['end_date']
-            ),
+            # Either side may still be open, the car's current state has no end yet
+            'end_date': latest_end(teslalogger_state.get('EndDate'), teslamate_state['end_date']),
             'car_id': teslalogger_state['CarID'],
             'state': teslalogger_state.get('state') or teslamate_state.get('state'),
             'battery_level': max(
@@ -94,32 +116,38 @@ class StateSync:
         }
         return merged_state
 
-    def log_potential_merges(self, potential_merges):
-        self.logger.info(f"Dry Run - Potential State Merges: {len(potential_merges)}")
-        for merge in potential_merges:
-            self.logger.info(f"Would merge state record: {merge}")
+    def _teslamate_row(self, merged_state):
+        # Flatten a merged state into the TeslaMate columns that are written back
+        return {'id': merged_state['teslamate_id'], **{column: merged_state[column] for column in STATE_WRITE_COLUMNS}}
 
-        if potential_merges:
-            self.logger.warning("""
-            DRY RUN MODE ACTIVE
-            Potential state merges detected.
-            To apply changes, set DRYRUN=0
-            """)
+    def _write_merges(self, merges):
+        # Update the matched TeslaMate rows from a batch of merges
+        self.writer.update_rows('states', STATE_WRITE_COLUMNS, [
+            self._teslamate_row(merge) for merge in merges if merge.get('teslamate_id') is not None
+        ])
 
-    def _fetch_teslalogger_states(self):
+    @sampled_timer
+    def _fetch_teslalogger_states(self, car_id=None):
         """
-        Fetch state records from TeslaLogger database
+        Stream state records from TeslaLogger database in pages ordered by start date and id
         """
-        try:
-            # Use text() for raw SQL queries
-            query = text("SELECT * FROM state LIMIT 1000")  # Adjust limit as needed
-            result = self.teslalogger_conn.execute(query)
-            
+        if self.checkpoints:
+            where, params = self.checkpoints.where_clause(self.checkpoint_key, 'CarID', 'StartDate')
+        else:
+            where, params = "1 = 1", {}
+        where, params = car_predicate(where, params, 'CarID', car_id)
+
+        fetched = 0
+        for rows in keyset_pages(self.teslalogger_conn, 'state', ('StartDate', 'id'), where, params, self.page_size):
             # Convert to list of dictionaries
             states = []
-            for row in result:
+            for row in rows:
+                if self.checkpoints:
+                    self.checkpoints.track(self.checkpoint_key, row.CarID, getattr(row, 'id', None), row.StartDate)
+
                 try:
                     state = {
+                        'id': getattr(row, 'id', None),
                         'StartDate': row.StartDate,
                         'EndDate': row.EndDate,
                         'CarID': row.CarID,
@@ -134,28 +162,36 @@ class StateSync:
                     states.append(state)
                 except Exception as field_error:
                     self.logger.warning(f"Could not process state row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(states)} states from TeslaLogger")
-            return states
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaLogger states: {e}")
-            return None
 
-    def _fetch_teslamate_states(self):
+            fetched += len(states)
+            yield states
+
+        self.logger.info(f"Fetched {fetched} states from TeslaLogger")
+
+    @sampled_timer
+    def _fetch_teslamate_states(self, car_id=None):
         """
-        Fetch state records from TeslaMate database
+        Stream state records from TeslaMate database in pages ordered by start date and id
         """
-        try:
-            # Use text() for raw SQL queries
-            query = text("SELECT * FROM states LIMIT 1000")  # Adjust limit as needed
-            result = self.teslamate_conn.execute(query)
-            
+        since = self.checkpoints.earliest(self.checkpoint_key, car_id) if self.checkpoints else None
+        if since is not None and self.offsets is not None:
+            # Watermarks are TeslaLogger local time, TeslaMate stores UTC
+            since = self.offsets.utc_datetime(since)
+        if since is not None:
+            where, params = "start_date >= :since", {'since': since}
+        else:
+            where, params = "1 = 1", {}
+        if car_id is not None:
+            where, params = car_predicate(where, params, 'car_id', self.cars.get(car_id, car_id))
+
+        fetched = 0
+        for rows in keyset_pages(self.teslamate_conn, 'states', ('start_date', 'id'), where, params, self.page_size):
             # Convert to list of dictionaries
             states = []
-            for row in result:
+            for row in rows:
                 try:
                     state = {
+                        'id': getattr(row, 'id', None),
                         'start_date': row.start_date,
                         'end_date': row.end_date,
                         'car_id': row.car_id,
@@ -170,10 +206,8 @@ class StateSync:
                     states.append(state)
                 except Exception as field_error:
                     self.logger.warning(f"Could not process TeslaMate state row: {field_error}")
-            
-            self.logger.info(f"Fetched {len(states)} states from TeslaMate")
-            return states
-        
-        except Exception as e:
-            self.logger.error(f"Error fetching TeslaMate states: {e}")
-            return None
+
+            fetched += len(states)
+            yield states
+
+        self.logger.info(f"Fetched {fetched} states from TeslaMate")
@@ -0,0 +1,49 @@
+import logging
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from database.cars import resolve_car_map, teslalogger_cars
+from database.checkpoints import CheckpointStore
+
+def session(tmp_path, name, statements):
+    engine = create_engine(f"sqlite:///{tmp_path / name}")
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    return sessionmaker(bind=engine)()
+
+def cars_table(rows):
+    return ["CREATE TABLE cars (id INTEGER PRIMARY KEY, vin TEXT)"] + [
+        f"INSERT INTO cars VALUES ({car_id}, '{vin}')" for car_id, vin in rows
+    ]
+
+def test_only_vin_pairs_are_cached(tmp_path):
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    teslalogger = session(tmp_path, 'tl.db', cars_table([(1, 'A'), (2, 'B')]))
+    teslamate = session(tmp_path, 'tm.db', cars_table([(11, 'A')]))
+
+    assert resolve_car_map(teslalogger, teslamate, checkpoints) == {1: 11, 2: 2}
+    assert checkpoints.car_map() == {1: 11}
+
+    # The unpaired car is looked up again and picked up once TeslaMate knows it
+    teslamate.execute(text("INSERT INTO cars VALUES (12, 'B')"))
+    teslamate.commit()
+    assert resolve_car_map(teslalogger, teslamate, checkpoints) == {1: 11, 2: 12}
+    assert checkpoints.car_map() == {1: 11, 2: 12}
+
+def test_cached_pairs_used_without_teslalogger_cars(tmp_path):
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    checkpoints.save_car_map({1: 11})
+    teslalogger = session(tmp_path, 'tl.db', [])
+    teslamate = session(tmp_path, 'tm.db', cars_table([(11, 'A')]))
+
+    assert resolve_car_map(teslalogger, teslamate, checkpoints, {3: 13}) == {1: 11, 3: 13}
+
+def test_rows_without_car_are_logged(tmp_path, caplog):
+    teslalogger = session(tmp_path, 'tl.db', [
+        "CREATE TABLE state (id INTEGER PRIMARY KEY, CarID INTEGER)",
+        "INSERT INTO state (CarID) VALUES (2), (1), (NULL), (NULL), (2)",
+    ])
+
+    with caplog.at_level(logging.WARNING):
+        assert teslalogger_cars(teslalogger, 'state') == [1, 2]
+    assert "Skipping 2 TeslaLogger state row(s) without a CarID" in caplog.text
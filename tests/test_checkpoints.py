@@ -0,0 +1,21 @@
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from database.checkpoints import CheckpointStore
+
+def test_watermark_keeps_rows_without_car(tmp_path):
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.db'), lookback_hours=0)
+    checkpoints.track('states', 1, 2, datetime(2024, 3, 2))
+    checkpoints.commit('states')
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'tl.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE state (id INTEGER PRIMARY KEY, CarID INTEGER, StartDate TIMESTAMP)"))
+        connection.execute(text("INSERT INTO state (CarID, StartDate) VALUES (:car_id, :start)"), [
+            {'car_id': 1, 'start': datetime(2024, 3, 1)},
+            {'car_id': 1, 'start': datetime(2024, 3, 3)},
+            {'car_id': 2, 'start': datetime(2024, 3, 1)},
+            {'car_id': None, 'start': datetime(2024, 3, 1)},
+        ])
+        where, params = checkpoints.where_clause('states', 'CarID', 'StartDate')
+        rows = connection.execute(text(f"SELECT id FROM state WHERE {where} ORDER BY id"), params)
+        assert [row.id for row in rows] == [2, 3, 4]
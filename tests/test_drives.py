@@ -0,0 +1,35 @@
+import sqlite3
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sync.drives import DriveSync
+from sync.sinks import BatchSink
+
+def session(tmp_path, name, statements):
+    engine = create_engine(f"sqlite:///{tmp_path / name}", connect_args={'detect_types': sqlite3.PARSE_DECLTYPES})
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    return sessionmaker(bind=engine)()
+
+def test_open_drives_are_merged(tmp_path):
+    teslalogger = session(tmp_path, 'tl.db', [
+        "CREATE TABLE drivestate (id INTEGER PRIMARY KEY, StartDate TIMESTAMP, EndDate TIMESTAMP, CarID INTEGER, "
+        "distance REAL, speed_max INTEGER)",
+        "INSERT INTO drivestate VALUES (1, '2024-03-01 08:00:00', '2024-03-01 08:30:00', 1, 20.0, 90)",
+        "INSERT INTO drivestate VALUES (2, '2024-03-01 10:00:00', NULL, 1, NULL, NULL)",
+    ])
+    teslamate = session(tmp_path, 'tm.db', [
+        "CREATE TABLE drives (id INTEGER PRIMARY KEY, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER, "
+        "distance REAL, speed_max INTEGER, start_km REAL, end_km REAL)",
+        "INSERT INTO drives VALUES (41, '2024-03-01 08:01:00', NULL, 1, 19.8, 88, 1000.0, 1019.8)",
+        "INSERT INTO drives VALUES (42, '2024-03-01 10:01:00', NULL, 1, NULL, NULL, 1020.0, NULL)",
+    ])
+
+    merges = []
+    assert DriveSync(teslalogger, teslamate, True, {}, sink=BatchSink(merges.extend, 10)).sync() == 2
+    merged = {merge['teslamate_id']: merge for merge in merges}
+    assert merged[41]['end_date'] == datetime(2024, 3, 1, 8, 30)
+    assert merged[41]['duration_min'] == 30
+    assert merged[42]['end_date'] is None
+    assert merged[42]['duration_min'] is None
@@ -0,0 +1,38 @@
+import math
+import random
+import numpy as np
+from utils.helpers import haversine_distance, haversine_distances, within_distance
+
+def random_pairs(count, seed=12):
+    rng = random.Random(seed)
+    return [(rng.uniform(-89, 89), rng.uniform(-180, 180), rng.uniform(-89, 89), rng.uniform(-180, 180))
+            for _ in range(count)]
+
+def test_vectorized_distances_equal_the_scalar_reference():
+    pairs = random_pairs(2000)
+    # Short distances too, the ones matching is decided on
+    pairs += [(lat, lng, lat + 5e-5, lng - 5e-5) for lat, lng, _, _ in pairs[:500]]
+    expected = [haversine_distance(*pair) for pair in pairs]
+    actual = haversine_distances(*(list(column) for column in zip(*pairs)))
+    assert np.allclose(actual, expected, rtol=1e-12, atol=1e-6)
+
+def test_scalar_broadcasts_against_arrays():
+    lats, lngs = [48.1, 48.2, -33.9], [11.5, 11.6, 151.2]
+    actual = haversine_distances(48.15, 11.55, lats, lngs)
+    assert np.allclose(actual, [haversine_distance(48.15, 11.55, lat, lng) for lat, lng in zip(lats, lngs)])
+
+def test_missing_coordinates_give_nan_and_are_accepted():
+    distances = haversine_distances([48.1, None, float('nan'), 48.1], [11.5, 11.5, 11.5, None],
+                                    [48.1, 48.1, 48.1, 48.1], [11.5, 11.5, 11.5, 11.5])
+    assert distances[0] == 0
+    assert np.isnan(distances[1:]).all()
+    assert within_distance([48.1, None, 48.1], [11.5, 11.5, 11.5], [48.1, 48.1, 48.2], [11.5, 11.5, 11.5], 10).tolist() == \
+        [True, True, False]
+
+def test_antimeridian_pairs_are_close():
+    lat = 52.0
+    expected = haversine_distance(lat, 179.9999, lat, -179.9999)
+    actual = haversine_distances([lat], [179.9999], [lat], [-179.9999])[0]
+    assert math.isclose(actual, expected, rel_tol=1e-12)
+    assert actual < 20
+    assert within_distance([lat], [179.9999], [lat], [-179.9999], 20).tolist() == [True]
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from utils.intervals import match_interval_pages, match_intervals
+
+KEYS = ('car', 'start', 'end')
+ORIGIN = datetime(2024, 1, 1)
+
+def interval(name, start_minute, end_minute, car=1):
+    return {'name': name, 'car': car,
+            'start': ORIGIN + timedelta(minutes=start_minute), 'end': ORIGIN + timedelta(minutes=end_minute)}
+
+def pairs(matches):
+    return sorted((left['name'], right['name']) for left, right, _ in matches)
+
+def test_active_right_interval_after_a_short_left_interval_is_not_paired():
+    left = [interval('A', 0, 100), interval('B', 10, 12)]
+    right = [interval('R1', 50, 60), interval('R2', 70, 80)]
+    matches = match_intervals(left, right, KEYS, KEYS, timedelta(minutes=5))
+    assert pairs(matches) == [('A', 'R1')]
+
+def test_pairs_within_the_tolerance_are_kept():
+    left = [interval('A', 0, 10)]
+    right = [interval('R', 14, 20)]
+    assert pairs(match_intervals(left, right, KEYS, KEYS, timedelta(minutes=5))) == [('A', 'R')]
+    assert pairs(match_intervals(left, right, KEYS, KEYS, timedelta(minutes=3))) == []
+
+def test_best_overlap_wins_and_cars_are_kept_apart():
+    left = [interval('A', 0, 30), interval('B', 40, 70), interval('C', 0, 30, car=2)]
+    right = [interval('R1', 38, 72), interval('R2', 1, 29), interval('R3', 25, 45), interval('R4', 0, 30, car=3)]
+    right.sort(key=lambda record: record['start'])
+    matches = match_intervals(left, right, KEYS, KEYS, timedelta(minutes=5))
+    assert pairs(matches) == [('A', 'R2'), ('B', 'R1')]
+
+def test_pages_match_like_a_single_pass():
+    left = [interval(f'L{i}', i * 20, i * 20 + 12) for i in range(30)]
+    right = [interval(f'R{i}', i * 20 + 3, i * 20 + 14) for i in range(30)]
+    paged = list(match_interval_pages((left[i:i + 4] for i in range(0, len(left), 4)),
+                                      (right[i:i + 7] for i in range(0, len(right), 7)),
+                                      KEYS, KEYS, timedelta(minutes=5)))
+    assert pairs(paged) == pairs(match_intervals(left, right, KEYS, KEYS, timedelta(minutes=5)))
+    assert len(pairs(paged)) == 30
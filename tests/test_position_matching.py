@@ -0,0 +1,97 @@
+import random
+from datetime import datetime, timedelta
+from sync.position_batch import PositionBatch, TESLALOGGER_POSITION_COLUMNS, TESLAMATE_POSITION_COLUMNS, column_indexes
+from sync.positions import PositionSync
+from utils.helpers import haversine_distance
+
+TESLALOGGER_KEYS = ['id', 'Datum', 'CarID', 'lat', 'lng', 'battery_level', 'speed', 'power', 'odometer']
+TESLAMATE_KEYS = ['id', 'date', 'car_id', 'latitude', 'longitude', 'battery_level', 'speed', 'power', 'odometer']
+
+def nested_match_counts(teslalogger_pos, teslamate_pos):
+    """
+    Counts of the nested loop matcher the sweep replaced, comparing every pair.
+    """
+    stats = {'identical': 0, 'invalid': 0, 'added': 0}
+    remaining = list(teslamate_pos)
+    for tl_pos in teslalogger_pos:
+        match_found = False
+        for tm_pos in remaining:
+            if (tl_pos['Datum'] == tm_pos['date'] and tl_pos['CarID'] == tm_pos['car_id'] and
+                    tl_pos['lat'] == tm_pos['latitude'] and tl_pos['lng'] == tm_pos['longitude']):
+                stats['identical'] += 1
+                remaining.remove(tm_pos)
+                match_found = True
+                break
+
+            if abs(tl_pos['Datum'] - tm_pos['date']) <= timedelta(seconds=30):
+                if tl_pos['lat'] and tl_pos['lng'] and tm_pos['latitude'] and tm_pos['longitude']:
+                    distance = haversine_distance(tl_pos['lat'], tl_pos['lng'], tm_pos['latitude'], tm_pos['longitude'])
+                else:
+                    distance = float('inf')
+                if tl_pos['CarID'] == tm_pos['car_id'] and distance <= 10:
+                    stats['added'] += 1
+                    match_found = True
+                    break
+                stats['invalid'] += 1
+
+        if not match_found:
+            stats['added'] += 1
+    return stats
+
+def synthetic_positions(car_ids, count=800, seed=3, gap=(5, 20)):
+    """
+    Time ordered TeslaLogger positions and TeslaMate positions holding identical
+    copies, nearby copies, distant copies and positions of their own.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 3, 1)
+    teslalogger, teslamate = [], []
+    timestamp = start
+    for i in range(count):
+        car_id = rng.choice(car_ids)
+        timestamp += timedelta(seconds=rng.randint(*gap))
+        lat, lng = 48.1 + i * 1e-4, 11.5 + rng.random() * 1e-3
+        if rng.random() < 0.05:
+            lat = lng = None
+        teslalogger.append({'id': i + 1, 'Datum': timestamp, 'CarID': car_id, 'lat': lat, 'lng': lng,
+                            'battery_level': 80, 'speed': 50, 'power': 10, 'odometer': 1000.0 + i})
+
+        kind = rng.random()
+        if kind < 0.4:
+            tm_lat, tm_lng, shift = lat, lng, 0
+        elif kind < 0.6 and lat is not None:
+            tm_lat, tm_lng, shift = lat + 2e-5, lng, rng.randint(-30, 30)
+        elif kind < 0.8 and lat is not None:
+            tm_lat, tm_lng, shift = lat + 1e-3, lng, rng.randint(-30, 30)
+        else:
+            continue
+        teslamate.append({'id': i + 1, 'date': timestamp + timedelta(seconds=shift), 'car_id': car_id,
+                          'latitude': tm_lat, 'longitude': tm_lng,
+                          'battery_level': 80, 'speed': 50, 'power': 10, 'odometer': 1000.0 + i})
+    teslamate.sort(key=lambda position: position['date'])
+    return teslalogger, teslamate
+
+def batch(records, keys, source_columns):
+    positions = PositionBatch()
+    positions.extend(([record[key] for key in keys] for record in records), column_indexes(keys, source_columns))
+    return positions
+
+def sweep_match_counts(teslalogger, teslamate):
+    stats = {'identical': 0, 'invalid': 0, 'added': 0}
+    sync = PositionSync(None, None, True, False, stats, 0)
+    sync.debug_print = 0
+    list(sync._find_position_matches(batch(teslalogger, TESLALOGGER_KEYS, TESLALOGGER_POSITION_COLUMNS),
+                                     batch(teslamate, TESLAMATE_KEYS, TESLAMATE_POSITION_COLUMNS)))
+    return stats
+
+def test_single_car_counts_match_nested_matcher():
+    teslalogger, teslamate = synthetic_positions([1])
+    expected = nested_match_counts(teslalogger, teslamate)
+    assert expected['identical'] and expected['invalid'] and expected['added']
+    assert sweep_match_counts(teslalogger, teslamate) == expected
+
+def test_multi_car_counts_match_nested_matcher():
+    # Crowded windows with positions of several cars in the same second
+    for seed, gap in ((3, (5, 20)), (4, (0, 5)), (5, (0, 2))):
+        teslalogger, teslamate = synthetic_positions([1, 2, 3], seed=seed, gap=gap)
+        assert sweep_match_counts(teslalogger, teslamate) == nested_match_counts(teslalogger, teslamate)
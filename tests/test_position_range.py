@@ -0,0 +1,42 @@
+import logging
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from database.checkpoints import CheckpointStore
+from sync.positions import PositionSync
+
+def teslalogger_session(tmp_path, positions):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tl.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE pos (id INTEGER PRIMARY KEY, Datum TIMESTAMP, CarID INTEGER, lat REAL, lng REAL)"))
+        connection.execute(text("CREATE INDEX pos_car_date ON pos (CarID, Datum)"))
+        connection.execute(text("INSERT INTO pos (Datum, CarID) VALUES (:datum, :car_id)"),
+                           [{'datum': datum, 'car_id': car_id} for datum, car_id in positions])
+    return sessionmaker(bind=engine)()
+
+POSITIONS = [
+    (datetime(2024, 3, 1, 8), 1), (datetime(2024, 3, 5, 8), 1),
+    (datetime(2024, 3, 2, 8), 2), (datetime(2024, 3, 3, 8), 2),
+    (datetime(2024, 2, 20, 8), None),
+]
+
+def test_date_range_starts_at_each_car_watermark(tmp_path):
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.db'), lookback_hours=0)
+    checkpoints.track('positions', 1, 2, datetime(2024, 3, 4, 8))
+    checkpoints.commit('positions')
+
+    sync = PositionSync(teslalogger_session(tmp_path, POSITIONS), None, False, False, {}, 0, checkpoints=checkpoints, cars={})
+    assert sync._get_date_range() == (datetime(2024, 3, 2), datetime(2024, 3, 6))
+    assert sync.car_ranges == {1: (datetime(2024, 3, 5), datetime(2024, 3, 6)),
+                               2: (datetime(2024, 3, 2), datetime(2024, 3, 4))}
+
+def test_positions_without_car(tmp_path, caplog):
+    teslalogger = teslalogger_session(tmp_path, POSITIONS)
+
+    # Synced together with the other cars
+    assert PositionSync(teslalogger, None, True, False, {}, 0)._get_date_range()[0] == datetime(2024, 2, 20)
+
+    # Skipped with a warning car by car
+    with caplog.at_level(logging.WARNING):
+        assert PositionSync(teslalogger, None, True, False, {}, 0, cars={})._get_date_range()[0] == datetime(2024, 3, 1)
+    assert "Skipping 1 TeslaLogger positions without a CarID" in caplog.text
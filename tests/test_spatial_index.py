@@ -0,0 +1,22 @@
+import random
+from utils.helpers import haversine_distance
+from utils.spatial_index import SpatioTemporalIndex
+
+def test_query_many_equals_brute_force():
+    rng = random.Random(7)
+    points = []
+    # Clusters at mid and high latitudes and across the antimeridian, spaced around the 10 m tolerance
+    for lat, lng in ((48.1, 11.5), (78.2, 15.6), (-16.5, 179.99995), (-16.5, -179.99995)):
+        for i in range(300):
+            points.append((rng.randint(0, 120), lat + rng.uniform(-2e-4, 2e-4), lng + rng.uniform(-4e-4, 4e-4)))
+    points = [(seconds, lat, (lng + 180) % 360 - 180) for seconds, lat, lng in points]
+
+    index = SpatioTemporalIndex(30, 10)
+    for item, (seconds, lat, lng) in enumerate(points):
+        index.insert(1, seconds, lat, lng, item)
+
+    hits = index.query_many(1, *zip(*points))
+    for (seconds, lat, lng), found in zip(points, hits):
+        expected = [item for item, (other_seconds, other_lat, other_lng) in enumerate(points)
+                    if abs(other_seconds - seconds) <= 30 and haversine_distance(lat, lng, other_lat, other_lng) <= 10]
+        assert sorted(found) == expected
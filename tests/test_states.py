@@ -0,0 +1,75 @@
+import sqlite3
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sync.sinks import BatchSink
+from sync.states import StateSync
+
+def session(tmp_path, name, statements):
+    engine = create_engine(f"sqlite:///{tmp_path / name}", connect_args={'detect_types': sqlite3.PARSE_DECLTYPES})
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    return sessionmaker(bind=engine)()
+
+def test_merged_states_name_both_rows(tmp_path):
+    teslalogger = session(tmp_path, 'tl.db', [
+        "CREATE TABLE state (id INTEGER PRIMARY KEY, StartDate TIMESTAMP, EndDate TIMESTAMP, CarID INTEGER, state TEXT)",
+        "INSERT INTO state VALUES (7, '2024-03-01 08:00:00', '2024-03-01 09:00:00', 1, 'online')",
+    ])
+    teslamate = session(tmp_path, 'tm.db', [
+        "CREATE TABLE states (id INTEGER PRIMARY KEY, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER, state TEXT)",
+        "INSERT INTO states VALUES (42, '2024-03-01 08:01:00', '2024-03-01 09:00:00', 1, 'online')",
+    ])
+
+    merges = []
+    assert StateSync(teslalogger, teslamate, True, {}, sink=BatchSink(merges.extend, 10)).sync() == 1
+    assert merges[0]['teslalogger_id'] == 7
+    assert merges[0]['teslamate_id'] == 42
+    assert merges[0]['start_date'] == datetime(2024, 3, 1, 8)
+
+def test_open_teslamate_state_is_merged(tmp_path):
+    teslalogger = session(tmp_path, 'tl.db', [
+        "CREATE TABLE state (id INTEGER PRIMARY KEY, StartDate TIMESTAMP, EndDate TIMESTAMP, CarID INTEGER, state TEXT)",
+        "INSERT INTO state VALUES (7, '2024-03-01 08:00:00', '2024-03-01 09:00:00', 1, 'online')",
+        "INSERT INTO state VALUES (8, '2024-03-01 09:00:00', NULL, 1, 'asleep')",
+    ])
+    teslamate = session(tmp_path, 'tm.db', [
+        "CREATE TABLE states (id INTEGER PRIMARY KEY, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER, state TEXT)",
+        "INSERT INTO states VALUES (42, '2024-03-01 08:01:00', NULL, 1, 'online')",
+        "INSERT INTO states VALUES (43, '2024-03-01 09:01:00', NULL, 1, 'asleep')",
+    ])
+
+    merges = []
+    assert StateSync(teslalogger, teslamate, True, {}, sink=BatchSink(merges.extend, 10)).sync() == 2
+    ends = {merge['teslamate_id']: merge['end_date'] for merge in merges}
+    # Closed in TeslaLogger only, and still open on both sides
+    assert ends == {42: datetime(2024, 3, 1, 9), 43: None}
+
+def test_failed_sync_raises_without_flushing(tmp_path, monkeypatch):
+    teslalogger = session(tmp_path, 'tl.db', [
+        "CREATE TABLE state (id INTEGER PRIMARY KEY, StartDate TIMESTAMP, EndDate TIMESTAMP, CarID INTEGER, state TEXT)",
+        "INSERT INTO state VALUES (7, '2024-03-01 08:00:00', '2024-03-01 09:00:00', 1, 'online')",
+        "INSERT INTO state VALUES (8, '2024-03-01 08:00:00', '2024-03-01 09:00:00', 2, 'online')",
+    ])
+    teslamate = session(tmp_path, 'tm.db', [
+        "CREATE TABLE states (id INTEGER PRIMARY KEY, start_date TIMESTAMP, end_date TIMESTAMP, car_id INTEGER, state TEXT)",
+        "INSERT INTO states VALUES (42, '2024-03-01 08:01:00', '2024-03-01 09:00:00', 1, 'online')",
+    ])
+
+    merges = []
+    sync = StateSync(teslalogger, teslamate, False, {}, sink=BatchSink(merges.extend, 10), cars={1: 1, 2: 2})
+    fetch = sync._fetch_teslamate_states
+
+    def failing_fetch(car_id):
+        if car_id == 2:
+            raise RuntimeError("connection lost")
+        return fetch(car_id)
+
+    # The merge of the first car stays buffered and is dropped with the failure
+    monkeypatch.setattr(sync, '_fetch_teslamate_states', failing_fetch)
+    with pytest.raises(RuntimeError):
+        sync.sync()
+    assert sync.sink.count == 1
+    assert merges == []
@@ -0,0 +1,82 @@
+import csv
+import io
+import re
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database.teslamate_writer import POSITION_COLUMNS, TeslaMateWriter
+from sync.position_batch import PositionBatch, TESLALOGGER_POSITION_COLUMNS, column_indexes
+from sync.positions import PositionSync
+from sync.sinks import BatchSink
+
+# TeslaMate positions column types and whether NULL is allowed
+TESLAMATE_POSITION_TYPES = {
+    'date': ('timestamp', False),
+    'car_id': ('integer', False),
+    'latitude': ('numeric', False),
+    'longitude': ('numeric', False),
+    'speed': ('smallint', True),
+    'power': ('smallint', True),
+    'odometer': ('double', True),
+    'battery_level': ('smallint', True),
+    'ideal_battery_range_km': ('numeric', True),
+}
+
+INTEGER = re.compile(r'-?\d+')
+
+def accepts(column_type, value):
+    # Whether PostgreSQL COPY in CSV format would accept the text for the column type
+    if column_type == 'timestamp':
+        return datetime.fromisoformat(value) is not None
+    if column_type in ('integer', 'smallint'):
+        return INTEGER.fullmatch(value) is not None and (column_type == 'integer' or abs(int(value)) < 2 ** 15)
+    return float(value) == float(value)
+
+def teslalogger_records():
+    keys = ['id', 'Datum', 'CarID', 'lat', 'lng', 'battery_level', 'ideal_battery_range_km', 'odometer', 'speed', 'power']
+    rows = [
+        [1, datetime(2024, 1, 1, 8, 0, 0), 1, 48.1, 11.2, 55.0, 301.25, 1000.5, 12.0, -3.0],
+        [2, datetime(2024, 1, 1, 8, 0, 10), 1, 48.2, 11.3, 54.6, None, 1000.6, None, 25.4],
+        [3, datetime(2024, 1, 1, 8, 0, 20), 2, 48.3, 11.4, None, None, None, 0.0, None],
+    ]
+    batch = PositionBatch()
+    batch.extend(rows, column_indexes(keys, TESLALOGGER_POSITION_COLUMNS))
+    return [batch.record(row) for row in range(len(batch))]
+
+def writer():
+    return TeslaMateWriter(sessionmaker(bind=create_engine('sqlite://'))())
+
+def test_copy_payload_matches_teslamate_column_types():
+    payload = writer().copy_payload(teslalogger_records()).getvalue()
+    lines = list(csv.reader(io.StringIO(payload)))
+    assert len(lines) == 3
+
+    for line in lines:
+        assert len(line) == len(POSITION_COLUMNS)
+        for column, value in zip(POSITION_COLUMNS, line):
+            column_type, nullable = TESLAMATE_POSITION_TYPES[column]
+            # COPY reads an unquoted empty field as NULL
+            if value == '':
+                assert nullable, column
+            else:
+                assert accepts(column_type, value), (column, value)
+
+    assert lines[0][POSITION_COLUMNS.index('battery_level')] == '55'
+    assert lines[1][POSITION_COLUMNS.index('battery_level')] == '55'
+    assert lines[1][POSITION_COLUMNS.index('speed')] == ''
+
+def test_only_new_located_positions_reach_the_writer():
+    written = []
+    sync = PositionSync(None, None, False, False, {}, 0, sink=BatchSink(written.extend, 10))
+    new, nearby, unlocated = teslalogger_records()
+    for record, teslamate_id in ((new, None), (nearby, 7), (unlocated, None)):
+        record['teslalogger_id'] = record.pop('id')
+        record['teslamate_id'] = teslamate_id
+    unlocated['latitude'] = unlocated['longitude'] = None
+
+    for record in (new, nearby, unlocated):
+        sync._emit(record)
+    sync.sink.close()
+
+    assert [record['teslalogger_id'] for record in written] == [1]
+    assert sync.not_written == 2
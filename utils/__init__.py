@@ -1,3 +1,22 @@
-from .helpers import haversine_distance
+import importlib
 
-__all__ = ['haversine_distance']
+# Exported name -> submodule defining it. Submodules are imported on first
+# access, so importing one light module does not load NumPy.
+_EXPORTS = {
+    'haversine_distance': 'helpers',
+    'haversine_distances': 'helpers',
+    'within_distance': 'helpers',
+    'to_epoch_seconds': 'helpers',
+    'SpatioTemporalIndex': 'spatial_index',
+    'latest_end': 'intervals',
+    'match_intervals': 'intervals',
+    'match_interval_pages': 'intervals',
+    'overlap_ratio': 'intervals',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
@@ -1,4 +1,6 @@
 import math
+from datetime import datetime, timezone
+import numpy as np
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     # Radius of the Earth in kilometers
@@ -16,3 +18,42 @@ def haversine_distance(lat1, lon1, lat2, lon2):
 
     # Distance in kilometers, converted to meters
     return R * c * 1000
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """
+    Vectorized haversine_distance returning an array of distances in meters.
+
+    Arguments broadcast against each other, so equal length arrays give
+    pairwise distances and a scalar against arrays gives one-to-many
+    distances. None and NaN coordinates yield NaN.
+    """
+    # Radius of the Earth in kilometers
+    R = 6371.0
+
+    # Convert latitude and longitude to radians
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+
+    # Haversine formula, identical to the scalar reference
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+    # Distance in kilometers, converted to meters
+    return R * c * 1000
+
+def within_distance(lat1, lon1, lat2, lon2, threshold):
+    """
+    Boolean array of pairs within threshold meters. Pairs missing a coordinate are accepted.
+    """
+    distances = haversine_distances(lat1, lon1, lat2, lon2)
+    return np.isnan(distances) | (distances <= threshold)
+
+def to_epoch_seconds(timestamp):
+    # Naive datetimes are treated as UTC, numbers are assumed to be epoch seconds already
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.timestamp()
+    return float(timestamp)
@@ -0,0 +1,150 @@
+import heapq
+from collections import defaultdict
+from itertools import count
+
+def overlap_ratio(start1, end1, start2, end2):
+    """
+    Intersection over union of two [start, end] intervals, between 0 and 1.
+    """
+    intersection = (min(end1, end2) - max(start1, start2)).total_seconds()
+    union = (max(end1, end2) - min(start1, start2)).total_seconds()
+    if union <= 0:
+        # Two zero-length intervals at the same instant
+        return 1.0 if intersection == 0 else 0.0
+    return max(intersection, 0) / union
+
+def latest_end(*ends):
+    """
+    Latest of the interval ends that are set, None while every interval is still open.
+    """
+    present = [end for end in ends if end is not None]
+    return max(present) if present else None
+
+def match_intervals(left, right, left_keys, right_keys, tolerance, accept=None):
+    """
+    Pair intervals one-to-one by best overlap.
+
+    Both sides are grouped per car and swept in start order, keeping a heap
+    of the right-hand intervals that are still open. Pairs whose intervals
+    overlap once widened by the tolerance are scored by overlap ratio, and
+    the best scoring pairs are assigned first so every interval is used at
+    most once.
+
+    :param left: Interval dictionaries, e.g. TeslaLogger records
+    :param right: Interval dictionaries, e.g. TeslaMate records
+    :param left_keys: (car, start, end) keys of the left records
+    :param right_keys: (car, start, end) keys of the right records
+    :param tolerance: timedelta both intervals are widened by
+    :param accept: Optional predicate(left, right) for additional criteria
+    :return: List of (left, right, score) tuples
+    """
+    left_by_car = _by_car(left, left_keys)
+    right_by_car = _by_car(right, right_keys)
+
+    candidates = []
+    for car_id, left_intervals in left_by_car.items():
+        right_intervals = right_by_car.get(car_id, [])
+        candidates.extend(_sweep(left_intervals, right_intervals, tolerance, accept))
+
+    # Highest overlap first, closest start times break ties
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+
+    matches = []
+    used_left = set()
+    used_right = set()
+    for score, _, left_index, right_index, left_record, right_record in candidates:
+        if left_index in used_left or right_index in used_right:
+            continue
+        used_left.add(left_index)
+        used_right.add(right_index)
+        matches.append((left_record, right_record, score))
+
+    return matches
+
+def match_interval_pages(left_pages, right_pages, left_keys, right_keys, tolerance, accept=None):
+    """
+    Streaming match_intervals over two inputs paged in start order.
+
+    Each left page is matched against the right intervals that can still
+    overlap it: right rows are read up to the latest left end plus the
+    tolerance, and dropped again once they end before the current page
+    starts or have been matched. Memory is bounded by a page plus the right
+    intervals spanning it. Assignment is best-overlap-first within a page.
+
+    :param left_pages: Iterable of lists of left records, ordered by start
+    :param right_pages: Iterable of lists of right records, ordered by start
+    :return: Generator of (left, right, score) tuples
+    """
+    _, left_start, left_end = left_keys
+    _, right_start, right_end = right_keys
+
+    right_rows = (record for page in right_pages for record in page if record[right_start] is not None)
+    upcoming = next(right_rows, None)
+    buffered = []
+
+    for page in left_pages:
+        intervals = [(record[left_start], record.get(left_end) or record[left_start])
+                     for record in page if record[left_start] is not None]
+        if not intervals:
+            continue
+
+        earliest = min(start for start, _ in intervals) - tolerance
+        horizon = max(max(start, end) for start, end in intervals) + tolerance
+
+        # Read every right interval that starts before this page can end
+        while upcoming is not None and upcoming[right_start] <= horizon:
+            buffered.append(upcoming)
+            upcoming = next(right_rows, None)
+
+        # Later pages start no earlier, so intervals ended before this one are done
+        buffered = [record for record in buffered
+                    if max(record[right_start], record.get(right_end) or record[right_start]) >= earliest]
+
+        matches = match_intervals(page, buffered, left_keys, right_keys, tolerance, accept)
+        matched = {id(right) for _, right, _ in matches}
+        buffered = [record for record in buffered if id(record) not in matched]
+
+        yield from matches
+
+def _by_car(records, keys):
+    # Group (start, end, index, record) per car, sorted by start
+    car_key, start_key, end_key = keys
+    grouped = defaultdict(list)
+    for index, record in enumerate(records):
+        start = record[start_key]
+        if start is None:
+            continue
+        end = record.get(end_key) or start
+        grouped[record[car_key]].append((start, max(start, end), index, record))
+
+    for intervals in grouped.values():
+        intervals.sort(key=lambda interval: (interval[0], interval[2]))
+    return grouped
+
+def _sweep(left_intervals, right_intervals, tolerance, accept):
+    # Yield (score, start distance, left index, right index, left, right) candidates
+    active = []
+    sequence = count()
+    pointer = 0
+
+    for left_start, left_end, left_index, left_record in left_intervals:
+        # Open every right interval starting before this one ends
+        while pointer < len(right_intervals) and right_intervals[pointer][0] <= left_end + tolerance:
+            right_start, right_end, right_index, right_record = right_intervals[pointer]
+            heapq.heappush(active, (right_end, next(sequence), right_start, right_index, right_record))
+            pointer += 1
+
+        # Close right intervals that ended before this one starts
+        while active and active[0][0] < left_start - tolerance:
+            heapq.heappop(active)
+
+        for right_end, _, right_start, right_index, right_record in active:
+            # Opened for an earlier, longer left interval, but starts after this one ends
+            if right_start > left_end + tolerance or right_end < left_start - tolerance:
+                continue
+            if accept is not None and not accept(left_record, right_record):
+                continue
+
+            score = overlap_ratio(left_start, left_end, right_start, right_end)
+            distance = abs((left_start - right_start).total_seconds())
+            yield score, distance, left_index, right_index, left_record, right_record
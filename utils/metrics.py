@@ -0,0 +1,246 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Phases every engine reports, in export order
+PHASES = ['fetch_teslalogger', 'fetch_teslamate', 'match', 'write']
+
+# Engine metrics and phase of the current thread, used to attribute database round-trips
+_active = threading.local()
+
+def _peak_rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def count_round_trip(*args, **kwargs):
+    """
+    SQLAlchemy before_cursor_execute listener charging a statement to the active phase.
+    """
+    metrics = getattr(_active, 'metrics', None)
+    if metrics is not None:
+        metrics.add(getattr(_active, 'phase', None) or 'match', round_trips=1)
+
+class EngineMetrics:
+    """
+    Wall time, rows read and written, database round-trips and peak memory
+    per phase of one sync engine run.
+
+    Fetch and write time is measured where it happens. Matching is charged
+    with the rest of the engine's wall time, because the streaming engines
+    interleave it with fetching.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.phases = {phase: self._new_phase() for phase in PHASES}
+        self.started = None
+        self.duration = 0.0
+        self.merges = 0
+        self.error = None
+
+    def _new_phase(self):
+        return {'seconds': 0.0, 'rows_read': 0, 'rows_written': 0, 'round_trips': 0, 'peak_memory_bytes': 0}
+
+    def start(self):
+        """
+        Start the engine clock and attribute round-trips of this thread to the engine.
+        """
+        self.started = time.monotonic()
+        _active.metrics = self
+        _active.phase = None
+
+    def finish(self, merges=0, error=None):
+        """
+        Stop the engine clock and charge the remaining wall time to matching.
+        """
+        self.duration = time.monotonic() - self.started if self.started is not None else 0.0
+        self.merges = merges
+        self.error = repr(error) if error else None
+
+        with self.lock:
+            measured = sum(self.phases[phase]['seconds'] for phase in PHASES if phase != 'match')
+            self.phases['match']['seconds'] = max(self.duration - measured, 0.0)
+            self.phases['match']['peak_memory_bytes'] = max(self.phases['match']['peak_memory_bytes'], _peak_rss_bytes())
+
+        if getattr(_active, 'metrics', None) is self:
+            _active.metrics = None
+
+    def add(self, phase, seconds=0.0, rows_read=0, rows_written=0, round_trips=0):
+        with self.lock:
+            counters = self.phases.setdefault(phase, self._new_phase())
+            counters['seconds'] += seconds
+            counters['rows_read'] += rows_read
+            counters['rows_written'] += rows_written
+            counters['round_trips'] += round_trips
+            if seconds:
+                counters['peak_memory_bytes'] = max(counters['peak_memory_bytes'], _peak_rss_bytes())
+
+    def merge(self, phases):
+        """
+        Add the phase counters reported by a worker process.
+        """
+        for phase, counters in phases.items():
+            self.add(phase, counters['seconds'], counters['rows_read'],
+                     counters['rows_written'], counters['round_trips'])
+            with self.lock:
+                own = self.phases[phase]
+                own['peak_memory_bytes'] = max(own['peak_memory_bytes'], counters['peak_memory_bytes'])
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Charge the wall time and round-trips of a block to a phase.
+        """
+        previous = getattr(_active, 'phase', None)
+        _active.phase = phase
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            _active.phase = previous
+            self.add(phase, seconds=time.perf_counter() - started)
+
+    def timed(self, phase, iterable, rows=None):
+        """
+        Yield from an iterable, charging the time spent producing each item to a phase.
+
+        :param rows: Optional function returning the number of rows in an item, defaults to one per item
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.add(phase, rows_read=rows(item) if rows else 1)
+            yield item
+
+    def snapshot(self):
+        with self.lock:
+            return {phase: dict(counters) for phase, counters in self.phases.items()}
+
+    def to_dict(self):
+        phases = self.snapshot()
+        for counters in phases.values():
+            rows = counters['rows_read'] or counters['rows_written']
+            counters['rows_per_second'] = round(rows / counters['seconds'], 1) if counters['seconds'] else 0.0
+            counters['seconds'] = round(counters['seconds'], 6)
+
+        return {
+            'duration_seconds': round(self.duration, 6),
+            'merges': self.merges,
+            'success': self.error is None,
+            'error': self.error,
+            'phases': phases,
+        }
+
+class RunMetrics:
+    """
+    Metrics of a whole sync run, exported as JSON and as a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.engines = {}
+        self.pools = {}
+        self.functions = {}  # Sampled function timings, see utils.profiling
+        self.startup = {}  # Seconds from process start to each startup stage
+        self.lock = threading.Lock()
+
+    def engine(self, name):
+        with self.lock:
+            if name not in self.engines:
+                self.engines[name] = EngineMetrics(name)
+            return self.engines[name]
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'finished': time.time(),
+            'engines': {name: metrics.to_dict() for name, metrics in self.engines.items()},
+            'pools': self.pools,
+            'functions': self.functions,
+            'startup': {stage: round(seconds, 6) for stage, seconds in self.startup.items()},
+        }
+
+    def write_json(self, path):
+        """
+        Write the run summary as JSON.
+        """
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2, default=str) + "\n")
+
+    def write_prometheus(self, path):
+        """
+        Write the run summary in the node_exporter textfile collector format.
+        """
+        summary = self.to_dict()
+        metrics = {
+            'duration_seconds': ('gauge', "Wall time of a sync phase in the last run"),
+            'rows_read': ('gauge', "Rows read by a sync phase in the last run"),
+            'rows_written': ('gauge', "Rows written by a sync phase in the last run"),
+            'rows_per_second': ('gauge', "Rows per second of a sync phase in the last run"),
+            'round_trips': ('gauge', "Database round-trips of a sync phase in the last run"),
+            'peak_memory_bytes': ('gauge', "Peak resident memory seen during a sync phase in the last run"),
+        }
+        keys = {'duration_seconds': 'seconds'}
+
+        lines = []
+        for metric, (kind, help_text) in metrics.items():
+            name = f"tesla_sync_phase_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for engine, engine_summary in summary['engines'].items():
+                for phase, counters in engine_summary['phases'].items():
+                    value = counters[keys.get(metric, metric)]
+                    lines.append(f'{name}{{engine="{engine}",phase="{phase}"}} {value}')
+
+        engine_metrics = {
+            'duration_seconds': "Wall time of a sync engine in the last run",
+            'merges': "Potential merges found by a sync engine in the last run",
+            'success': "Whether a sync engine completed without error in the last run",
+        }
+        for metric, help_text in engine_metrics.items():
+            name = f"tesla_sync_engine_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for engine, engine_summary in summary['engines'].items():
+                lines.append(f'{name}{{engine="{engine}"}} {int(engine_summary[metric]) if metric == "success" else engine_summary[metric]}')
+
+        pool_metrics = {
+            'checkouts': "Connection pool checkouts in the last run",
+            'wait_seconds_total': "Time spent waiting for pooled connections in the last run",
+            'wait_seconds_max': "Longest wait for a pooled connection in the last run",
+        }
+        for metric, help_text in pool_metrics.items():
+            name = f"tesla_sync_pool_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for database, counters in summary['pools'].items():
+                lines.append(f'{name}{{database="{database}"}} {counters[metric]}')
+
+        lines.append("# HELP tesla_sync_startup_seconds Seconds from process start to a startup stage in the last run")
+        lines.append("# TYPE tesla_sync_startup_seconds gauge")
+        for stage, seconds in summary['startup'].items():
+            lines.append(f'tesla_sync_startup_seconds{{stage="{stage}"}} {seconds}')
+
+        lines.append("# HELP tesla_sync_last_run_timestamp_seconds Unix time the last run finished")
+        lines.append("# TYPE tesla_sync_last_run_timestamp_seconds gauge")
+        lines.append(f"tesla_sync_last_run_timestamp_seconds {summary['finished']:.0f}")
+
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+def _write_atomic(path, content):
+    # Write to a temporary file and rename, so collectors never read a partial file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as handle:
+        handle.write(content)
+    os.replace(temporary, path)
@@ -0,0 +1,147 @@
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Fraction of calls timed by sampled_timer, 0 disables sampling
+_sample_rate = 0.0
+_timings = {}
+_timings_lock = threading.Lock()
+
+def configure_sampling(rate):
+    """
+    Set the fraction of calls (0 to 1) that sampled_timer measures.
+    """
+    global _sample_rate
+    _sample_rate = max(0.0, min(float(rate), 1.0))
+
+def _record(name, seconds):
+    with _timings_lock:
+        timing = _timings.setdefault(name, {'sampled_calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        timing['sampled_calls'] += 1
+        timing['seconds'] += seconds
+        timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+def function_timings():
+    """
+    Return {function: timing} for every sampled call so far.
+    """
+    with _timings_lock:
+        return {
+            name: {
+                'sampled_calls': timing['sampled_calls'],
+                'seconds': round(timing['seconds'], 6),
+                'avg_seconds': round(timing['seconds'] / timing['sampled_calls'], 6),
+                'max_seconds': round(timing['max_seconds'], 6),
+            }
+            for name, timing in _timings.items()
+        }
+
+def sampled_timer(func):
+    """
+    Time a random sample of calls to a function.
+
+    Unsampled calls only cost a comparison. For generator functions the
+    time spent producing items is measured across the whole iteration.
+    """
+    name = func.__qualname__
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            if not _sample_rate or random.random() >= _sample_rate:
+                return func(*args, **kwargs)
+            return _timed_generator(name, func(*args, **kwargs))
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _sample_rate or random.random() >= _sample_rate:
+            return func(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter() - started)
+    return wrapper
+
+def _timed_generator(name, generator):
+    # Only time spent inside the generator counts, not the consumer's work between items
+    elapsed = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        _record(name, elapsed)
+
+@contextmanager
+def profile_run(name, directory, trace_memory=False, top=25):
+    """
+    Profile a block with cProfile, and optionally tracemalloc, writing reports to a directory.
+
+    Writes <name>-<timestamp>.pstats, a readable .txt summary and, with
+    trace_memory, a -alloc.txt of the top allocation sites.
+    """
+    logger = logging.getLogger(__name__)
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+    # tracemalloc is process wide, only the block that started it stops it
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiler is active in this process
+        logger.warning(f"Could not profile {name}: {e}")
+        profiler = None
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+        # Snapshot allocations before writing the reports adds its own
+        snapshot = None
+        if trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+
+        if profiler is not None:
+            profiler.dump_stats(f"{prefix}.pstats")
+
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(top)
+            with open(f"{prefix}.txt", 'w') as handle:
+                handle.write(summary.getvalue())
+            logger.info(f"Wrote profile for {name} to {prefix}.pstats")
+
+        if snapshot is not None:
+            with open(f"{prefix}-alloc.txt", 'w') as handle:
+                handle.write(f"Traced memory: current {current / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB\n\n")
+                for statistic in snapshot.statistics('lineno')[:top]:
+                    handle.write(f"{statistic}\n")
+            logger.info(f"Wrote allocation report for {name} to {prefix}-alloc.txt")
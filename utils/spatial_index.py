@@ -0,0 +1,120 @@
+import math
+from collections import defaultdict
+import numpy as np
+from .helpers import haversine_distances, to_epoch_seconds
+
+# Length of one degree of latitude in meters
+METERS_PER_DEGREE = 6371.0 * 1000 * math.pi / 180
+
+# Safety margin applied to the equirectangular bound before rejecting a pair
+EQUIRECTANGULAR_MARGIN = 1.01
+
+
+class SpatioTemporalIndex:
+    """
+    Grid index bucketing points by (car_id, time bucket, lat cell, lng cell).
+
+    Cells are sized to the tolerances, so a lookup only visits the
+    neighbouring buckets instead of every point of the car. Pairs are
+    rejected with a cheap equirectangular bound, and the remaining pairs of a
+    batch of lookups are measured with one vectorized haversine call.
+    """
+
+    def __init__(self, time_tolerance, distance_tolerance):
+        self.time_tolerance = time_tolerance  # seconds
+        self.distance_tolerance = distance_tolerance  # meters
+        self.cell_size = distance_tolerance / METERS_PER_DEGREE  # degrees
+        self.buckets = defaultdict(list)
+        self.size = 0
+
+    def _time_bucket(self, seconds):
+        return math.floor(seconds / self.time_tolerance)
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def insert(self, car_id, timestamp, lat, lng, item):
+        """
+        Add a point to the index. Points without coordinates are ignored.
+        """
+        if lat is None or lng is None:
+            return
+
+        seconds = to_epoch_seconds(timestamp)
+        lat_cell, lng_cell = self._cell(lat, lng)
+        key = (car_id, self._time_bucket(seconds), lat_cell, lng_cell)
+        self.buckets[key].append((seconds, lat, lng, item))
+        self.size += 1
+
+    def candidates(self, car_id, timestamp, lat, lng):
+        """
+        Yield the (seconds, lat, lng, item) entries stored in the neighbouring buckets.
+        """
+        seconds = to_epoch_seconds(timestamp)
+        time_bucket = self._time_bucket(seconds)
+        lat_cell, lng_cell = self._cell(lat, lng)
+
+        # Longitude cells shrink towards the poles, so widen the search accordingly
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + self.cell_size, 90.0))), 0.01)
+        lng_reach = math.ceil(1 / cos_lat)
+
+        # Near the antimeridian the neighbours sit in cells on the other side of it
+        lng_cells = [lng_cell]
+        if 180.0 - abs(lng) <= (lng_reach + 1) * self.cell_size:
+            lng_cells.append(self._cell(lat, lng - math.copysign(360.0, lng))[1])
+
+        for dt in (-1, 0, 1):
+            for dlat in (-1, 0, 1):
+                for center in lng_cells:
+                    for dlng in range(-lng_reach, lng_reach + 1):
+                        key = (car_id, time_bucket + dt, lat_cell + dlat, center + dlng)
+                        bucket = self.buckets.get(key)
+                        if bucket:
+                            yield from bucket
+
+    def query_many(self, car_id, timestamps, lats, lngs):
+        """
+        Return the list of items within both tolerances for every point.
+
+        Candidate pairs of all points are gathered first. Pairs outside a
+        cheap equirectangular bound are rejected in one vectorized pass, and
+        only the rest are measured with the exact haversine distance.
+        """
+        owners = []
+        other_lats = []
+        other_lngs = []
+        items = []
+
+        for owner, (timestamp, lat, lng) in enumerate(zip(timestamps, lats, lngs)):
+            if lat is None or lng is None:
+                continue
+
+            seconds = to_epoch_seconds(timestamp)
+            for other_seconds, other_lat, other_lng, item in self.candidates(car_id, seconds, lat, lng):
+                if abs(other_seconds - seconds) <= self.time_tolerance:
+                    owners.append(owner)
+                    other_lats.append(other_lat)
+                    other_lngs.append(other_lng)
+                    items.append(item)
+
+        hits = [[] for _ in range(len(timestamps))]
+        if not owners:
+            return hits
+
+        owners = np.asarray(owners)
+        lats = np.asarray(lats, dtype=float)[owners]
+        lngs = np.asarray(lngs, dtype=float)[owners]
+        other_lats = np.asarray(other_lats, dtype=float)
+        other_lngs = np.asarray(other_lngs, dtype=float)
+
+        # Equirectangular bound in degrees, using the cosine nearest the pole so it never rejects too much
+        reach = self.distance_tolerance * EQUIRECTANGULAR_MARGIN / METERS_PER_DEGREE
+        dlng = np.abs(other_lngs - lngs)
+        dlng = np.minimum(dlng, 360.0 - dlng) * np.cos(np.radians(np.minimum(np.abs(lats) + reach, 90.0)))
+        near = np.flatnonzero((other_lats - lats) ** 2 + dlng ** 2 <= reach * reach)
+
+        within = haversine_distances(lats[near], lngs[near], other_lats[near], other_lngs[near]) <= self.distance_tolerance
+        matched = near[within]
+        for owner, index in zip(owners[matched].tolist(), matched.tolist()):
+            hits[owner].append(items[index])
+        return hits
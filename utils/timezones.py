@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+import numpy as np
+
+# Naive timestamps are epoch seconds counted from here, like PositionBatch
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+# Years covered by the transition tables
+FIRST_YEAR = 1990
+LAST_YEAR = 2060
+
+class UtcOffsets:
+    """
+    UTC offsets of a time zone as a table of transitions.
+
+    The table is built once from zoneinfo. Converting timestamps is then a
+    binary search into it, so whole arrays of local wall-clock seconds are
+    converted with one numpy call instead of a time zone lookup per row.
+    Local times inside the hour repeated when clocks go back are read as
+    the later, standard time occurrence.
+    """
+
+    def __init__(self, zone_name):
+        self.zone_name = zone_name
+        zone = ZoneInfo(zone_name)
+
+        def offset(utc_seconds):
+            moment = datetime.fromtimestamp(utc_seconds, timezone.utc).astimezone(zone)
+            return int(moment.utcoffset().total_seconds())
+
+        # Walk the covered years a day at a time, bisecting every day the offset changes in
+        utc_starts = [_seconds(datetime(FIRST_YEAR, 1, 1))]
+        offsets = [offset(utc_starts[0])]
+        day = 86400
+        for day_start in range(utc_starts[0], _seconds(datetime(LAST_YEAR, 1, 1)), day):
+            if offset(day_start + day) == offsets[-1]:
+                continue
+            low, high = day_start, day_start + day
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset(middle) == offsets[-1]:
+                    low = middle
+                else:
+                    high = middle
+            utc_starts.append(high)
+            offsets.append(offset(high))
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.utc_starts = np.array(utc_starts, dtype=np.int64)
+        # Local wall-clock second at which each offset starts to apply
+        self.local_starts = self.utc_starts + self.offsets
+
+    def to_utc(self, local_seconds):
+        """
+        Convert an array of local epoch seconds to UTC epoch seconds.
+        """
+        local_seconds = np.asarray(local_seconds, dtype=np.int64)
+        index = np.maximum(np.searchsorted(self.local_starts, local_seconds, side='right') - 1, 0)
+        return local_seconds - self.offsets[index]
+
+    def to_local(self, utc_seconds):
+        """
+        Convert an array of UTC epoch seconds to local epoch seconds.
+        """
+        utc_seconds = np.asarray(utc_seconds, dtype=np.int64)
+        index = np.maximum(np.searchsorted(self.utc_starts, utc_seconds, side='right') - 1, 0)
+        return utc_seconds + self.offsets[index]
+
+    def utc_datetime(self, local):
+        """
+        Convert one naive local datetime to a naive UTC datetime.
+        """
+        return local + timedelta(seconds=int(self.to_utc(_seconds(local))) - _seconds(local))
+
+    def local_datetime(self, utc):
+        """
+        Convert one naive UTC datetime to a naive local datetime.
+        """
+        return utc + timedelta(seconds=int(self.to_local(_seconds(utc))) - _seconds(utc))
+
+@lru_cache(maxsize=None)
+def utc_offsets(zone_name):
+    """
+    Return the cached UtcOffsets table of a time zone, or None for an empty name.
+    """
+    return UtcOffsets(zone_name) if zone_name else None
+
+def records_to_utc(pages, keys, offsets):
+    """
+    Convert the local datetime fields of every record in a page stream to UTC.
+
+    Each field of a page is converted in one vectorized call.
+    """
+    for page in pages:
+        if offsets is not None:
+            for key in keys:
+                records = [record for record in page if record.get(key) is not None]
+                if not records:
+                    continue
+                converted = offsets.to_utc([_seconds(record[key]) for record in records])
+                for record, seconds in zip(records, converted.tolist()):
+                    record[key] = EPOCH + timedelta(seconds=seconds, microseconds=record[key].microsecond)
+        yield page
+
+def _seconds(timestamp):
+    # Whole epoch seconds of a naive datetime
+    return (timestamp - EPOCH) // ONE_SECOND